@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较冷启动（解释core.fs）和从启动镜像启动的耗时。
+
+用法: python -m bench.boot [-n 20]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from t4th import t4th
+
+
+def _boot(n):
+    start = time.perf_counter()
+    for _ in range(n):
+        vm = t4th.T4th()
+        vm._load_core_fs()
+    return (time.perf_counter() - start) / n
+
+
+def _process(n, env):
+    main_py = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+    start = time.perf_counter()
+    for _ in range(n):
+        subprocess.run([sys.executable, main_py], input=b'bye\n', stdout=subprocess.DEVNULL, env=env, check=True)
+    return (time.perf_counter() - start) / n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=20, help='iterations')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with patch.dict('os.environ', {'T4TH_CACHE_DIR': ''}):
+            cold = _boot(args.n)
+            cold_process = _process(max(1, args.n // 4), dict(os.environ))
+        with patch.dict('os.environ', {'T4TH_CACHE_DIR': cache_dir}):
+            _boot(1) # 生成镜像
+            cached = _boot(args.n)
+            cached_process = _process(max(1, args.n // 4), dict(os.environ))
+
+    print(f'in-process boot: cold {cold * 1000:.1f}ms, cached {cached * 1000:.1f}ms, {cold / cached:.1f}x')
+    print(f'process startup: cold {cold_process * 1000:.1f}ms, cached {cached_process * 1000:.1f}ms, {cold_process / cached_process:.1f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较整段内存的原语（MOVE、CMOVE、FILL、ERASE、COMPARE）和逐个字符的Forth循环，
+在64K字符的缓冲区上复制、填充和比较。
+
+用法: python -m bench.bulk [--size 65536] [-n 5]
+"""
+
+import argparse
+import sys
+import time
+
+from t4th import t4th
+
+SETUP = """
+: cmove-loop ( a1 a2 u -- ) 0 ?do over i + c@ over i + c! loop 2drop ;
+: fill-loop ( a u c -- ) -rot 0 ?do 2dup c! 1+ loop 2drop ;
+: compare-loop ( a1 a2 u -- n ) 0 ?do over i + c@ over i + c@ - ?dup if nip nip unloop exit then loop 2drop 0 ;
+"""
+
+# (名字, 原语, Forth循环)。按顺序执行，比较时两个缓冲区的内容相同
+CASES = (
+    ('fill',    'buf1 size char x fill',      'buf1 size char x fill-loop'),
+    ('erase',   'buf2 size erase',            'buf2 size 0 fill-loop'),
+    ('move',    'buf1 buf2 size move',        'buf1 buf2 size cmove-loop'),
+    ('cmove',   'buf1 buf2 size cmove',       'buf1 buf2 size cmove-loop'),
+    ('compare', 'buf1 size buf2 size compare drop', 'buf1 buf2 size compare-loop drop'),
+)
+
+
+def _time(vm, source, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        vm.eval(source)
+    return (time.perf_counter() - start) / n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=65536, help='characters per buffer')
+    parser.add_argument('-n', type=int, default=5, help='repetitions')
+    args = parser.parse_args(argv)
+
+    vm = t4th.T4th(memory_size=2 * args.size + 65536)
+    vm._load_core_fs()
+    vm.eval(SETUP)
+    vm.eval(f'{args.size} constant size create buf1 size allot create buf2 size allot')
+
+    for (name, native, loop) in CASES:
+        fast = _time(vm, native, args.n)
+        slow = _time(vm, loop, 1)
+        print(f'{name:8} native {fast * 1000:8.2f} ms   loop {slow * 1000:8.1f} ms   {slow / fast:7.0f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较CASE的跳转表和逐个比较的OF链：一个有256个操作码的CASE，对每个操作码各分派若干次。
+逐个比较的版本用core.fs中原来的Forth定义（改名为LCASE、LOF、LENDOF、LENDCASE），
+窥孔优化照常把OVER = 0BRANCH融合成一条指令。
+
+用法: python -m bench.case [--opcodes 256] [--rounds 100] [-n 3]
+"""
+
+import argparse
+import sys
+import time
+
+from t4th import t4th
+
+LINEAR = """
+: lcase  0 ; immediate
+: lof    postpone over postpone = postpone if postpone drop ; immediate
+: lendcase postpone drop begin ?dup while postpone then repeat ; immediate
+: lendof postpone else ; immediate
+"""
+
+
+def _decoder(name, prefix, opcodes):
+    clauses = '\n'.join(f'{op} {prefix}of {op} 3 * {prefix}endof' for op in range(opcodes))
+    return f': {name} ( op -- x ) {prefix}case {clauses} 0 swap {prefix}endcase ;'
+
+
+def _time(vm, source, n):
+    best = None
+    for _ in range(n):
+        start = time.perf_counter()
+        result = vm.eval(source)
+        elapsed = time.perf_counter() - start
+        vm.eval('drop')
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result.stack)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--opcodes', type=int, default=256, help='OF clauses in the CASE')
+    parser.add_argument('--rounds', type=int, default=100, help='dispatches per opcode')
+    parser.add_argument('-n', type=int, default=3, help='repetitions, the best is reported')
+    args = parser.parse_args(argv)
+
+    vm = t4th.T4th()
+    vm._load_core_fs()
+    vm.eval(LINEAR)
+    vm.eval(_decoder('table-decode', '', args.opcodes))
+    vm.eval(_decoder('linear-decode', 'l', args.opcodes))
+    for name in ('table', 'linear'):
+        vm.eval(f': run-{name} 0 {args.rounds} 0 do {args.opcodes + 1} 0 do i {name}-decode + loop loop ;')
+
+    (table, table_stack) = _time(vm, 'run-table', args.n)
+    (linear, linear_stack) = _time(vm, 'run-linear', args.n)
+    assert table_stack == linear_stack, (table_stack, linear_stack)
+    dispatches = args.rounds * (args.opcodes + 1)
+    print(f'{dispatches} dispatches over {args.opcodes} opcodes')
+    print(f'jump table {table * 1000:8.1f} ms   linear {linear * 1000:8.1f} ms   {linear / table:5.1f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较线索执行和编译成闭包（compile_closures=True）的执行速度。
+
+用法: python -m bench.closures [-n 3]
+"""
+
+import argparse
+import sys
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from t4th import t4th
+
+WORKLOADS = {
+    'do-loop': ': run 0 200000 0 do i + loop drop ;',
+    'nested-loop': ': run 300 0 do 300 0 do i j + drop loop loop ;',
+    'begin-while': ': run 100000 begin dup while 1- repeat drop ;',
+    'fib': ': fib dup 2 < if drop 1 else dup 1- recurse swap 2 - recurse + then ; : run 20 fib drop ;',
+    # 很多跳转目标，分派的开销随块数增加
+    'if-chain': ': run 50000 0 do i 7 and ' + ' '.join(f'dup {k} = if drop {k} else' for k in range(7)) +
+                ' drop 7' + ' then' * 7 + ' drop loop ;',
+}
+
+
+def _time(options, source, n):
+    vm = t4th.T4th(**options)
+    vm._load_core_fs()
+    with patch('sys.stdout', new=StringIO()):
+        vm._in_stream = StringIO(source + '\n')
+        vm.interpret()
+        best = None
+        for _ in range(n):
+            vm._in_stream = StringIO('run\n')
+            start = time.perf_counter()
+            vm.interpret()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=3, help='iterations, the best one is reported')
+    args = parser.parse_args(argv)
+
+    for (name, source) in WORKLOADS.items():
+        threaded = _time({}, source, args.n)
+        compiled = _time({'compile_closures': True}, source, args.n)
+        print(f'{name:12} threaded {threaded:.3f}s, closures {compiled:.3f}s, {threaded / compiled:.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较core.fs中的Forth定义和加速核心（accelerated_core=True）的执行速度。
+
+用法: python -m bench.core [-n 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from t4th import t4th
+
+WORKLOADS = {
+    'stack': ': run 100000 0 do 1 2 3 rot -rot nip tuck 2dup 2swap 2over 2drop 2drop 2drop drop loop ;',
+    'compare': ': run 0 100000 0 do i 500 > i 700 <> and i 3 = or + loop drop ;',
+    'arith': ': run 0 100000 0 do i 1+ 1- negate abs 1000 min -5 max + loop drop ;',
+    'memory': 'variable v : run 0 v ! 100000 0 do i v +! v cell+ c@ drop loop ;',
+}
+
+
+def _time(options, source, n):
+    vm = t4th.T4th(**options)
+    vm._load_core_fs()
+    with patch('sys.stdout', new=StringIO()):
+        vm._in_stream = StringIO(source + '\n')
+        vm.interpret()
+        best = None
+        for _ in range(n):
+            vm._in_stream = StringIO('run\n')
+            start = time.perf_counter()
+            vm.interpret()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _time_test_core(options):
+    # 跑一遍tests/test_core.fs
+    tests_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests')
+    vm = t4th.T4th(**options)
+    vm._load_core_fs()
+    with patch('sys.stdout', new=StringIO()):
+        vm.load_and_run_file(os.path.join(tests_dir, 'ttester.fs'))
+        start = time.perf_counter()
+        vm.load_and_run_file(os.path.join(tests_dir, 'test_core.fs'))
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=3, help='iterations, the best one is reported')
+    args = parser.parse_args(argv)
+
+    for (name, source) in WORKLOADS.items():
+        forth = _time({'accelerated_core': False}, source, args.n)
+        native = _time({'accelerated_core': True}, source, args.n)
+        print(f'{name:12} forth {forth:.3f}s, accelerated {native:.3f}s, {forth / native:.2f}x')
+
+    forth = _time_test_core({'accelerated_core': False})
+    native = _time_test_core({'accelerated_core': True})
+    print(f'{"test_core.fs":12} forth {forth:.3f}s, accelerated {native:.3f}s, {forth / native:.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较原生的定义词（CONSTANT、VALUE、2CONSTANT、DEFER）和用CREATE ... DOES>定义的同样的词，
+在循环中反复读取常量、值和调用延迟词。
+
+用法: python -m bench.defining [--iterations 200000] [-n 3]
+"""
+
+import argparse
+import sys
+import time
+
+from t4th import t4th
+
+SETUP = """
+: does-constant create , does> @ ;
+: does-2constant create , , does> 2@ ;
+: does-defer create ['] abort , does> @ execute ;
+: nop ;
+
+7 constant c1          7 does-constant c2
+7 value v1             7 does-constant v2
+1 2 2constant p1       1 2 does-2constant p2
+defer d1  ' nop is d1  does-defer d2  ' nop ' d2 >body !
+
+: constants ( n -- ) 0 do c1 c1 2drop loop ;      : does-constants ( n -- ) 0 do c2 c2 2drop loop ;
+: values ( n -- ) 0 do v1 v1 2drop loop ;         : does-values ( n -- ) 0 do v2 v2 2drop loop ;
+: 2constants ( n -- ) 0 do p1 2drop loop ;        : does-2constants ( n -- ) 0 do p2 2drop loop ;
+: defers ( n -- ) 0 do d1 d1 loop ;               : does-defers ( n -- ) 0 do d2 d2 loop ;
+"""
+
+CASES = ('constants', 'values', '2constants', 'defers')
+
+
+def _time(vm, source, n):
+    best = None
+    for _ in range(n):
+        start = time.perf_counter()
+        vm.eval(source)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000, help='loop iterations per case')
+    parser.add_argument('-n', type=int, default=3, help='repetitions, the best is reported')
+    args = parser.parse_args(argv)
+
+    vm = t4th.T4th()
+    vm._load_core_fs()
+    vm.eval(SETUP)
+
+    for name in CASES:
+        fast = _time(vm, f'{args.iterations} {name}', args.n)
+        slow = _time(vm, f'{args.iterations} does-{name}', args.n)
+        print(f'{name:12} native {fast * 1000:8.1f} ms   does> {slow * 1000:8.1f} ms   {slow / fast:5.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
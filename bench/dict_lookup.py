@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""编译一个包含大量定义的源文件，比较哈希索引查词和原来的链表遍历查词。
+
+链表遍历是平方复杂度，所以对比默认在较小的规模上进行。
+
+用法: python -m bench.dict_lookup [--defs 10000] [--compare-defs 2000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from t4th import t4th
+
+
+def _linear_find_word_ptr(self, word_name:str) -> int:
+    # 原来的实现：沿着prev链逐个比较
+    word_name = word_name.upper()
+    p = self._latest_word_ptr
+    if self._get_var_value('STATE') != 0:
+        p = self._memory[p].prev
+
+    while p > 0 and self._memory[p].word_name != word_name:
+        p = self._memory[p].prev
+    return p
+
+
+def _make_source(path, n):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(': w0 1 ;\n')
+        for i in range(1, n):
+            f.write(f': w{i} w{i - 1} dup + 2 / ;\n')
+
+
+def _compile(path, memory_size):
+    vm = t4th.T4th(memory_size=memory_size)
+    vm._load_core_fs()
+    start = time.perf_counter()
+    with patch('sys.stdout', new=StringIO()):
+        vm.load_and_run_file(path)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--defs', type=int, default=10000)
+    parser.add_argument('--compare-defs', type=int, default=2000,
+                        help='size of the hash/linear comparison run, 0 to skip')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'defs.fs')
+        _make_source(path, args.defs)
+        indexed = _compile(path, 65536 + args.defs * 16)
+        print(f'hash index : {args.defs} definitions in {indexed:.3f}s')
+
+        if args.compare_defs > 0:
+            n = args.compare_defs
+            _make_source(path, n)
+            indexed = _compile(path, 65536 + n * 16)
+            with patch.object(t4th.T4th, '_find_word_ptr', _linear_find_word_ptr):
+                linear = _compile(path, 65536 + n * 16)
+            print(f'hash index : {n} definitions in {indexed:.3f}s')
+            print(f'linear walk: {n} definitions in {linear:.3f}s')
+            print(f'speedup    : {linear / indexed:.1f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
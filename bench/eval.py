@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较从Python执行一小段Forth代码的两种方式：
+替换sys.stdin/sys.stdout后调用interpret()，和T4th.eval()。
+
+用法: python -m bench.eval [-n 3000]
+"""
+
+import argparse
+import sys
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from t4th import t4th
+
+SETUP = ': count-up 0 10 0 do i + loop ;'
+SOURCE = '1 2 + 3 * . count-up'
+
+
+def _patched(vm, source):
+    with patch('sys.stdin', new=StringIO(source)), \
+         patch('sys.stdout', new=StringIO()) as stdout:
+        vm._in_stream = StringIO(source + '\n')
+        vm.interpret()
+        return (stdout.getvalue(), list(vm._data_stack))
+
+
+def _eval(vm, source):
+    result = vm.eval(source)
+    return (result.output, result.stack)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=3000, help='evaluations')
+    args = parser.parse_args(argv)
+
+    vm = t4th.T4th()
+    vm._load_core_fs()
+    vm.eval(SETUP)
+
+    for (name, fn) in (('patched', _patched), ('eval', _eval)):
+        start = time.perf_counter()
+        for _ in range(args.n):
+            (output, stack) = fn(vm, SOURCE)
+            assert '9 ' in output and stack == [45], (output, stack)
+            vm._data_stack.clear()
+        elapsed = time.perf_counter() - start
+        print(f'{name:8} {args.n / elapsed:8.0f} evaluations/s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较关闭和打开内联（inline_threshold）时的执行速度。
+
+用法: python -m bench.inline [-n 3]
+"""
+
+import argparse
+import sys
+
+from bench.closures import _time
+
+WORKLOADS = {
+    'small-words': ': sq dup * ; : inc 1 + ; : run 0 100000 0 do i sq inc + loop drop ;',
+    'core-words': ': run 0 100000 0 do i cells char+ 2* + loop drop ;',
+    'empty': ': nop ; : run 100000 0 do nop nop nop loop ;',
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=3, help='iterations, the best one is reported')
+    args = parser.parse_args(argv)
+
+    for (name, source) in WORKLOADS.items():
+        plain = _time({'inline_threshold': None}, source, args.n)
+        inlined = _time({}, source, args.n)
+        print(f'{name:12} calls {plain:.3f}s, inlined {inlined:.3f}s, {plain / inlined:.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较DO循环的参数放在单独的循环栈（整数列表）中和放在返回栈（tn.memory）中的速度，
+后者用原来的实现，在子类中替换循环词。
+
+用法: python -m bench.loops [--iterations 300000] [-n 3]
+"""
+
+import argparse
+import sys
+import time
+
+from t4th import t4th
+import t4th.t4th_num as tn
+
+SETUP = """
+: loop1 ( n -- x ) 0 swap 0 do i xor loop ;
+: loop2 ( n -- x ) 0 swap 0 do i + 3 +loop ;
+: loop3 ( n -- x ) 0 swap 100 / 0 do 100 0 do i j + xor loop loop ;
+: loop4 ( n -- x ) 0 swap 10 / 0 do 10 0 do i 5 > if leave then loop i + loop ;
+"""
+
+CASES = (
+    ('loop', 'loop1'),
+    ('+loop', 'loop2'),
+    ('nested i j', 'loop3'),
+    ('leave', 'loop4'),
+)
+
+
+class _ReturnStackLoops(t4th.T4th):
+    # 原来的实现：每层循环在返回栈上压三个单元
+
+    def _do_runtime(self, leave_addr):
+        index = self._data_stack.pop()
+        limit = self._data_stack.pop()
+        self._return_stack.append(leave_addr)
+        self._return_stack.append(limit)
+        self._return_stack.append(index)
+
+    def _question_do_runtime(self, leave_addr) -> bool:
+        index = self._data_stack.pop()
+        limit = self._data_stack.pop()
+        if limit == index:
+            return False
+        self._return_stack.append(leave_addr)
+        self._return_stack.append(limit)
+        self._return_stack.append(index)
+        return True
+
+    def _loop_runtime(self) -> bool:
+        self._check_return_stack(3)
+        index = tn.wrap(self._return_stack[-1] + 1)
+        if index < self._return_stack[-2]:
+            self._return_stack[-1] = index
+            return True
+        self._return_stack.pop()
+        self._return_stack.pop()
+        self._return_stack.pop()
+        return False
+
+    def _plus_loop_runtime(self) -> bool:
+        self._check_return_stack(3)
+        index = self._return_stack[-1]
+        limit = self._return_stack[-2]
+        self._check_stack(1)
+        step = self._data_stack.pop()
+        old_index = index
+        index = tn.wrap(index + step)
+        if not ((step > 0 and tn.wrap(limit - old_index) > 0 and tn.wrap(index - limit) >= 0) or
+                (step < 0 and tn.wrap(limit - old_index) <= 0 and tn.wrap(index - limit) < 0)):
+            self._return_stack[-1] = index
+            return True
+        self._return_stack.pop()
+        self._return_stack.pop()
+        self._return_stack.pop()
+        return False
+
+    def _leave_runtime(self) -> int:
+        self._check_return_stack(3)
+        self._return_stack.pop()
+        self._return_stack.pop()
+        return self._return_stack.pop()
+
+    def _word_unloop(self):
+        self._check_return_stack(3)
+        self._return_stack.pop()
+        self._return_stack.pop()
+        self._return_stack.pop()
+
+    def _word_i(self):
+        self._check_return_stack(3)
+        self._data_stack.append(self._return_stack[-1])
+
+    def _word_j(self):
+        self._check_return_stack(6)
+        self._data_stack.append(self._return_stack[-4])
+
+
+def _time(vm, source, n):
+    best = None
+    for _ in range(n):
+        start = time.perf_counter()
+        result = vm.eval(source)
+        elapsed = time.perf_counter() - start
+        vm.eval('drop')
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result.stack)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=300000, help='loop iterations per case')
+    parser.add_argument('-n', type=int, default=3, help='repetitions, the best is reported')
+    args = parser.parse_args(argv)
+
+    vms = []
+    for cls in (_ReturnStackLoops, t4th.T4th):
+        vm = cls()
+        vm._load_core_fs()
+        vm.eval(SETUP)
+        vms.append(vm)
+
+    for (name, word) in CASES:
+        source = f'{args.iterations} {word}'
+        (old, old_stack) = _time(vms[0], source, args.n)
+        (new, new_stack) = _time(vms[1], source, args.n)
+        assert old_stack == new_stack, (name, old_stack, new_stack)
+        print(f'{name:12} return stack {old * 1000:8.1f} ms   loop stack {new * 1000:8.1f} ms   {old / new:5.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较 tn.memory（list）和 tn.cell_memory（array + 对象表）的内存占用和存取速度。
+
+用法: python -m bench.memory [--cells 65536]
+"""
+
+import argparse
+import sys
+import timeit
+import tracemalloc
+
+import t4th.t4th_num as tn
+
+
+def _footprint(make, n):
+    tracemalloc.start()
+    m = make(n)
+    for i in range(n):
+        m[i] = i * 7 - n # 每个单元的值都不同
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (m, size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cells', type=int, default=65536)
+    args = parser.parse_args(argv)
+    n = args.cells
+
+    for (name, make) in (('memory', tn.memory), ('cell_memory', tn.cell_memory)):
+        (m, size) = _footprint(make, n)
+        fetch = min(timeit.repeat(lambda: m[1234], number=200000, repeat=3)) / 200000
+        store = min(timeit.repeat(lambda: m.__setitem__(1234, 42), number=200000, repeat=3)) / 200000
+        print(f'{name:12} {size / n:6.1f} bytes/cell, fetch {fetch * 1e9:5.0f}ns, store {store * 1e9:5.0f}ns')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较原来基于ctypes的单元运算和现在基于普通整数的单元运算，以及跑一段算术密集的Forth代码。
+
+用法: python -m bench.num [--number 200000]
+"""
+
+import argparse
+import sys
+import time
+import timeit
+from ctypes import c_int32, c_uint32, c_int64
+from io import StringIO
+from unittest.mock import patch
+
+import t4th.t4th_num as tn
+from t4th import t4th
+
+
+def _ctypes_ops():
+    return {
+        'wrap': lambda: c_int32(0x7FFFFFFF + 12345).value,
+        'add': lambda: c_int32(c_int32(123456).value + c_int32(-7890).value).value,
+        'rshift': lambda: c_int32(c_uint32(-12345).value >> 3).value,
+        'm*': lambda: (lambda d: (c_int32(d & 0xFFFFFFFF).value, c_int32(d >> 32).value))(
+            c_int32(123456).value * c_int32(-7890).value),
+        'fm/mod': lambda: (lambda d: (c_int32(d % 77).value, c_int32(d // 77).value))(
+            c_int64(c_uint32(-12345).value + (c_uint32(-1).value << 32)).value),
+    }
+
+
+def _int_ops():
+    return {
+        'wrap': lambda: tn.wrap(0x7FFFFFFF + 12345),
+        'add': lambda: tn.wrap(123456 + -7890),
+        'rshift': lambda: tn.wrap(tn.i2u(-12345) >> 3),
+        'm*': lambda: tn.I(123456).m_star(-7890),
+        'fm/mod': lambda: tn.I(77).fm_mod(-12345, -1),
+    }
+
+
+_SCRIPT = ': bench 0 200000 0 do i 3 * + 7 xor 1 rshift loop drop ; bench'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=200000)
+    args = parser.parse_args(argv)
+    n = args.number
+
+    ref = _ctypes_ops()
+    new = _int_ops()
+    for name in ref:
+        t_ref = min(timeit.repeat(ref[name], number=n, repeat=3)) / n
+        t_new = min(timeit.repeat(new[name], number=n, repeat=3)) / n
+        print(f'{name:8} ctypes {t_ref * 1e9:6.0f}ns, int {t_new * 1e9:6.0f}ns ({t_ref / t_new:4.1f}x)')
+
+    vm = t4th.T4th()
+    vm._load_core_fs()
+    with patch('sys.stdout', new=StringIO()):
+        vm._in_stream = StringIO(_SCRIPT + '\n')
+        start = time.perf_counter()
+        vm.interpret()
+    print(f'forth loop {time.perf_counter() - start:.3f}s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
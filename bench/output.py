@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较每次输出都写出（buffer_size=1，相当于原来的print(..., flush=True)）和缓冲输出的速度。
+输出写到临时文件。
+
+用法: python -m bench.output [-n 3]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from io import BytesIO, TextIOWrapper
+
+from t4th import t4th
+from t4th.output import OutputSink
+
+WORKLOADS = {
+    'emit': ': run 20000 0 do [char] * emit loop cr ;',
+    'dot': ': run 20000 0 do i . loop cr ;',
+    'type': ': run 2000 0 do s" hello, world" type cr loop ;',
+}
+
+
+def _input(source):
+    # 像管道一样的输入，不回显提示符
+    return TextIOWrapper(BytesIO((source + '\n').encode()))
+
+
+def _time(buffer_size, source, n):
+    best = None
+    with tempfile.TemporaryFile('w') as f:
+        vm = t4th.T4th(output=OutputSink(f, buffer_size=buffer_size, line_buffered=False))
+        vm._load_core_fs()
+        vm._in_stream = _input(source)
+        vm.interpret()
+        for _ in range(n):
+            vm._in_stream = _input('run')
+            start = time.perf_counter()
+            vm.interpret()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=3, help='iterations, the best one is reported')
+    args = parser.parse_args(argv)
+
+    for (name, source) in WORKLOADS.items():
+        unbuffered = _time(1, source, args.n)
+        buffered = _time(8192, source, args.n)
+        print(f'{name:12} unbuffered {unbuffered:.3f}s, buffered {buffered:.3f}s, {unbuffered / buffered:.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""外层解释器的解析速度：解释core.fs，以及一个生成的大源文件（定义、注释和字符串）。
+
+用法: python -m bench.parse [--lines 5000] [-n 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from t4th import t4th
+
+
+def _source(lines):
+    out = []
+    for i in range(lines):
+        out.append(f'\\ line {i}: a comment that the parser has to skip')
+        out.append(f': word{i}   ( n -- n )   {i} +   dup drop   ;  ( trailing comment )')
+        out.append(f'  s" string number {i}" 2drop   {i} word{i} drop')
+    return '\n'.join(out) + '\n'
+
+
+def _time_core(n):
+    best = None
+    with patch.dict('os.environ', {'T4TH_CACHE_DIR': ''}):
+        for _ in range(n):
+            vm = t4th.T4th()
+            start = time.perf_counter()
+            vm._load_core_fs()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _time_file(path, n):
+    best = None
+    for _ in range(n):
+        vm = t4th.T4th()
+        vm._load_core_fs()
+        with patch('sys.stdout', new=StringIO()):
+            start = time.perf_counter()
+            vm.load_and_run_file(path)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=5000)
+    parser.add_argument('-n', type=int, default=3, help='iterations, the best one is reported')
+    args = parser.parse_args(argv)
+
+    print(f'core.fs       {_time_core(args.n):.3f}s')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'big.fs')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(_source(args.lines))
+        print(f'{args.lines * 3} lines   {_time_file(path, args.n):.3f}s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较关闭和打开窥孔优化（peephole=True）时的执行速度。
+
+用法: python -m bench.peephole [-n 3]
+"""
+
+import argparse
+import sys
+
+from bench.closures import _time
+
+WORKLOADS = {
+    'literal': ': run 0 100000 0 do 3 + 1 - loop drop ;',
+    # 选择值是VALUE，不编译成跳转表，逐个用OVER = 0BRANCH比较
+    'case': '1 value one 2 value two 3 value three '
+            ': c case one of 10 endof two of 20 endof three of 30 endof 0 swap endcase ; '
+            ': run 100000 0 do i 4 mod c drop loop ;',
+    'until': ': run 100000 begin 1- dup 0= until drop ;',
+    'if': ': run 0 100000 0 do i 3 and 0= if 1+ then loop drop ;',
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=3, help='iterations, the best one is reported')
+    args = parser.parse_args(argv)
+
+    for (name, source) in WORKLOADS.items():
+        plain = _time({'peephole': False}, source, args.n)
+        fused = _time({'peephole': True}, source, args.n)
+        print(f'{name:12} plain {plain:.3f}s, peephole {fused:.3f}s, {plain / fused:.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
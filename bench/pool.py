@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""用t4th.pool执行一批短任务，比较不同进程数的吞吐量。
+第一行是在当前进程中逐个执行（eval后恢复状态）的结果。
+
+用法: python -m bench.pool [--jobs 2000] [--processes 1,2,4]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from t4th import t4th
+from t4th.pool import Pool
+
+JOB = ': f 0 200 0 do i + loop ; f . : g 10 0 do i loop ; g'
+
+
+def _sequential(n):
+    vm = t4th.T4th()
+    vm._load_core_fs()
+    checkpoint = vm.checkpoint()
+    start = time.perf_counter()
+    for _ in range(n):
+        vm.eval(JOB)
+        vm.reset(checkpoint)
+    return time.perf_counter() - start
+
+
+def _pooled(n, processes):
+    with Pool(processes) as pool:
+        start = time.perf_counter()
+        for r in pool.run(JOB for _ in range(n)):
+            if r.error is not None:
+                raise RuntimeError(r.error)
+        return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=2000, help='number of jobs')
+    parser.add_argument('--processes', help='comma separated process counts, default 1 up to the number of CPUs')
+    args = parser.parse_args(argv)
+
+    if args.processes:
+        counts = [int(n) for n in args.processes.split(',')]
+    else:
+        cpus = os.cpu_count() or 1
+        counts = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+
+    elapsed = _sequential(args.jobs)
+    print(f'in-process   {args.jobs / elapsed:8.0f} jobs/s')
+    base = None
+    for n in counts:
+        rate = args.jobs / _pooled(args.jobs, n)
+        base = base or rate
+        print(f'{n:2} processes {rate:8.0f} jobs/s {rate / base:5.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
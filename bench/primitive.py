@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较用define_primitive定义的Python词和原语通常的写法（检查栈、逐个pop/append、复制内存）。
+
+用法: python -m bench.primitive [-n 3]
+"""
+
+import argparse
+import sys
+import time
+
+from t4th import t4th
+
+LOOP = ': run 20000 0 do {} loop ;'
+
+
+def _clamp(n, lo, hi):
+    return max(lo, min(n, hi))
+
+
+def _checksum(buf):
+    return sum(buf) & 0xFFFF
+
+
+def _define_naive(vm):
+    ds = vm._data_stack
+
+    def clamp():
+        vm._check_stack(3)
+        hi = ds.pop()
+        lo = ds.pop()
+        n = ds.pop()
+        ds.append(_clamp(n, lo, hi))
+
+    def checksum():
+        vm._check_stack(2)
+        n = ds.pop()
+        addr = ds.pop()
+        ds.append(_checksum(vm._memory.get_range(addr, addr + n)))
+
+    vm.define_primitive('clamp', lambda: None)
+    vm._memory[vm._find_word('clamp').ptr] = t4th.T4th._PrimitiveWord('CLAMP', clamp)
+    vm.define_primitive('checksum', lambda: None)
+    vm._memory[vm._find_word('checksum').ptr] = t4th.T4th._PrimitiveWord('CHECKSUM', checksum)
+
+
+def _define_batched(vm):
+    vm.define_primitive('clamp', _clamp, stack_in=3, stack_out=1)
+    vm.define_primitive('checksum', _checksum, stack_in=(memoryview,), stack_out=1)
+
+
+WORKLOADS = {
+    'clamp': 'i 100 200 clamp drop',
+    'checksum': 'buf 200 checksum drop',
+}
+
+
+def _time(define, body, n):
+    vm = t4th.T4th()
+    vm._load_core_fs()
+    define(vm)
+    vm.eval('create buf 200 allot buf 200 7 fill')
+    vm.eval(LOOP.format(body))
+
+    best = None
+    for _ in range(n):
+        start = time.perf_counter()
+        vm.eval('run')
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=3, help='iterations, the best one is reported')
+    args = parser.parse_args(argv)
+
+    for (name, body) in WORKLOADS.items():
+        naive = _time(_define_naive, body, args.n)
+        batched = _time(_define_batched, body, args.n)
+        print(f'{name:10} pop/append {naive:.3f}s, define_primitive {batched:.3f}s, {naive / batched:.2f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
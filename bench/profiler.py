@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较不分析、按词分析（PROFILE-ON）和采样分析（SAMPLE-ON）时执行递归fib的速度。
+不分析时内循环只多一次判断，应该和原来一样快；采样分析的开销应该在5%以内。
+
+用法: python -m bench.profiler [-n 5] [--fib 20] [--interval 0.005]
+"""
+
+import argparse
+import sys
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from t4th import t4th
+from t4th.output import OutputSink
+
+SOURCE = ': fib dup 2 < if drop 1 else dup 1- recurse swap 2 - recurse + then ;'
+
+
+def _time(vm, source, n):
+    best = None
+    for _ in range(n):
+        vm._in_stream = StringIO(source + '\n')
+        with patch('sys.stdout', new=StringIO()):
+            start = time.perf_counter()
+            vm.interpret()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=5, help='iterations, the best one is reported')
+    parser.add_argument('--fib', type=int, default=20, help='argument of fib')
+    parser.add_argument('--interval', type=float, default=0.005, help='sampling interval in seconds')
+    args = parser.parse_args(argv)
+
+    vm = t4th.T4th(output=OutputSink(StringIO()))
+    vm._load_core_fs()
+    vm._in_stream = StringIO(SOURCE + '\n')
+    with patch('sys.stdout', new=StringIO()):
+        vm.interpret()
+
+    source = f'{args.fib} fib drop'
+    off = _time(vm, source, args.n)
+    vm.profile_start()
+    on = _time(vm, source, args.n)
+    report = vm.profile_stop()
+    vm.sample_start(args.interval)
+    sampled = _time(vm, source, args.n)
+    samples = vm.sample_stop()
+
+    print(f'profile off {off:.3f}s, on {on:.3f}s, {on / off:.2f}x')
+    print(f'sampling {sampled:.3f}s, {sampled / off:.2f}x, {len(samples)} samples')
+    print()
+    print(report.format(limit=10))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较回到加载core.fs之后的状态的几种方式：
+重新启动（有启动镜像时加载镜像）、从内存中的镜像还原（_load_image），和T4th.reset()。
+每次先执行一小段定义词和变量的代码。
+
+用法: python -m bench.reset [-n 200]
+"""
+
+import argparse
+import sys
+import time
+
+from t4th import t4th
+
+JOB = 'variable v 5 v ! : sq dup * ; v @ sq 100 allot drop'
+
+
+def _boot(vm, saved):
+    vm = t4th.T4th()
+    vm._load_core_fs()
+    return vm
+
+
+def _image(vm, saved):
+    vm._load_image(saved)
+    return vm
+
+
+def _reset(vm, saved):
+    vm.reset(saved)
+    return vm
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=200, help='resets per method')
+    args = parser.parse_args(argv)
+
+    for (name, fn, save) in (('boot', _boot, lambda vm: None),
+                             ('image', _image, lambda vm: vm._image()),
+                             ('reset', _reset, lambda vm: vm.checkpoint())):
+        vm = t4th.T4th()
+        vm._load_core_fs()
+        saved = save(vm)
+        here = vm._here()
+        elapsed = 0.0
+        for _ in range(args.n):
+            vm.eval(JOB)
+            start = time.perf_counter()
+            vm = fn(vm, saved)
+            elapsed += time.perf_counter() - start
+            assert vm._here() == here and vm._find_word_or_none('sq') is None
+        print(f'{name:6} {elapsed / args.n * 1e6:10.1f} us/reset')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
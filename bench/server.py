@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""t4th.server的负载测试：多个连接并发地一行一行发请求，统计每秒请求数和延迟。
+不指定--connect时在子进程中启动一个本地服务。
+
+用法: python -m bench.server [--clients 10] [--requests 200] [--connect HOST:PORT | --unix PATH]
+"""
+
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+SETUP = ': sq dup * ; : sum-sq 0 swap 0 ?do i sq + loop ;'
+REQUEST = '100 sum-sq .'
+
+
+async def _open(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    (host, port) = args.connect.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+async def _request(reader, writer, line):
+    writer.write(line.encode() + b'\n')
+    reply = b''
+    while not (reply.endswith(b' ok\n') or b'Error: ' in reply):
+        data = await reader.readline()
+        if not data:
+            raise ConnectionError('connection closed')
+        reply += data
+    if b'Error: ' in reply:
+        raise RuntimeError(reply.decode())
+    return reply
+
+
+async def _client(args, latencies):
+    (reader, writer) = await _open(args)
+    await reader.readline()
+    await _request(reader, writer, SETUP)
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        await _request(reader, writer, REQUEST)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def _run(args):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(args, latencies) for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'{len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s')
+    print(f'{len(latencies) / elapsed:.0f} requests/s, '
+          f'p50 {statistics.median(latencies) * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=10, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=200, help='requests per connection')
+    parser.add_argument('--connect', help='HOST:PORT of a running server')
+    parser.add_argument('--unix', help='Unix socket of a running server')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.connect is None and args.unix is None:
+        server = subprocess.Popen([sys.executable, '-m', 't4th.server', '--port', '0',
+                                   '--max-connections', str(args.clients)],
+                                  stdout=subprocess.PIPE, text=True)
+        line = server.stdout.readline()
+        if not line.startswith('Listening on '):
+            server.kill()
+            raise RuntimeError(f'server did not start: {line!r}')
+        args.connect = line[len('Listening on '):].strip()
+
+    try:
+        asyncio.run(_run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
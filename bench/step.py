@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较同一段循环在几种执行方式下的速度：
+不限步数的eval、带budget的eval，以及start()之后用step(n)分段执行。
+不限步数时内循环不变，带步数时换用数步数的内循环。
+
+用法: python -m bench.step [--iterations 200000] [--slice 1000]
+"""
+
+import argparse
+import sys
+import time
+
+from t4th import t4th
+
+SETUP = ': work 0 swap 0 do i xor loop ;'
+
+
+def _eval(vm, source, args):
+    return vm.eval(source)
+
+
+def _budget(vm, source, args):
+    return vm.eval(source, budget=10 ** 9)
+
+
+def _step(vm, source, args):
+    vm.start(source)
+    while True:
+        result = vm.step(args.slice)
+        if result is not None:
+            return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000, help='loop iterations')
+    parser.add_argument('--slice', type=int, default=1000, help='steps per step() call')
+    args = parser.parse_args(argv)
+
+    vm = t4th.T4th()
+    vm._load_core_fs()
+    vm.eval(SETUP)
+    source = f'{args.iterations} work'
+    expected = vm.eval(source).stack
+    vm.eval('drop')
+
+    for (name, fn) in (('eval', _eval), ('budget', _budget), (f'step({args.slice})', _step)):
+        start = time.perf_counter()
+        result = fn(vm, source, args)
+        elapsed = time.perf_counter() - start
+        assert result.stack == expected, result
+        vm.eval('drop')
+        print(f'{name:12} {elapsed * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""比较内存和Python字符串之间逐个字符的转换与整段转换（cell_memory.get_str/set_str），
+以及TYPE和EVALUATE一段很长的字符串。
+
+用法: python -m bench.strings [--sizes 100,10000,100000]
+"""
+
+import argparse
+import sys
+import time
+
+from t4th import t4th
+import t4th.t4th_num as tn
+
+
+def _get_chars(m, start, n):
+    s = ''
+    for i in range(n):
+        s += chr(m[start + i])
+    return s
+
+
+def _set_chars(m, start, s):
+    for (i, ch) in enumerate(s):
+        m[start + i] = ord(ch)
+
+
+def _time(fn, *args):
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,10000,100000', help='comma separated string lengths')
+    args = parser.parse_args(argv)
+    sizes = [int(n) for n in args.sizes.split(',')]
+
+    for n in sizes:
+        m = tn.cell_memory(n + 16)
+        m[n + 8] = object() # 内存中有对象，和VM中一样
+        text = ('t4th 中文 ' * (n // 8 + 1))[:n]
+        set_chars = _time(_set_chars, m, 0, text)
+        set_str = _time(m.set_str, 0, text)
+        get_chars = _time(_get_chars, m, 0, n)
+        get_str = _time(m.get_str, 0, n)
+        assert m.get_str(0, n) == _get_chars(m, 0, n) == text
+        print(f'{n:7} chars  set {set_chars * 1000:8.2f} -> {set_str * 1000:6.3f} ms'
+              f'   get {get_chars * 1000:8.2f} -> {get_str * 1000:6.3f} ms')
+
+    n = max(sizes)
+    vm = t4th.T4th(memory_size=n + 65536)
+    vm._load_core_fs()
+    (addr,) = vm.eval(f'here {n} allot').stack
+    vm.eval('drop')
+    source = ' '.join(['1 drop'] * (n // 7))
+    vm._memory.set_str(addr, source)
+    elapsed = _time(vm.eval, f'{addr} {len(source)} evaluate')
+    print(f'EVALUATE {len(source)} chars {elapsed * 1000:8.1f} ms')
+    elapsed = _time(vm.eval, f'{addr} {len(source)} type')
+    print(f'TYPE     {len(source)} chars {elapsed * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
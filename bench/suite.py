@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Forth基准测试集。
+
+每个测试项在新的T4th实例中执行N次，取每次的耗时，结果写成JSON。
+--compare和保存的基线比较，比基线慢超过阈值的项算作退化，退出码为1。
+
+用法:
+    python -m bench.suite [-n 5] [--only fib,sieve] [--output results.json]
+    python -m bench.suite --compare bench/baseline.json [--threshold 0.25]
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from t4th import t4th
+from t4th.output import OutputSink
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def _large_source(defs=1000):
+    lines = []
+    for i in range(defs):
+        lines.append(f': w{i} ( n -- n ) dup {i} + swap drop ; \\ definition {i}')
+        lines.append(f': v{i} w{i} 0 ?do i drop loop s" str{i}" 2drop ;')
+    return '\n'.join(lines)
+
+
+# 名字 -> (准备代码, 计时的代码, 执行后数据栈上应有的值)。输入缓冲区只有255个字符，长的代码要分行。
+WORKLOADS = {
+    'fib': (
+        ': fib dup 2 < if drop 1 else dup 1- recurse swap 2 - recurse + then ;',
+        '20 fib',
+        [10946],
+    ),
+    'sieve': (
+        '8190 constant size create flags size allot\n'
+        ': primes 0 flags size 1 fill size 0 do flags i + c@ if '
+        'i dup + 3 + dup i + begin dup size < while 0 over flags + c! over + repeat 2drop 1+ '
+        'then loop ;',
+        'primes',
+        [1899],
+    ),
+    'nested-loop': (
+        ': nested 0 200 0 do 200 0 do i j + + loop loop ;',
+        'nested',
+        [7960000],
+    ),
+    'bubble-sort': (
+        '200 constant n create arr n cells allot\n'
+        ': init n 0 do n i - arr i cells + ! loop ;\n'
+        ': sort n 1 do n i - 0 do arr i cells + dup @ over cell+ @ 2dup > '
+        'if rot tuck ! cell+ ! else 2drop drop then loop loop ;\n'
+        ': sorted? -1 n 1 do arr i cells + dup @ swap 1- @ 1+ = and loop ;',
+        'init sort sorted?',
+        [-1],
+    ),
+    'string': (
+        'create buf1 1000 allot create buf2 1000 allot\n'
+        ': strings buf1 1000 [char] a fill 0 100 0 do '
+        'buf1 buf2 1000 move buf1 1000 buf2 1000 compare + loop ;',
+        'strings',
+        [0],
+    ),
+    'pictured': (
+        ': pic 0 3000 0 do i 1000 - dup abs s>d <# #s rot sign #> nip + loop ;',
+        'pic',
+        [10783],
+    ),
+    'evaluate': (
+        ': evals 0 3000 0 do s" 1 2 + +" evaluate loop ;',
+        'evals',
+        [9000],
+    ),
+    'compile': (
+        '',
+        _large_source(),
+        [],
+    ),
+}
+
+
+def _calibrate(n=5):
+    # 固定的纯Python负载，用来抵消机器快慢的差别
+    def loop():
+        d = {}
+        for i in range(100000):
+            d[i & 255] = d.get(i & 255, 0) + i
+        return d
+
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        loop()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _new_vm():
+    vm = t4th.T4th(output=OutputSink(StringIO()))
+    vm._load_core_fs()
+    vm._quit_on_error = True
+    return vm
+
+
+def _run(vm, source):
+    with patch('sys.stdout', new=StringIO()):
+        vm._in_stream = StringIO(source + '\n')
+        vm.interpret()
+
+
+def time_workload(name, n):
+    """在新的T4th实例中执行n次，返回每次的耗时（秒）。"""
+    times = []
+    for _ in range(n):
+        if name == 'cold-boot':
+            with patch.dict('os.environ', {'T4TH_CACHE_DIR': ''}):
+                vm = t4th.T4th()
+                start = time.perf_counter()
+                vm._load_core_fs()
+                times.append(time.perf_counter() - start)
+            continue
+
+        (setup, timed, expected) = WORKLOADS[name]
+        vm = _new_vm()
+        _run(vm, setup)
+        # 和timeit一样，计时时关掉垃圾回收
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            _run(vm, timed)
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+        if list(vm._data_stack) != expected:
+            raise RuntimeError(f'{name}: expected {expected}, got {list(vm._data_stack)}')
+    return times
+
+
+def run_suite(names, n):
+    calibration = _calibrate()
+    results = {}
+    for name in names:
+        times = time_workload(name, n)
+        results[name] = {
+            'min': min(times),
+            'median': statistics.median(times),
+            'times': times,
+        }
+        print(f'{name:12} min {results[name]["min"]:.4f}s, median {results[name]["median"]:.4f}s', flush=True)
+
+    return {
+        'meta': {
+            't4th': t4th.T4th._version,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'n': n,
+            'calibration': calibration,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """返回退化的项 [(名字, 基线, 现在)]。
+
+    按每项的最小耗时比较，先用两次运行的校准时间换算到同样的机器速度。
+    """
+    scale = baseline['meta']['calibration'] / results['meta']['calibration']
+    print(f'calibration {scale:.2f}x')
+    regressions = []
+    for (name, r) in results['results'].items():
+        b = baseline['results'].get(name)
+        if b is None:
+            print(f'{name:12} no baseline')
+            continue
+        ratio = r['min'] * scale / b['min']
+        mark = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{name:12} {b["min"]:.4f}s -> {r["min"]:.4f}s {ratio:5.2f}x {mark}')
+        if mark:
+            regressions.append((name, b['min'], r['min']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=5, help='iterations per workload')
+    parser.add_argument('--only', help='comma separated workload names')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', nargs='?', const=BASELINE, help='baseline JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, 0.25 means 25%%')
+    args = parser.parse_args(argv)
+
+    all_names = list(WORKLOADS) + ['cold-boot']
+    names = args.only.split(',') if args.only else all_names
+    for name in names:
+        if name not in all_names:
+            parser.error(f'unknown workload: {name}')
+
+    # 启动镜像放在临时目录中，保证每次运行的条件相同
+    with tempfile.TemporaryDirectory() as cache_dir, \
+         patch.dict('os.environ', {'T4TH_CACHE_DIR': cache_dir}):
+        results = run_suite(names, args.n)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+# 把冒号定义的线索代码编译成一个Python闭包（子程序线索）。
+#
+# 闭包的行为和DOCOL + 内循环一致：进入时把self._pc压入返回栈，EXIT时弹出。
+# 线索代码仍然留在内存中，闭包只替换代码域，所以xt、'、EXECUTE、COMPILE,
+# 和>BODY都不受影响。数步数时（eval的budget、step()）执行的是线索代码，不用闭包。
+#
+# 限制：不能编译的定义（代码中有非xt的数据、或者调用了不认识的词）保持
+# 线索执行。把返回地址当数据来读写的词（例如用R>读取内联数据）在闭包中
+# 看到的返回地址没有意义。闭包之间的调用会用到Python栈，递归太深会出错。
+
+from typing import Callable, Optional, Tuple
+
+# 指令种类
+_CALL = 'call'            # 直接调用Python函数
+_DYN = 'dyn'              # 通过_call_xt调用
+_LIT = 'lit'
+_BRANCH = 'branch'
+_0BRANCH = '0branch'
+_DO = 'do'
+_QDO = '?do'
+_LOOP = 'loop'
+_PLOOP = '+loop'
+_LEAVE = 'leave'
+_EXIT = 'exit'
+_DOES = 'does'
+_EXECUTE = 'execute'
+_CASE = 'case'            # 参数是_CaseTable，按表跳转
+
+# 带一个内联参数的指令
+_WITH_ARG = (_LIT, _BRANCH, _0BRANCH, _DO, _QDO, _LOOP, _PLOOP)
+
+# 一个块函数中最多生成的指令数，超过时在下一个块的入口处分派
+_MAX_BLOCK = 64
+
+
+class CompileError(Exception):
+    pass
+
+
+def _op_kinds(vm):
+    cls = type(vm)
+    return {
+        cls._word_literal_p: _LIT,
+        cls._word_branch: _BRANCH,
+        cls._word_0branch: _0BRANCH,
+        cls._word_do_p: _DO,
+        cls._word_question_do_p: _QDO,
+        cls._word_loop_p: _LOOP,
+        cls._word_plus_loop_p: _PLOOP,
+        cls._word_leave: _LEAVE,
+        cls._word_exit: _EXIT,
+        cls._word_does: _DOES,
+        cls._word_execute: _EXECUTE,
+        cls._word_case_p: _CASE,
+        # 这些需要_exec_pc或者会接着执行线索代码
+        cls._word_docol: _DYN,
+        cls._word_create_p: _DYN,
+        cls._word_constant_p: _DYN,
+        cls._word_2constant_p: _DYN,
+        cls._word_defer_p: _DYN,
+    }
+
+
+def _cell(vm, addr):
+    if not (0 <= addr < len(vm._memory)):
+        raise CompileError(f'address out of range: {addr}')
+    return vm._memory[addr]
+
+
+def decode(vm, start:int) -> dict:
+    """从start开始沿着控制流解码线索代码。
+
+    返回 {地址: (种类, xt, 参数, 下一条指令的地址)}。
+    """
+    kinds = _op_kinds(vm)
+    instrs = {}
+    todo = [start]
+    while todo:
+        addr = todo.pop()
+        if addr in instrs:
+            continue
+
+        xt = _cell(vm, addr)
+        if not isinstance(xt, int):
+            raise CompileError(f'not an xt at {addr}')
+        code = _cell(vm, xt)
+        if not isinstance(code, vm._PrimitiveWord):
+            raise CompileError(f'no code field at {xt}')
+
+        unfused_xt = vm._unfused_xt(code)
+        if unfused_xt is not None:
+            # 窥孔优化融合的指令：按原来的第一条指令解码，后面的单元都还在
+            xt = unfused_xt
+            code = _cell(vm, xt)
+
+        if isinstance(code, vm._DoesWord):
+            kind = _DYN
+        elif isinstance(code, vm._CompiledWord):
+            kind = _CALL
+        else:
+            kind = kinds.get(getattr(code.ptr, '__func__', None), _CALL)
+
+        arg = None
+        next_addr = addr + 1
+        if kind in _WITH_ARG:
+            arg = _cell(vm, next_addr)
+            if not isinstance(arg, int):
+                raise CompileError(f'bad argument at {next_addr}')
+            next_addr += 1
+        elif kind == _CASE:
+            arg = _cell(vm, next_addr)
+            if not isinstance(arg, vm._CaseTable):
+                raise CompileError(f'bad case table at {next_addr}')
+            next_addr += 1
+
+        instrs[addr] = (kind, xt, arg, next_addr)
+
+        if kind in (_BRANCH,):
+            todo.append(arg)
+        elif kind == _CASE:
+            todo.extend(case_targets(arg))
+        elif kind in (_0BRANCH, _LOOP, _PLOOP, _DO, _QDO):
+            todo.append(arg)
+            todo.append(next_addr)
+        elif kind not in (_EXIT, _DOES, _LEAVE):
+            todo.append(next_addr)
+
+    return instrs
+
+
+def case_targets(table) -> list:
+    """(CASE)可能跳到的地址。"""
+    return list(table.targets.values()) + [table.default]
+
+
+def _leaders(start, instrs):
+    leaders = {start}
+    for (kind, _, arg, next_addr) in instrs.values():
+        if kind == _CASE:
+            leaders.update(case_targets(arg))
+        if kind in (_BRANCH, _0BRANCH, _LOOP, _PLOOP, _DO, _QDO):
+            leaders.add(arg)
+        if kind in (_0BRANCH, _LOOP, _PLOOP, _QDO):
+            leaders.add(next_addr)
+    return sorted(leaders)
+
+
+def _generate(vm, start, instrs):
+    # 需要分派的跳转目标各生成一个块函数，返回下一个块的地址，EXIT时返回None，word()通过字典分派。
+    # 块沿着顺序执行和BRANCH接着生成后面的代码，条件跳转的目标在if中接着生成（代码会复制），
+    # 跳回块的入口是continue，所以IF ... ELSE ... THEN和只有一个入口的循环不用分派。
+    # 开始的块直接生成在word()中。
+    leader_set = set(_leaders(start, instrs))
+    leave_targets = [arg for (kind, _, arg, _) in instrs.values() if kind in (_DO, _QDO)]
+    fns = []
+    entries = []   # 需要块函数的地址
+
+    def fn_ref(f):
+        fns.append(f)
+        return f'f{len(fns) - 1}'
+
+    def add_entries(targets):
+        for target in targets:
+            if target not in entries:
+                entries.append(target)
+
+    def emit_block(entry, in_word, lines):
+        emitted = [0] # 已经生成的指令数
+
+        def dispatch(target, pad):
+            if target == entry:
+                lines.append(f'{pad}continue')
+            else:
+                dispatch_dynamic(str(target), pad)
+                add_entries([target])
+
+        def dispatch_dynamic(expr, pad):
+            if in_word:
+                lines.append(f'{pad}b = {expr}')
+                lines.append(f'{pad}break')
+            else:
+                lines.append(f'{pad}return {expr}')
+
+        def emit(addr, pad, path):
+            # 从addr生成到这条路径结束，path是这条路径上已经生成的地址
+            while True:
+                if addr in path or (addr in leader_set and emitted[0] >= _MAX_BLOCK):
+                    dispatch(addr, pad)
+                    return
+                path.add(addr)
+                emitted[0] += 1
+
+                (kind, xt, arg, next_addr) = instrs[addr]
+                code = vm._memory[xt]
+
+                if kind == _CALL:
+                    f = code.fn if isinstance(code, vm._CompiledWord) else code.ptr
+                    lines.append(f'{pad}{fn_ref(f)}()')
+                elif kind == _DYN:
+                    lines.append(f'{pad}call({xt})')
+                elif kind == _LIT:
+                    lines.append(f'{pad}ds.append({arg})')
+                elif kind == _BRANCH:
+                    addr = arg
+                    continue
+                elif kind == _0BRANCH:
+                    lines.append(f'{pad}if not ds: vm._check_stack(1)')
+                    lines.append(f'{pad}if ds.pop() == 0:')
+                    emit(arg, pad + '    ', set(path))
+                elif kind == _DO:
+                    lines.append(f'{pad}vm._do_runtime({arg})')
+                elif kind == _QDO:
+                    lines.append(f'{pad}if not vm._question_do_runtime({arg}):')
+                    emit(arg, pad + '    ', set(path))
+                elif kind == _LOOP:
+                    lines.append(f'{pad}if vm._loop_runtime():')
+                    emit(arg, pad + '    ', set(path))
+                elif kind == _PLOOP:
+                    lines.append(f'{pad}if vm._plus_loop_runtime():')
+                    emit(arg, pad + '    ', set(path))
+                elif kind == _LEAVE:
+                    add_entries(leave_targets)
+                    dispatch_dynamic('target(vm._leave_runtime())', pad)
+                    return
+                elif kind == _EXIT:
+                    lines.append(f'{pad}vm._word_exit()')
+                    lines.append(f'{pad}return')
+                    return
+                elif kind == _DOES:
+                    # DOES>用_pc作为DOES>之后代码的地址
+                    lines.append(f'{pad}vm._pc = {next_addr}')
+                    lines.append(f'{pad}vm._word_does()')
+                    lines.append(f'{pad}return')
+                    return
+                elif kind == _EXECUTE:
+                    lines.append(f'{pad}if not ds: vm._check_stack(1)')
+                    lines.append(f'{pad}call(ds.pop())')
+                elif kind == _CASE:
+                    add_entries(case_targets(arg))
+                    lines.append(f'{pad}if not ds: vm._check_stack(1)')
+                    lines.append(f'{pad}b = {fn_ref(arg.targets.get)}(ds[-1])')
+                    lines.append(f'{pad}if b is None:')
+                    lines.append(f'{pad}    b = {arg.default}')
+                    lines.append(f'{pad}else:')
+                    lines.append(f'{pad}    ds.pop()')
+                    dispatch_dynamic('b', pad)
+                    return
+
+                addr = next_addr
+
+        lines.append('while True:')
+        emit(entry, ' ' * 4, set())
+
+    word_lines = []
+    emit_block(start, True, word_lines)
+
+    block_lines = []
+    i = 0
+    while i < len(entries):
+        lines = []
+        emit_block(entries[i], False, lines)
+        block_lines.append(f'def b{entries[i]}(ds):')
+        block_lines.extend('    ' + line for line in lines)
+        i += 1
+
+    lines = block_lines
+    lines.append(f'blocks = {{{", ".join(f"{addr}: b{addr}" for addr in entries)}}}')
+    lines.append('def target(b):')
+    lines.append('    if b not in blocks:')
+    lines.append("        raise ValueError(f'Invalid jump target {b}')")
+    lines.append('    return b')
+    lines.append('def word():')
+    lines.append('    ds = vm._data_stack')
+    lines.append('    vm._return_stack.append(vm._pc)')
+    lines.extend('    ' + line for line in word_lines)
+    if entries:
+        lines.append('    while True:')
+        lines.append('        b = blocks[b](ds)')
+        lines.append('        if b is None:')
+        lines.append('            return')
+
+    header = ['def factory(vm, call, fns):']
+    if fns:
+        header.append(f'    ({", ".join(f"f{i}" for i in range(len(fns)))},) = fns')
+    source = '\n'.join(header + ['    ' + line for line in lines] + ['    return word'])
+    return (source, fns)
+
+
+def compile_thread(vm, start:int) -> Optional[Tuple[Callable, list]]:
+    """把start开始的线索代码编译成闭包。
+
+    返回 (闭包, DOES>之后代码的地址列表)，不能编译时返回None。
+    """
+    try:
+        instrs = decode(vm, start)
+    except CompileError:
+        return None
+
+    (source, fns) = _generate(vm, start, instrs)
+    namespace = {}
+    exec(compile(source, f'<t4th closure {start}>', 'exec'), namespace)
+    word = namespace['factory'](vm, vm._call_xt, fns)
+
+    does_addrs = [next_addr for (kind, _, _, next_addr) in instrs.values() if kind == _DOES]
+    return (word, does_addrs)
@@ -5,6 +5,9 @@
 : hex $10 base ! ;
 : decimal #10 base ! ;
 
+\ 使用加速核心时，下面用[UNDEFINED]包起来的词已经由Python实现
+
+[UNDEFINED] rot [IF]
 : rot >r swap r> swap ;
 : -rot rot rot ;
 : nip swap drop ;
@@ -14,6 +17,7 @@
 : 2drop drop drop ;
 : 2over 3 pick 3 pick ;
 : 2swap rot >r rot r> ;
+[THEN]
 
 : >mark    ( -- addr )  here 0 , ;           \ 记下当前位置，填0做占位
 : >resolve ( addr -- )  here swap ! ;        \ 将 addr 处的0改为当前地址
@@ -37,8 +41,10 @@
     >resolve         \ 解析 if 的地址（addr2）
 ; immediate
 
+[UNDEFINED] 1+ [IF]
 : 1+ 1 + ;
 : 1- 1 - ;
+[THEN]
 : 2* 2 * ;
 : 2/ 2 / ;
 
@@ -46,6 +52,7 @@
 
 : */ */mod swap drop ;
 
+[UNDEFINED] negate [IF]
 : negate invert 1+ ;
 
 : abs dup 0< if negate then ;
@@ -55,9 +62,10 @@
 : > ( a b -- flag ) \ flag = not (a <= b)
   2dup < -rot = or invert ;
 
-: U> dup U< -rot = or invert ;
+: U> swap U< ;
 
 : +! swap over @ + swap ! ;
+[THEN]
 : allot dp +! ;
 
 : chars ;
@@ -65,18 +73,24 @@
 : align ;
 : aligned ;
 
+[UNDEFINED] c@ [IF]
 : c@ @ ;
-: c, , ;
 : c! ! ;
+[THEN]
+: c, , ;
 
 : char+ 1 chars + ;
+[UNDEFINED] cell+ [IF]
 : cell+ 1 cells + ;
+[THEN]
 
 : 2@ DUP CELL+ @ SWAP @ ;
 : 2! SWAP OVER ! CELL+ ! ;
 
+[UNDEFINED] constant [IF]
 : variable create 0 , ;
 : constant create , does> @ ;
+[THEN]
 
 -1 constant true
 0 constant false
@@ -94,8 +108,10 @@ $20 constant bl
 
 : ['] ' postpone literal ; immediate
 
+[UNDEFINED] min [IF]
 : MIN 2DUP > IF SWAP THEN DROP ;
 : MAX 2DUP < IF SWAP THEN DROP ;
+[THEN]
 
 : ?dup dup if dup then ;
 
@@ -107,7 +123,9 @@ $20 constant bl
     postpone literal
 ; immediate
 
+[UNDEFINED] count [IF]
 : count dup @ swap 1+ swap ;
+[THEN]
 
 : s"
   [char] " parse          \ ( c-addr u ) 获得字符串地址和长度
@@ -163,8 +181,6 @@ $20 constant bl
   DUP >R - SWAP R> CHARS + SWAP
 ;
 
-: FILL -ROT 0 ?DO 2DUP C! 1+ LOOP 2DROP ;
-
 \ PARSE-NAME Implementation (from Forth-Standard.org)
 : isspace? ( c -- f )
    BL 1+ U< ;
@@ -199,12 +215,6 @@ $20 constant bl
   then
 ; immediate
 
-: [THEN] ( -- ) ; IMMEDIATE
-
-: [IF] ( flag -- )
-   0= IF POSTPONE [ELSE] THEN
-; IMMEDIATE
-
 : 2>R ( x1 x2 -- ) ( R: -- x1 x2 )
           \ ( x1 x2 ) ( R: x0 )
   SWAP    \ ( x2 x1 ) ( R: x0 )
@@ -270,17 +280,21 @@ variable hld
   CREATE ALLOT
 ;
 
+[UNDEFINED] case [IF]
 : case  0 ; immediate  \ 初始化计数器
 : of    postpone over postpone = postpone if postpone drop ; immediate
 : endcase postpone drop begin ?dup while postpone then repeat ; immediate
 : endof
   postpone else  \ 添加跳转指令跳过后续分支
 ; immediate
+[THEN]
 
+[UNDEFINED] DEFER [IF]
 : DEFER ( "name" -- )
    CREATE ['] ABORT ,
 DOES> ( ... -- ... )
    @ EXECUTE ;
+[THEN]
 
 : DEFER! ( xt2 xt1 -- )
    >BODY ! ;
@@ -302,8 +316,10 @@ DOES> ( ... -- ... )
      ' DEFER@
    THEN ; IMMEDIATE
 
+[UNDEFINED] VALUE [IF]
 : VALUE ( x "name" -- )
   CREATE , DOES> @ ;
+[THEN]
 
 : TO ( x "name" -- )
   state @
@@ -329,6 +345,11 @@ DOES> ( ... -- ... )
 : 2VARIABLE ( "name" -- )
     CREATE 0 , 0 ,  ;
 
+[UNDEFINED] 2CONSTANT [IF]
+: 2CONSTANT ( x1 x2 "name" -- )
+    CREATE , , DOES> 2@ ;
+[THEN]
+
 : include parse-name included ;
 
 \ 这个词之后的，才能forget。
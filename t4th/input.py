@@ -50,12 +50,60 @@ def _move_cursor_right(cursor_pos, display_widths, out_stream, result) -> int:
         cursor_pos += 1
     return cursor_pos
 
+class SourceReader:
+    """从字符串按行读输入的流，不是终端，不回显提示符。
+
+    比StringIO少了回显和写出，T4th.eval和EVALUATE用它。lineno是已经读过的行数。
+    """
+
+    def __init__(self, source:str=''):
+        self._source = source
+        self._pos = 0
+        self.lineno = 0
+
+    def readline(self) -> str:
+        source = self._source
+        pos = self._pos
+        if pos >= len(source):
+            return ''
+        end = source.find('\n', pos)
+        end = len(source) if end < 0 else end + 1
+        self._pos = end
+        self.lineno += 1
+        return source[pos:end]
+
+    def read(self, n:int=-1) -> str:
+        end = len(self._source) if n < 0 else self._pos + n
+        s = self._source[self._pos:end]
+        self._pos += len(s)
+        self.lineno += s.count('\n')
+        return s
+
+    def isatty(self) -> bool:
+        return False
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos:int):
+        self.lineno = self._source.count('\n', 0, pos)
+        self._pos = pos
+
+    def close(self):
+        pass
+
+def echoes_prompt(stream) -> bool:
+    # 从终端读输入时把提示符和输入回显到标准输出，StringIO用于单元测试
+    return isinstance(stream, StringIO) or stream.isatty()
+
 def get_input_line(prompt: str = '', stream=None, max_length: int = -1) -> Optional[str]:
     if stream is None:
         stream = sys.stdin
 
-    # StringIO用于单元测试
-    if isinstance(stream, StringIO) or stream.isatty():
+    if echoes_prompt(stream):
         _out = sys.stdout
     else:
         _out = NullIO()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+class OutputSink:
+    """缓冲VM的输出，按策略写到输出流。
+
+    stream为None时写到当时的sys.stdout（单元测试会替换sys.stdout）。
+    缓冲超过buffer_size个字符时写出；line_buffered为真时遇到换行也写出，
+    为None时输出流是终端才按行写出。读输入之前和解释结束时由VM调用flush()。
+    """
+
+    def __init__(self, stream=None, buffer_size:int=8192, line_buffered:bool=None):
+        self._stream = stream
+        self.buffer_size = buffer_size
+        self.line_buffered = line_buffered
+        self._parts = []
+        self._size = 0
+
+    @property
+    def stream(self):
+        return self._stream if self._stream is not None else sys.stdout
+
+    def write(self, s:str):
+        if not s:
+            return
+        self._parts.append(s)
+        self._size += len(s)
+        if self._size >= self.buffer_size or ('\n' in s and self._is_line_buffered()):
+            self.flush()
+
+    def flush(self):
+        if not self._parts:
+            return
+        s = ''.join(self._parts)
+        self._parts.clear()
+        self._size = 0
+
+        stream = self.stream
+        stream.write(s)
+        stream.flush()
+
+    def _is_line_buffered(self) -> bool:
+        if self.line_buffered is not None:
+            return self.line_buffered
+        try:
+            return self.stream.isatty()
+        except (AttributeError, ValueError):
+            return False
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# 在;时对冒号定义的线索代码做窥孔优化，把常见的指令序列融合成一条超级指令。
+#
+# 优化不移动线索代码：只把序列的第一个单元改成融合后的xt，融合指令执行完整个
+# 序列后直接跳到序列之后。序列中其余的单元原样保留，所以>MARK/>RESOLVE记下的
+# 跳转地址、DO/LOOP的leave地址都不需要修正，跳到序列中间的分支也照常执行原来
+# 的指令。
+
+from .compiler import CompileError, decode, case_targets, _BRANCH, _0BRANCH, _DO, _QDO, _LOOP, _PLOOP, _DOES, _CASE
+
+# (融合后的词, 原来的词序列)，长的序列在前。
+# (LITERAL)和0BRANCH后面的内联参数不算在序列中。
+PATTERNS = (
+    ('(OVER=0BRANCH)', ('OVER', '=', '0BRANCH')),
+    ('(DUP0=0BRANCH)', ('DUP', '0=', '0BRANCH')),
+    ('(=0BRANCH)', ('=', '0BRANCH')),
+    ('(0=0BRANCH)', ('0=', '0BRANCH')),
+    ('(LIT+)', ('(LITERAL)', '+')),
+    ('(LIT-)', ('(LITERAL)', '-')),
+    ('(LIT=)', ('(LITERAL)', '=')),
+    ('(RDROP)', ('R>', 'DROP')),
+)
+
+FUSED = dict(PATTERNS)
+
+
+def _xt(vm, word_name):
+    # 只匹配最早定义的同名词，用户重新定义的词不参与优化
+    ptrs = vm._word_index.get(word_name)
+    return vm._memory[ptrs[0]].ptr if ptrs else None
+
+
+def _match(vm, instrs, addr, names):
+    for name in names:
+        instr = instrs.get(addr)
+        if instr is None or instr[1] != _xt(vm, name):
+            return False
+        addr = instr[3]
+    return True
+
+
+def _decode_all(vm, start):
+    # 解码冒号定义和它的DOES>部分
+    instrs = {}
+    todo = [start]
+    while todo:
+        addr = todo.pop()
+        if addr in instrs:
+            continue
+        part = decode(vm, addr)
+        instrs.update(part)
+        todo.extend(next_addr for (kind, _, _, next_addr) in part.values() if kind == _DOES)
+    return instrs
+
+
+def optimize(vm, start:int) -> int:
+    """优化start开始的线索代码，返回融合的序列个数。不能解码时不做优化。"""
+    try:
+        instrs = _decode_all(vm, start)
+    except CompileError:
+        return 0
+
+    count = 0
+    for addr in sorted(instrs):
+        for (fused, names) in PATTERNS:
+            fused_xt = _xt(vm, fused)
+            if fused_xt is not None and _match(vm, instrs, addr, names):
+                vm._memory[addr] = fused_xt
+                count += 1
+                break
+    return count
+
+
+def listing(vm, start:int) -> list:
+    """返回优化后的线索代码：[(地址, 词名, 内联参数列表)]。
+
+    被融合指令覆盖的单元不列出，除非有分支跳到那里。
+    """
+    instrs = _decode_all(vm, start)
+    targets = {arg for (kind, _, arg, _) in instrs.values()
+               if kind in (_BRANCH, _0BRANCH, _DO, _QDO, _LOOP, _PLOOP)}
+    for (kind, _, arg, _) in instrs.values():
+        if kind == _CASE:
+            targets.update(case_targets(arg))
+
+    lines = []
+    covered = set()
+    for addr in sorted(instrs):
+        if addr in covered and addr not in targets:
+            continue
+
+        code = vm._memory[vm._memory[addr]]
+        (kind, xt, arg, next_addr) = instrs[addr]
+        if code.name in FUSED:
+            name = code.name
+            args = []
+            a = addr
+            for _ in FUSED[name]:
+                (_, _, arg, next_a) = instrs[a]
+                if arg is not None:
+                    args.append(arg)
+                if a != addr:
+                    covered.add(a)
+                a = next_a
+        else:
+            header = vm._memory[xt - 1]
+            name = header.word_name if isinstance(header, vm._Word) else str(xt)
+            args = [] if arg is None else [arg]
+        lines.append((addr, name, args))
+    return lines
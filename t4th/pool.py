@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# 用多个进程批量执行互相独立的Forth代码。
+#
+# 每个工作进程启动时加载一次core.fs（有启动镜像时直接加载镜像），记下加载后的状态；
+# 每个任务用T4th.eval执行，执行完用T4th.reset恢复到加载后的检查点，不重新启动。
+# 任务超时时结束这个工作进程，换一个新的。
+
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from multiprocessing.connection import wait
+
+from .t4th import T4th, ForthError
+
+# index是任务在输入中的序号，error为None表示成功，elapsed是执行的秒数
+JobResult = namedtuple('JobResult', ['index', 'output', 'stack', 'error', 'elapsed'])
+
+
+def _read_job(job) -> str:
+    if isinstance(job, os.PathLike):
+        with open(job, 'r', encoding='utf-8') as f:
+            return f.read()
+    return job
+
+
+def _worker_main(conn, vm_options):
+    vm = T4th(**vm_options)
+    vm._load_core_fs()
+    checkpoint = vm.checkpoint()
+    conn.send('ready')
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        (index, source) = job
+        start = time.perf_counter()
+        try:
+            result = vm.eval(_read_job(source))
+            (output, stack, error) = (result.output, result.stack, None)
+        except ForthError as e:
+            (output, stack, error) = (e.output, e.stack, f'{e.message} (line {e.lineno}, word {e.word})')
+        except OSError as e:
+            (output, stack, error) = ('', [], str(e))
+        elapsed = time.perf_counter() - start
+
+        vm.reset(checkpoint)
+        conn.send(JobResult(index, output, stack, error, elapsed))
+
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, ctx, vm_options):
+        (self.conn, child_conn) = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, vm_options), daemon=True)
+        self.process.start()
+        child_conn.close()
+        try:
+            self.conn.recv() # 等到加载完core.fs
+        except EOFError:
+            self.kill()
+            raise RuntimeError(f'Worker process failed to start (exit code {self.process.exitcode})') from None
+        self.job = None
+        self.start = None
+
+    def send(self, index, source):
+        self.job = index
+        self.start = time.perf_counter()
+        self.conn.send((index, source))
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class Pool:
+    """工作进程池，每个进程中有一个加载好core.fs的T4th。
+
+    vm_options传给T4th()，例如compile_closures=True。
+    """
+
+    def __init__(self, processes:int=None, **vm_options):
+        self._ctx = multiprocessing.get_context()
+        self._vm_options = vm_options
+        self._workers = []
+        try:
+            for _ in range(processes or os.cpu_count() or 1):
+                self._workers.append(_Worker(self._ctx, vm_options))
+        except RuntimeError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for w in self._workers:
+            w.stop()
+        self._workers = []
+
+    def run(self, jobs, timeout:float=None):
+        """执行jobs中的每个任务，按完成的先后返回JobResult。
+
+        任务是Forth源代码字符串，或者os.PathLike表示的文件。
+        一个任务执行超过timeout秒时结果的error是'Timeout'，执行它的进程被换掉。
+        没取完结果就关闭生成器时，还在执行任务的进程被换掉，进程池可以继续使用。
+        """
+        jobs = iter(enumerate(jobs))
+        idle = list(self._workers)
+        busy = {}
+        exhausted = False
+
+        try:
+            while True:
+                while idle and not exhausted:
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                        break
+                    w = idle.pop()
+                    w.send(*job)
+                    busy[w.conn] = w
+
+                if not busy:
+                    return
+
+                wait_time = None
+                if timeout is not None:
+                    now = time.perf_counter()
+                    wait_time = max(0, min(w.start + timeout - now for w in busy.values()))
+
+                for conn in wait(list(busy), wait_time):
+                    w = busy.pop(conn)
+                    try:
+                        result = conn.recv()
+                    except EOFError:
+                        result = JobResult(w.job, '', [], 'Worker exited', time.perf_counter() - w.start)
+                        w = self._replace(w)
+                    idle.append(w)
+                    yield result
+
+                if timeout is not None:
+                    now = time.perf_counter()
+                    for w in [w for w in busy.values() if now - w.start >= timeout]:
+                        del busy[w.conn]
+                        result = JobResult(w.job, '', [], 'Timeout', now - w.start)
+                        idle.append(self._replace(w))
+                        yield result
+        finally:
+            # 调用者没取完结果就停止时，忙的进程还在执行任务，结果会留在管道里，换掉它们
+            for w in busy.values():
+                if w in self._workers: # 进程池已经关闭时不用换
+                    self._replace(w)
+
+    def _replace(self, worker):
+        worker.kill()
+        new = _Worker(self._ctx, self._vm_options)
+        self._workers[self._workers.index(worker)] = new
+        return new
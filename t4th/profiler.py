@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# 按词统计的性能分析：调用次数、自身时间和包含时间。
+#
+# 打开分析时VM换用_run_until_profiled内循环，关闭时内循环不变。
+# 原语和编译成闭包的词在调用前后计时；线索执行的冒号定义（DOCOL和DOES>）
+# 从进入开始计时，到EXIT把返回栈弹回进入前的深度为止。
+# 闭包内部的调用和被内联的词不单独统计。
+#
+# 采样分析（Sampler）不改变内循环，由后台线程定时记下VM的返回栈，
+# 再按地址找到返回地址所在的定义，还原出Forth的调用栈。
+
+import threading
+import time
+from collections import Counter, namedtuple
+
+ProfileEntry = namedtuple('ProfileEntry', ['name', 'xt', 'calls', 'self_time', 'inclusive_time'])
+
+
+class ProfileReport:
+    """分析结果，按自身时间从多到少排列的ProfileEntry列表。"""
+
+    def __init__(self, entries:list):
+        self.entries = sorted(entries, key=lambda e: (-e.self_time, e.name))
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, name:str) -> ProfileEntry:
+        # 按词名查找，同名的词取第一个
+        for e in self.entries:
+            if e.name == name.upper():
+                return e
+        raise KeyError(name)
+
+    def format(self, limit:int=None) -> str:
+        lines = [f'{"WORD":20} {"CALLS":>10} {"SELF ms":>10} {"INCL ms":>10}']
+        for e in self.entries[:limit]:
+            lines.append(f'{e.name:20} {e.calls:>10} {e.self_time * 1000:>10.3f} {e.inclusive_time * 1000:>10.3f}')
+        return '\n'.join(lines)
+
+
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stats = {}   # xt -> [调用次数, 自身时间, 包含时间]
+        self.frames = []  # [xt, 开始时间, 子调用时间, 返回栈深度]，原语的返回栈深度是None
+        self._active = {} # xt -> 正在执行的层数，递归时只统计最外层的包含时间
+
+    def enter(self, xt:int, rs_depth:int=None):
+        self._active[xt] = self._active.get(xt, 0) + 1
+        self.frames.append([xt, self.clock(), 0.0, rs_depth])
+
+    def leave(self):
+        (xt, start, child_time, _) = self.frames.pop()
+        elapsed = self.clock() - start
+
+        st = self.stats.get(xt)
+        if st is None:
+            st = self.stats[xt] = [0, 0.0, 0.0]
+        st[0] += 1
+        st[1] += elapsed - child_time
+
+        self._active[xt] -= 1
+        if self._active[xt] == 0:
+            st[2] += elapsed
+
+        if self.frames:
+            self.frames[-1][2] += elapsed
+
+    def leave_threaded(self, rs_depth:int):
+        # EXIT之后，结束返回栈已经弹回的冒号定义
+        frames = self.frames
+        while frames and frames[-1][3] is not None and frames[-1][3] > rs_depth:
+            self.leave()
+
+    def unwind(self, depth:int):
+        # 出错时丢掉没有结束的调用
+        while len(self.frames) > depth:
+            (xt, _, _, _) = self.frames.pop()
+            self._active[xt] -= 1
+
+    def report(self, name_of) -> ProfileReport:
+        return ProfileReport([ProfileEntry(name_of(xt), xt, calls, self_time, inclusive_time)
+                              for (xt, (calls, self_time, inclusive_time)) in self.stats.items()])
+
+
+class SampleReport:
+    """采样结果：{调用栈: 次数}，调用栈是从外到内的词名元组。"""
+
+    def __init__(self, counts:dict, interval:float):
+        self.counts = counts
+        self.interval = interval
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def collapsed(self) -> str:
+        # 折叠栈格式，每行“外层;...;内层 次数”，flamegraph.pl、speedscope等工具可以读入
+        return ''.join(f'{";".join(stack)} {n}\n' for (stack, n) in sorted(self.counts.items()))
+
+    def save(self, filename:str):
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+
+class Sampler:
+    """在后台线程中每隔interval秒调用一次snapshot()，统计返回的调用栈。
+
+    snapshot()返回None的样本不计。线程只在取样时拿GIL，VM的内循环不变。
+    """
+
+    def __init__(self, snapshot, interval:float=0.005):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='t4th-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            stack = self.snapshot()
+            if stack is not None:
+                self.samples[stack] += 1
+
+    def report(self, resolve) -> SampleReport:
+        # resolve把snapshot()的原始结果换成词名元组，同一个调用栈的样本合并
+        counts = Counter()
+        for (raw, n) in list(self.samples.items()):
+            counts[resolve(raw)] += n
+        return SampleReport(dict(counts), self.interval)
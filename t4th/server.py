@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# 基于asyncio的按行求值服务，支持TCP和Unix socket。
+#
+# 每个连接有自己的T4th，从启动时加载好core.fs的模板镜像还原，不再执行core.fs。
+# 连接建立后服务先发一行版本信息；客户端每发一行，服务在线程池中用T4th.eval执行，
+# 不占用事件循环的线程。回复和交互时一样：输出之后是" ok"（定义没结束时是" compiled"），
+# 出错时是"Error: ..."一行。BYE结束连接。
+# 一行执行的步数超过eval_budget或者时间超过eval_timeout秒时，服务回复错误并结束连接。
+
+import argparse
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .t4th import T4th, ForthError
+
+
+class Server:
+    """vm_options传给每个连接的T4th()。max_connections是同时的连接数上限，
+    idle_timeout秒内没有收到一行就断开连接，workers是执行eval的线程数。
+    eval_budget是一行最多执行的步数，eval_timeout是一行最多执行的秒数，None表示不限制。
+    """
+
+    # 有eval_timeout时分段执行，每段的步数
+    _slice_steps = 10000
+
+    def __init__(self, max_connections:int=64, idle_timeout:float=300.0, workers:int=None,
+                 eval_budget:int=None, eval_timeout:float=10.0, **vm_options):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.eval_budget = eval_budget
+        self.eval_timeout = eval_timeout
+        self.connections = 0
+
+        template = T4th(**vm_options)
+        template._load_core_fs()
+        self._image = template._image()
+        self._vm_options = vm_options
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='t4th-eval')
+
+    def new_vm(self) -> T4th:
+        vm = T4th(**self._vm_options)
+        vm._load_image(self._image)
+        return vm
+
+    def _eval(self, vm:T4th, source:str):
+        # 在线程池中执行。线程不能从外面停止，所以有eval_timeout时用start()和step()分段执行，
+        # 每段之后检查时间，超时时抛出TimeoutError，VM停在中间，连接随后结束
+        if self.eval_timeout is None:
+            return vm.eval(source, self.eval_budget)
+        deadline = time.monotonic() + self.eval_timeout
+        vm.start(source, self.eval_budget)
+        while True:
+            result = vm.step(Server._slice_steps)
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                raise TimeoutError()
+
+    async def start(self, host:str='127.0.0.1', port:int=4242, path:str=None):
+        """开始监听，返回asyncio的Server。path不为None时监听Unix socket。"""
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        if self.connections >= self.max_connections:
+            writer.write(b'Error: too many connections\n')
+            await self._close(writer)
+            return
+
+        self.connections += 1
+        loop = asyncio.get_running_loop()
+        try:
+            vm = await loop.run_in_executor(self._executor, self.new_vm)
+            writer.write(f'T4th version {T4th._version}\n'.encode())
+            await writer.drain()
+
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    writer.write(b'Error: idle timeout\n')
+                    break
+                except ValueError: # 一行太长
+                    writer.write(b'Error: line too long\n')
+                    break
+                if not line:
+                    break
+
+                try:
+                    result = await loop.run_in_executor(self._executor, self._eval, vm, line.decode('utf-8', 'replace'))
+                    if result.quit:
+                        writer.write(result.output.encode())
+                        break
+                    reply = result.output + (' ok\n' if vm._get_var_value('STATE') == 0 else ' compiled\n')
+                except ForthError as e:
+                    reply = f'{e.output}\nError: {e.message}\n'
+                    if e.message == 'Budget exhausted':
+                        writer.write(reply.encode())
+                        break
+                except TimeoutError:
+                    writer.write(b'Error: eval timeout\n')
+                    break
+
+                writer.write(reply.encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            await self._close(writer)
+
+    async def _close(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def _serve(server, args):
+    srv = await server.start(args.host, args.port, args.unix)
+    for sock in srv.sockets:
+        name = sock.getsockname()
+        print(f'Listening on {name if isinstance(name, str) else f"{name[0]}:{name[1]}"}', flush=True)
+    async with srv:
+        await srv.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='T4th evaluation server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4242, help='0 picks a free port')
+    parser.add_argument('--unix', help='listen on a Unix socket instead of TCP')
+    parser.add_argument('--max-connections', type=int, default=64)
+    parser.add_argument('--idle-timeout', type=float, default=300.0, help='seconds')
+    parser.add_argument('--workers', type=int, help='threads running evaluations')
+    parser.add_argument('--eval-budget', type=int, help='steps allowed per line')
+    parser.add_argument('--eval-timeout', type=float, default=10.0, help='seconds allowed per line, 0 for no limit')
+    parser.add_argument('--compile-closures', action='store_true')
+    args = parser.parse_args(argv)
+
+    server = Server(args.max_connections, args.idle_timeout, args.workers, args.eval_budget, args.eval_timeout or None,
+                    compile_closures=args.compile_closures)
+    try:
+        asyncio.run(_serve(server, args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__': # pragma: no cover
+    sys.exit(main())
@@ -1,14 +1,52 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple
 from io import StringIO
+import bisect
+import hashlib
+import marshal
 import os
+import re
 import sys
+import tempfile
 import t4th.t4th_num as tn
-from ctypes import c_int
 from typing import Optional
 from enum import Enum, auto
-from .input import get_raw_input, get_input_line
+from .input import get_raw_input, get_input_line, echoes_prompt, SourceReader
+from .output import OutputSink
+from .profiler import Profiler, ProfileReport, Sampler, SampleReport
+from .compiler import compile_thread, decode, CompileError, _CALL, _DYN, _LIT, _EXECUTE, _EXIT
+from . import peephole
+
+# quit为真表示执行了BYE，之后的source没有执行
+EvalResult = namedtuple('EvalResult', ['output', 'stack', 'quit'], defaults=[False])
+
+# step()用完这一段的步数时从内循环中退出，不是错误
+class _Suspend(BaseException):
+    word = None
+
+
+# T4th.checkpoint()的结果，用T4th.reset()恢复
+Checkpoint = namedtuple('Checkpoint', ['memory', 'latest', 'word_index', 'compiled_does', 'inline_bodies'])
+
+
+class ForthError(Exception):
+    """T4th.eval执行出错。
+
+    word是出错时解释的词，source和lineno是出错的输入行和行号（从1开始），
+    output是出错前的输出，stack是出错时的数据栈。
+    """
+
+    def __init__(self, message:str, word:str=None, source:str=None, lineno:int=None, output:str='', stack:list=None):
+        super().__init__(message)
+        self.message = message
+        self.word = word
+        self.source = source
+        self.lineno = lineno
+        self.output = output
+        self.stack = [] if stack is None else stack
+
 
 class T4th:
     _version = '0.1.0'
@@ -32,9 +70,15 @@ class T4th:
 
         END = auto()
 
+    _TOKEN_RE = re.compile(r'[ \t\n\r]*([^ \t\n\r]+)[ \t\n\r]?')
+
+    # 变量名 -> 地址，比每次查MemAddress快
+    _VAR_ADDR = {m.name: m.value for m in MemAddress}
+
     class _Word:
         FLAG_IMMEDIATE = 1 << 0
         FLAG_NON_INTERACTIVE = 1 << 1
+        FLAG_INLINE = 1 << 2
 
         def __init__(self, word_name:str, ptr:int=0, flag=0, prev:int=0):
             self.word_name = word_name.upper()
@@ -54,6 +98,9 @@ class T4th:
         def is_non_interactive(self):
             return (self.flag & T4th._Word.FLAG_NON_INTERACTIVE)!= 0
 
+        def is_inline(self):
+            return (self.flag & T4th._Word.FLAG_INLINE) != 0
+
     class _PrimitiveWord:
         def __init__(self, name:str, ptr:int):
             self.name = name.upper()
@@ -68,19 +115,59 @@ class T4th:
         def __repr__(self):
             return self.__str__()
 
+    class _DoesWord(_PrimitiveWord):
+        def __init__(self, jmp_ptr:int, ptr):
+            super().__init__('(DOES>)', ptr)
+            self.jmp_ptr = jmp_ptr
+
+    class _CaseSys:
+        # 编译CASE时放在数据栈上：每个OF的(选择值或None, OF之后的地址, ENDOF要回填的地址)
+        def __init__(self, start:int):
+            self.start = start
+            self.clauses = []
+            self.clause_start = start # 当前分支的第一个单元
+
+        def __repr__(self):
+            return f'<CASE {len(self.clauses)}>'
+
+    class _CaseTable:
+        # (CASE)后面的单元：选择值 -> 匹配时跳到的地址，都不匹配时跳到default
+        def __init__(self, targets:dict, default:int):
+            self.targets = targets
+            self.default = default
+
+        def __repr__(self):
+            return f'<CASE-TABLE {len(self.targets)}>'
+
+    class _CompiledWord(_PrimitiveWord):
+        # 数步数时（eval的budget、step()）按留在内存中的线索代码执行，这样步数数得到，也能挂起
+        def __init__(self, name:str, fn, vm):
+            super().__init__(name, fn)
+            self.fn = fn
+            self.vm = vm
+
+        def __call__(self):
+            if self.vm._step_limit is None:
+                self.fn()
+            else:
+                self.vm._word_docol()
+
     def _add_word(self, word:_Word):
         word.prev = self._latest_word_ptr
         self._latest_word_ptr = self._here()
         self._memory_append(word)
+        self._word_index.setdefault(word.word_name, []).append(self._latest_word_ptr)
 
     def _find_word_ptr(self, word_name:str) -> int:
-        word_name = word_name.upper()
-        p = self._latest_word_ptr
-        if self._get_var_value('STATE') != 0:
-            p = self._memory[p].prev
-
-        while p > 0 and self._memory[p].word_name!= word_name:
-            p = self._memory[p].prev
+        # _word_index: 词名 -> 同名词头的地址列表，最新的在最后
+        ptrs = self._word_index.get(word_name.upper())
+        if not ptrs:
+            return 0
+
+        p = ptrs[-1]
+        if p == self._latest_word_ptr and self._get_var_value('STATE') != 0:
+            # 正在定义的词不可见
+            p = ptrs[-2] if len(ptrs) > 1 else 0
         return p
 
     def _find_word_or_none(self, word_name:str) -> Optional[_Word]:
@@ -95,26 +182,36 @@ class T4th:
             raise ValueError(f"Undefined word: `{word_name}`")
         return word
 
+    def _core_xt(self, word_name:str) -> int:
+        # 最早定义的同名词（原语或core.fs中的词）的xt，用户重新定义的词不影响编译出的代码
+        return self._memory[self._word_index[word_name][0]].ptr
+
     def _VAR_WORD(self, name:str, alias:str=None) -> _Word:
         addr = T4th.MemAddress[name].value
         return (T4th._Word(alias if alias else name), lambda: self._data_stack.append(addr))
 
     def _set_var_value(self, name:str, value:int):
-        addr = T4th.MemAddress[name].value
-        self._memory[addr] = value
+        self._memory[T4th._VAR_ADDR[name]] = value
 
     def _inc_var(self, name:str, i:int=1):
-        addr = T4th.MemAddress[name].value
-        self._memory[addr] += i
+        self._memory[T4th._VAR_ADDR[name]] += i
 
     def _get_var_value(self, name:str) -> int:
-        addr = T4th.MemAddress[name].value
-        return self._memory[addr]
-
-    def __init__(self, memory_size=65536):
-        tn.base = lambda : self._base()
+        return self._memory[T4th._VAR_ADDR[name]]
 
+    def __init__(self, memory_size=65536, compile_closures=False, accelerated_core=True, peephole=True,
+                 inline_threshold=3, output=None):
         self._memory_size = memory_size
+        # 在;时把冒号定义编译成Python闭包
+        self._compile_closures = compile_closures
+        # 用Python实现core.fs中常用的词，core.fs中对应的定义会被跳过
+        self._accelerated_core = accelerated_core
+        # 在;时做窥孔优化，把常见的指令序列融合成超级指令
+        self._peephole = peephole
+        # 定义体不超过这么多单元的冒号定义在编译时内联，标记了INLINE的不受限制；None表示不内联
+        self._inline_threshold = inline_threshold
+        # 输出先写到缓冲中，output可以是OutputSink或者输出流
+        self._output = output if isinstance(output, OutputSink) else OutputSink(output)
 
         IM = T4th._Word.FLAG_IMMEDIATE
         NI = T4th._Word.FLAG_NON_INTERACTIVE
@@ -158,6 +255,11 @@ class T4th:
             (T4th._Word(','), self._word_comma),
 
             (T4th._Word('MOVE'), self._word_move),
+            (T4th._Word('CMOVE'), self._word_cmove),
+            (T4th._Word('CMOVE>'), self._word_cmove_up),
+            (T4th._Word('FILL'), self._word_fill),
+            (T4th._Word('ERASE'), self._word_erase),
+            (T4th._Word('BLANK'), self._word_blank),
 
             (T4th._Word('>R'), self._word_to_r),
             (T4th._Word('R>'), self._word_r_from),
@@ -203,6 +305,7 @@ class T4th:
             (T4th._Word('RECURSE', flag=IM|NI), self._word_recurse),
 
             (T4th._Word('IMMEDIATE'), self._word_immediate),
+            (T4th._Word('INLINE'), self._word_inline),
 
             (T4th._Word('POSTPONE', flag=IM|NI), self._word_postpone),
             (T4th._Word('[COMPILE]', flag=IM|NI), self._word_bracket_compile),
@@ -215,6 +318,24 @@ class T4th:
             (T4th._Word('LITERAL', flag=IM|NI), self._word_literal),
             (T4th._Word('(LITERAL)', flag=NI), self._word_literal_p),
 
+            (T4th._Word('(LIT+)', flag=NI), self._word_lit_plus),
+            (T4th._Word('(LIT-)', flag=NI), self._word_lit_minus),
+            (T4th._Word('(LIT=)', flag=NI), self._word_lit_equ),
+            (T4th._Word('(=0BRANCH)', flag=NI), self._word_equ_0branch),
+            (T4th._Word('(0=0BRANCH)', flag=NI), self._word_zero_equ_0branch),
+            (T4th._Word('(OVER=0BRANCH)', flag=NI), self._word_over_equ_0branch),
+            (T4th._Word('(DUP0=0BRANCH)', flag=NI), self._word_dup_zero_equ_0branch),
+            (T4th._Word('(RDROP)', flag=NI), self._word_rdrop),
+
+            (T4th._Word('SEE'), self._word_see),
+
+            (T4th._Word('PROFILE-ON'), self._word_profile_on),
+            (T4th._Word('PROFILE-OFF'), self._word_profile_off),
+            (T4th._Word('.PROFILE'), self._word_dot_profile),
+            (T4th._Word('SAMPLE-ON'), self._word_sample_on),
+            (T4th._Word('SAMPLE-OFF'), self._word_sample_off),
+            (T4th._Word('.SAMPLES'), self._word_dot_samples),
+
             (T4th._Word('CHAR'), self._word_char),
 
             (T4th._Word(']'), self._word_right_bracket),
@@ -227,12 +348,20 @@ class T4th:
             (T4th._Word('BRANCH', flag=NI), self._word_branch),
             (T4th._Word('0BRANCH', flag=NI), self._word_0branch),
 
+            (T4th._Word('[IF]', flag=IM), self._word_bracket_if),
             (T4th._Word('[ELSE]', flag=IM), self._word_bracket_else),
+            (T4th._Word('[THEN]', flag=IM), self._word_bracket_then),
+            (T4th._Word('[DEFINED]', flag=IM), self._word_bracket_defined),
+            (T4th._Word('[UNDEFINED]', flag=IM), self._word_bracket_undefined),
 
             (T4th._Word('DO', flag=IM|NI), self._word_do),
+            (T4th._Word('(DO)', flag=NI), self._word_do_p),
             (T4th._Word('?DO', flag=IM|NI), self._word_question_do),
+            (T4th._Word('(?DO)', flag=NI), self._word_question_do_p),
             (T4th._Word('LOOP', flag=IM|NI), self._word_loop),
+            (T4th._Word('(LOOP)', flag=NI), self._word_loop_p),
             (T4th._Word('+LOOP', flag=IM|NI), self._word_plus_loop),
+            (T4th._Word('(+LOOP)', flag=NI), self._word_plus_loop_p),
             (T4th._Word('LEAVE', flag=NI), self._word_leave),
             (T4th._Word('UNLOOP', flag=NI), self._word_unloop),
             (T4th._Word('I', flag=NI), self._word_i),
@@ -256,23 +385,77 @@ class T4th:
             (T4th._Word('INCLUDED'), self._word_included),
         ]
 
+        if accelerated_core:
+            self._primitive_words += [
+                (T4th._Word('ROT'), self._word_rot),
+                (T4th._Word('-ROT'), self._word_minus_rot),
+                (T4th._Word('NIP'), self._word_nip),
+                (T4th._Word('TUCK'), self._word_tuck),
+
+                (T4th._Word('2DUP'), self._word_2dup),
+                (T4th._Word('2DROP'), self._word_2drop),
+                (T4th._Word('2OVER'), self._word_2over),
+                (T4th._Word('2SWAP'), self._word_2swap),
+
+                (T4th._Word('1+'), self._word_one_plus),
+                (T4th._Word('1-'), self._word_one_minus),
+                (T4th._Word('NEGATE'), self._word_negate),
+                (T4th._Word('ABS'), self._word_abs),
+
+                (T4th._Word('='), self._word_equ),
+                (T4th._Word('<>'), self._word_not_equ),
+                (T4th._Word('>'), self._word_greater),
+                (T4th._Word('U>'), self._word_u_greater),
+                (T4th._Word('MIN'), self._word_min),
+                (T4th._Word('MAX'), self._word_max),
+
+                (T4th._Word('+!'), self._word_plus_store),
+                (T4th._Word('C@'), self._word_mem_fetch),
+                (T4th._Word('C!'), self._word_mem_store),
+                (T4th._Word('CELL+'), self._word_one_plus),
+                (T4th._Word('COUNT'), self._word_count),
+
+                (T4th._Word('VARIABLE'), self._word_variable),
+                (T4th._Word('CONSTANT'), self._word_constant),
+                (T4th._Word('(CONSTANT)', flag=NI), self._word_constant_p),
+                (T4th._Word('2CONSTANT'), self._word_2constant),
+                (T4th._Word('(2CONSTANT)', flag=NI), self._word_2constant_p),
+                (T4th._Word('VALUE'), self._word_value),
+                (T4th._Word('(VALUE)', flag=NI), self._word_constant_p), # 运行时和常量一样，TO改写数据域
+                (T4th._Word('DEFER'), self._word_defer),
+                (T4th._Word('(DEFER)', flag=NI), self._word_defer_p),
+
+                (T4th._Word('CASE', flag=IM|NI), self._word_case),
+                (T4th._Word('OF', flag=IM|NI), self._word_of),
+                (T4th._Word('ENDOF', flag=IM|NI), self._word_endof),
+                (T4th._Word('ENDCASE', flag=IM|NI), self._word_endcase),
+                (T4th._Word('(CASE)', flag=NI), self._word_case_p),
+            ]
+
+        # 加载core.fs或者镜像之后才能用define_primitive；用它定义的词，xt -> (name, func, stack_in, stack_out)
+        self._core_loaded = False
+        self._user_primitives = {}
+
         self._init_vm()
 
     # primitive words implementation
 
     def _word_dot_vm(self):
-        print()
-        print(f'Memory: {self._memory[:self._memory[T4th.MemAddress.DP.value]]}')
-
-        print(f' STACK: {self._data_stack}')
-        print(f'     R: {self._return_stack}')
-        print(f'    PC: {self._pc}')
-        print(f' STATE: {self._get_var_value('STATE')}')
-        print(f'  BASE: {self._base()}')
-        print(f'LATEST: {self._latest_word_ptr}')
+        self._print()
+        cells = self._memory.get_range(0, self._here())
+        base = self._base()
+        self._print(f'Memory: [{", ".join(tn.int_to_base(v, base) if isinstance(v, int) else repr(v) for v in cells)}]')
+
+        self._print(f' STACK: {self._data_stack}')
+        self._print(f'     R: {self._return_stack}')
+        self._print(f'  LOOP: {self._loop_stack}')
+        self._print(f'    PC: {self._pc}')
+        self._print(f' STATE: {self._get_var_value('STATE')}')
+        self._print(f'  BASE: {self._base()}')
+        self._print(f'LATEST: {self._latest_word_ptr}')
 
     def _word_bye(self):
-        print()
+        self._print()
         self._quit = True
 
     def _word_abort(self):
@@ -288,7 +471,7 @@ class T4th:
         input_backup = self._input_backup()
 
         # 准备好evaluate的环境
-        self._in_stream = StringIO('')
+        self._in_stream = SourceReader()
         self._source_addr_set(c_addr)
         self._source_n_set(u)
         self._to_in_set(0)
@@ -297,7 +480,12 @@ class T4th:
         self._evaluating = True
 
         # 执行
-        self.interpret()
+        level = len(self._nested)
+        self._nested.append((len(self._return_stack), pc, 'EVALUATE'))
+        try:
+            self.interpret()
+        finally:
+            del self._nested[level:]
 
         # 还原状态
         self._evaluating = False
@@ -318,10 +506,10 @@ class T4th:
             self._data_stack.append(0)
 
     def _word_words(self):
-        print()
+        self._print()
         p = self._latest_word_ptr
         while p > 0:
-            print(self._memory[p].word_name, end=' ')
+            self._print(self._memory[p].word_name, end=' ')
             p = self._memory[p].prev
 
     def _word_forget(self):
@@ -338,24 +526,23 @@ class T4th:
             raise ValueError('Unclosed parenthesis')
 
     def _word_dot_s(self):
-        print(f'<{len(self._data_stack)}> ', end='', flush=True)
-        for v in self._data_stack:
-            print(f'{tn.int_to_base(v)}', end=' ', flush=True)
+        base = self._base()
+        self._output.write(f'<{len(self._data_stack)}> ' + ''.join(f'{tn.int_to_base(v, base)} ' for v in self._data_stack))
 
     def _word_dot(self):
         self._check_stack(1)
-        print(f'{tn.int_to_base(self._data_stack.pop())} ', end='', flush=True)
+        self._output.write(f'{tn.int_to_base(self._data_stack.pop(), self._base())} ')
 
     def _word_u_dot(self):
         self._check_stack(1)
-        print(f'{tn.int_to_base(tn.i2u(self._data_stack.pop()))} ', end='', flush=True)
+        self._output.write(f'{tn.int_to_base(tn.i2u(self._data_stack.pop()), self._base())} ')
 
     def _word_emit(self):
         self._check_stack(1)
-        print(chr(self._data_stack.pop()), end='', flush=True)
+        self._output.write(chr(self._data_stack.pop()))
 
     def _word_cr(self):
-        print()
+        self._output.write('\n')
 
     def _word_depth(self):
         self._data_stack.append(len(self._data_stack))
@@ -409,19 +596,77 @@ class T4th:
 
         self._memory_append(self._data_stack.pop())
 
-    def _word_move(self):
+    # 整段内存的操作：每次调用检查一次范围，用切片复制、填充和比较
+
+    def _check_range(self, addr:int, u:int):
+        if addr < 0 or addr + u > len(self._memory):
+            raise ValueError(f'Invalid address range: {addr} {u}')
+
+    def _pop_move_args(self):
+        # ( addr1 addr2 u -- )，u不是正数时返回None
         self._check_stack(3)
         u = self._data_stack.pop()
         addr2 = self._data_stack.pop()
         addr1 = self._data_stack.pop()
+        if u <= 0:
+            return None
+        self._check_range(addr1, u)
+        self._check_range(addr2, u)
+        return (addr1, addr2, u)
 
-        if addr1 >= addr2:
-            for i in range(u):
-                self._memory[addr2 + i] = self._memory[addr1 + i]
+    def _word_move(self):
+        args = self._pop_move_args()
+        if args is not None:
+            (addr1, addr2, u) = args
+            self._memory.copy(addr1, addr2, u)
+
+    def _word_cmove(self):
+        # 从低地址向高地址逐个复制，目标在源的后面并且重叠时，源开头的addr2-addr1个字符重复下去
+        args = self._pop_move_args()
+        if args is None:
+            return
+        (addr1, addr2, u) = args
+        d = addr2 - addr1
+        if 0 < d < u:
+            pattern = self._memory.get_range(addr1, addr2)
+            self._memory.set_range(addr2, (pattern * (u // d + 1))[:u])
         else:
-            # 要防止覆盖，从后向前复制
-            for i in range(u-1, -1, -1):
-                self._memory[addr2 + i] = self._memory[addr1 + i]
+            self._memory.copy(addr1, addr2, u)
+
+    def _word_cmove_up(self):
+        # 从高地址向低地址逐个复制，目标在源的前面并且重叠时，源末尾的addr1-addr2个字符向前重复
+        args = self._pop_move_args()
+        if args is None:
+            return
+        (addr1, addr2, u) = args
+        d = addr1 - addr2
+        if 0 < d < u:
+            tail = self._memory.get_range(addr2 + u, addr1 + u)
+            k = -(u - d) % d
+            self._memory.set_range(addr2, ((tail[k:] + tail[:k]) * (u // d + 1))[:u])
+        else:
+            self._memory.copy(addr1, addr2, u)
+
+    def _fill(self, addr:int, u:int, c:int):
+        if u > 0:
+            self._check_range(addr, u)
+            self._memory.fill(addr, u, c)
+
+    def _word_fill(self):
+        self._check_stack(3)
+        c = self._data_stack.pop()
+        u = self._data_stack.pop()
+        self._fill(self._data_stack.pop(), u, c)
+
+    def _word_erase(self):
+        self._check_stack(2)
+        u = self._data_stack.pop()
+        self._fill(self._data_stack.pop(), u, 0)
+
+    def _word_blank(self):
+        self._check_stack(2)
+        u = self._data_stack.pop()
+        self._fill(self._data_stack.pop(), u, ord(' '))
 
     def _word_to_r(self):
         self._check_stack(1)
@@ -441,17 +686,18 @@ class T4th:
     def _word_add(self):
         self._check_stack(2)
 
-        self._data_stack.append(tn.I(self._data_stack.pop()) + tn.I(self._data_stack.pop()))
+        self._data_stack.append(self._data_stack.pop() + self._data_stack.pop())
 
     def _word_sub(self):
         self._check_stack(2)
 
-        self._data_stack.append(tn.I(-self._data_stack.pop()) - tn.I(-self._data_stack.pop()))
+        n2 = self._data_stack.pop()
+        self._data_stack.append(self._data_stack.pop() - n2)
 
     def _word_mul(self):
         self._check_stack(2)
 
-        self._data_stack.append(tn.I(self._data_stack.pop()) * tn.I(self._data_stack.pop()))
+        self._data_stack.append(self._data_stack.pop() * self._data_stack.pop())
 
     def _word_div(self):
         self._check_stack(2)
@@ -565,7 +811,7 @@ class T4th:
 
     def _word_invert(self):
         self._check_stack(1)
-        self._data_stack.append(tn.I(self._data_stack.pop()).invert())
+        self._data_stack.append(~self._data_stack.pop())
 
     def _word_and(self):
         self._check_stack(2)
@@ -582,12 +828,12 @@ class T4th:
     def _word_rshift(self):
         self._check_stack(2)
         shift = self._data_stack.pop()
-        self._data_stack.append(tn.I(self._data_stack.pop()).rshift(shift))
+        self._data_stack.append(tn.i2u(self._data_stack.pop()) >> shift)
 
     def _word_lshift(self):
         self._check_stack(2)
         shift = self._data_stack.pop()
-        self._data_stack.append(tn.I(self._data_stack.pop()).lshift(shift))
+        self._data_stack.append(tn.i2u(self._data_stack.pop()) << shift)
 
     def _word_less(self):
         self._check_stack(2)
@@ -608,25 +854,161 @@ class T4th:
     def _word_compare(self):
         self._check_stack(4)
 
-        u2 = self._data_stack.pop()
+        u2 = max(self._data_stack.pop(), 0)
         addr2 = self._data_stack.pop()
-        u1 = self._data_stack.pop()
+        u1 = max(self._data_stack.pop(), 0)
         addr1 = self._data_stack.pop()
+        self._check_range(addr1, u1)
+        self._check_range(addr2, u2)
 
-        for i in range(min(u1, u2)):
-            if self._memory[addr1 + i] < self._memory[addr2 + i]:
-                self._data_stack.append(-1)
-                return
-            elif self._memory[addr1 + i] > self._memory[addr2 + i]:
-                self._data_stack.append(1)
-                return
+        # 列表按字典序比较，较短的是另一个的前缀时较小
+        s1 = self._memory.get_range(addr1, addr1 + u1)
+        s2 = self._memory.get_range(addr2, addr2 + u2)
+        self._data_stack.append((s1 > s2) - (s1 < s2))
 
-        if u1 < u2:
-            self._data_stack.append(-1)
-        elif u1 > u2:
-            self._data_stack.append(1)
-        else:
-            self._data_stack.append(0)
+    # 加速核心
+
+    def _word_rot(self):
+        self._check_stack(3)
+
+        self._data_stack.append(self._data_stack.pop(-3))
+
+    def _word_minus_rot(self):
+        self._check_stack(3)
+
+        self._data_stack.insert(-2, self._data_stack.pop())
+
+    def _word_nip(self):
+        self._check_stack(2)
+
+        del self._data_stack[-2]
+
+    def _word_tuck(self):
+        self._check_stack(2)
+
+        self._data_stack.insert(-2, self._data_stack[-1])
+
+    def _word_2dup(self):
+        self._check_stack(2)
+
+        self._data_stack.extend(self._data_stack[-2:])
+
+    def _word_2drop(self):
+        self._check_stack(2)
+
+        del self._data_stack[-2:]
+
+    def _word_2over(self):
+        self._check_stack(4)
+
+        self._data_stack.extend(self._data_stack[-4:-2])
+
+    def _word_2swap(self):
+        self._check_stack(4)
+
+        self._data_stack[-4:] = self._data_stack[-2:] + self._data_stack[-4:-2]
+
+    def _word_one_plus(self):
+        self._check_stack(1)
+
+        self._data_stack[-1] += 1
+
+    def _word_one_minus(self):
+        self._check_stack(1)
+
+        self._data_stack[-1] -= 1
+
+    def _word_negate(self):
+        self._check_stack(1)
+
+        self._data_stack[-1] = -self._data_stack[-1]
+
+    def _word_abs(self):
+        self._check_stack(1)
+
+        self._data_stack[-1] = abs(self._data_stack[-1])
+
+    def _word_equ(self):
+        self._check_stack(2)
+        self._data_stack.append(-1 if self._data_stack.pop() == self._data_stack.pop() else 0)
+
+    def _word_not_equ(self):
+        self._check_stack(2)
+        self._data_stack.append(-1 if self._data_stack.pop() != self._data_stack.pop() else 0)
+
+    def _word_greater(self):
+        self._check_stack(2)
+        self._data_stack.append(-1 if self._data_stack.pop() < self._data_stack.pop() else 0)
+
+    def _word_u_greater(self):
+        self._check_stack(2)
+        self._data_stack.append(-1 if tn.i2u(self._data_stack.pop()) < tn.i2u(self._data_stack.pop()) else 0)
+
+    def _word_min(self):
+        self._check_stack(2)
+        self._data_stack.append(min(self._data_stack.pop(), self._data_stack.pop()))
+
+    def _word_max(self):
+        self._check_stack(2)
+        self._data_stack.append(max(self._data_stack.pop(), self._data_stack.pop()))
+
+    def _word_plus_store(self):
+        self._check_stack(2)
+
+        addr = self._data_stack.pop()
+        x = self._data_stack.pop()
+        self._memory[addr] += x
+
+    def _word_count(self):
+        self._check_stack(1)
+
+        addr = self._data_stack.pop()
+        self._data_stack.append(addr + 1)
+        self._data_stack.append(self._memory[addr])
+
+    # 定义词：值放在数据域（xt+1），>BODY、TO、DEFER!和DEFER@照旧读写数据域，
+    # 执行时由代码域的原语直接取值，不经过DOES>的线索代码
+
+    def _word_variable(self):
+        self._create_with('(CREATE)')
+        self._memory_append(0)
+
+    def _word_constant(self):
+        self._check_stack(1)
+        self._create_with('(CONSTANT)')
+        self._memory_append(self._data_stack.pop())
+
+    def _word_constant_p(self):
+        self._data_stack.append(self._memory[self._exec_pc + 1])
+
+    def _word_2constant(self):
+        self._check_stack(2)
+        self._create_with('(2CONSTANT)')
+        # 和2!的顺序一样，x2在前
+        x2 = self._data_stack.pop()
+        x1 = self._data_stack.pop()
+        self._memory_append(x2)
+        self._memory_append(x1)
+
+    def _word_2constant_p(self):
+        body = self._exec_pc + 1
+        self._data_stack.append(self._memory[body + 1])
+        self._data_stack.append(self._memory[body])
+
+    def _word_value(self):
+        self._check_stack(1)
+        self._create_with('(VALUE)')
+        self._memory_append(self._data_stack.pop())
+
+    def _word_defer(self):
+        self._create_with('(DEFER)')
+        self._memory_append(self._find_word('ABORT').ptr)
+
+    def _word_defer_p(self):
+        # 和EXECUTE一样直接执行数据域中的xt
+        xt = self._memory[self._exec_pc + 1]
+        self._exec_pc = xt
+        self._memory[xt]()
 
     def _word_docol(self):
         self._return_stack.append(self._pc)
@@ -655,11 +1037,20 @@ class T4th:
 
     def _word_end_def(self):
         self._check_return_stack(1)
-        self._return_stack.pop()
+        if any(isinstance(v, T4th._CaseSys) for v in self._data_stack):
+            # 没有ENDCASE的CASE，不把编译用的对象留在数据栈上
+            self._data_stack[:] = [v for v in self._data_stack if not isinstance(v, T4th._CaseSys)]
+            raise ValueError('Unterminated CASE')
+        xt = self._return_stack.pop()
 
         self._memory_append(self._find_word('EXIT').ptr)
         self._set_var_value('STATE', 0)
 
+        if self._peephole:
+            peephole.optimize(self, xt + 1)
+        if self._compile_closures:
+            self._compile_word(xt)
+
     def _word_exit(self):
         self._check_return_stack(1)
 
@@ -671,8 +1062,16 @@ class T4th:
         self._memory_append(self._return_stack[-1])
 
     def _word_immediate(self):
+        self._set_latest_flag(T4th._Word.FLAG_IMMEDIATE)
+
+    def _word_inline(self):
+        self._set_latest_flag(T4th._Word.FLAG_INLINE)
+
+    def _set_latest_flag(self, flag:int):
+        # 换一个新的词头，不改原来的对象，检查点中的词头保持不变
         if self._latest_word_ptr > 0:
-            self._memory[self._latest_word_ptr].flag |= T4th._Word.FLAG_IMMEDIATE
+            w = self._memory[self._latest_word_ptr]
+            self._memory[self._latest_word_ptr] = T4th._Word(w.word_name, w.ptr, w.flag | flag, w.prev)
 
     def _word_postpone(self):
         word_name = self._get_next_word()
@@ -697,25 +1096,53 @@ class T4th:
         self._data_stack.append(self._exec_pc + 1)
 
     def _word_create(self):
+        self._create_with('(CREATE)')
+
+    def _create_with(self, runtime_name:str):
+        # 定义一个词，代码域是runtime_name的代码域
         word_name = self._get_next_word()
 
-        create_p = self._find_word('(CREATE)')
+        runtime = self._find_word(runtime_name)
         w = T4th._Word(word_name, self._here() + 1, prev=self._latest_word_ptr)
         self._add_word(w)
-        self._memory_append(self._memory[create_p.ptr])
+        self._memory_append(self._memory[runtime.ptr])
 
     def _new_does_p(self, jmp_ptr):
         def does_p():
             self._data_stack.append(self._exec_pc + 1)
 
-            self._return_stack.append(self._pc)
-            self._pc = jmp_ptr
+            body = self._compiled_does.get(jmp_ptr) if self._step_limit is None else None
+            if body is not None:
+                body()
+            else:
+                self._return_stack.append(self._pc)
+                self._pc = jmp_ptr
 
         return does_p
 
+    def _compile_word(self, xt:int):
+        code = self._memory[xt]
+        if not isinstance(code, T4th._PrimitiveWord) or code.ptr != self._word_docol:
+            return
+
+        result = compile_thread(self, xt + 1)
+        if result is None:
+            return
+
+        (fn, does_addrs) = result
+        self._memory[xt] = T4th._CompiledWord(code.name, fn, self)
+
+        # DOES>之后的代码单独编译
+        while does_addrs:
+            addr = does_addrs.pop()
+            result = compile_thread(self, addr)
+            if result is not None:
+                self._compiled_does[addr] = result[0]
+                does_addrs.extend(result[1])
+
     def _word_does(self):
         jmp_ptr = self._pc
-        does_p = T4th._PrimitiveWord('(DOES>)', self._new_does_p(jmp_ptr))
+        does_p = T4th._DoesWord(jmp_ptr, self._new_does_p(jmp_ptr))
         this_word = self._memory[self._latest_word_ptr]
         self._memory[this_word.ptr] = does_p
 
@@ -733,6 +1160,121 @@ class T4th:
         self._data_stack.append(value)
         self._pc += 1
 
+    # 超级指令，由窥孔优化写入线索代码。执行时_pc指向融合序列的第二个单元。
+
+    def _word_lit_plus(self):
+        # (LITERAL) n +
+        self._check_stack(1)
+        self._data_stack[-1] += self._memory[self._pc]
+        self._pc += 2
+
+    def _word_lit_minus(self):
+        # (LITERAL) n -
+        self._check_stack(1)
+        self._data_stack[-1] -= self._memory[self._pc]
+        self._pc += 2
+
+    def _word_lit_equ(self):
+        # (LITERAL) n =
+        self._check_stack(1)
+        self._data_stack[-1] = -1 if self._data_stack[-1] == self._memory[self._pc] else 0
+        self._pc += 2
+
+    def _word_equ_0branch(self):
+        # = 0BRANCH addr
+        self._check_stack(2)
+        if self._data_stack.pop() != self._data_stack.pop():
+            self._pc = self._memory[self._pc + 1]
+        else:
+            self._pc += 2
+
+    def _word_zero_equ_0branch(self):
+        # 0= 0BRANCH addr
+        self._check_stack(1)
+        if self._data_stack.pop() != 0:
+            self._pc = self._memory[self._pc + 1]
+        else:
+            self._pc += 2
+
+    def _word_over_equ_0branch(self):
+        # OVER = 0BRANCH addr
+        self._check_stack(2)
+        if self._data_stack.pop() != self._data_stack[-1]:
+            self._pc = self._memory[self._pc + 2]
+        else:
+            self._pc += 3
+
+    def _word_dup_zero_equ_0branch(self):
+        # DUP 0= 0BRANCH addr
+        self._check_stack(1)
+        if self._data_stack[-1] != 0:
+            self._pc = self._memory[self._pc + 2]
+        else:
+            self._pc += 3
+
+    def _word_rdrop(self):
+        # R> DROP
+        self._check_return_stack(1)
+        self._return_stack.pop()
+        self._pc += 1
+
+    def _unfused_xt(self, code) -> Optional[int]:
+        # 超级指令对应的原来的第一条指令，不是超级指令时返回None
+        names = peephole.FUSED.get(code.name)
+        if names is None:
+            return None
+        return self._memory[self._word_index[names[0]][0]].ptr
+
+    def _word_see(self):
+        word_name = self._get_next_word()
+        w = self._find_word(word_name)
+        code = self._memory[w.ptr]
+
+        self._print()
+        if not isinstance(code, T4th._PrimitiveWord) or code.name != 'DOCOL':
+            self._print(f'{w.word_name} is not a colon definition', end='')
+            return
+
+        self._print(f': {w.word_name}')
+        base = self._base()
+        for (addr, name, args) in peephole.listing(self, w.ptr + 1):
+            self._print(f'  {addr} {" ".join([name] + [self._see_arg(a, base) for a in args])}')
+        self._print(f';{" IMMEDIATE" if w.is_immediate() else ""}', end='')
+
+    def _see_arg(self, arg, base:int) -> str:
+        if isinstance(arg, T4th._CaseTable):
+            targets = [f'{tn.int_to_base(v, base)}:{tn.int_to_base(addr, base)}' for (v, addr) in arg.targets.items()]
+            return ' '.join(targets + [f'ELSE:{tn.int_to_base(arg.default, base)}'])
+        return tn.int_to_base(arg, base)
+
+    def _word_profile_on(self):
+        self.profile_start()
+
+    def _word_profile_off(self):
+        self.profile_stop()
+
+    def _word_dot_profile(self):
+        report = self.profile_report()
+        self._print()
+        if report is None:
+            self._print('No profile', end='')
+        else:
+            self._print(report.format(limit=30), end='')
+
+    def _word_sample_on(self):
+        self.sample_start()
+
+    def _word_sample_off(self):
+        self.sample_stop()
+
+    def _word_dot_samples(self):
+        report = self.sample_report()
+        self._print()
+        if report is None:
+            self._print('No samples', end='')
+        else:
+            self._print(report.collapsed(), end='')
+
     def _word_char(self):
         word_name = self._get_next_word()
         ch = word_name[0]
@@ -780,6 +1322,23 @@ class T4th:
         else:
             self._pc += 1
 
+    def _word_bracket_if(self):
+        self._check_stack(1)
+
+        if self._data_stack.pop() == 0:
+            self._word_bracket_else()
+
+    def _word_bracket_then(self):
+        pass
+
+    def _word_bracket_defined(self):
+        word_name = self._get_next_word()
+        self._data_stack.append(0 if self._find_word_ptr(word_name) == 0 else -1)
+
+    def _word_bracket_undefined(self):
+        word_name = self._get_next_word()
+        self._data_stack.append(-1 if self._find_word_ptr(word_name) == 0 else 0)
+
     def _word_bracket_else(self):
         level = 1
         while True:
@@ -803,149 +1362,250 @@ class T4th:
     def _word_do(self):
         """
         编译后：
-        +----+------------+-----+
-        | DO | leave_addr | ... |
-        +----+-----+------+-----+
-                   |           ^
-                   |           |
-        +-------+  |           +-----+
-        | LEAVE |  +---------+       |
-        +-------+            |       |
-                             V       |
-        +------+-----------+-----+   |
-        | LOOP | loop_addr | ... |   |
-        +------+-----+-----+-----+   |
-                     |               |
-                     +---------------+
-
-        运行时的返回栈：
-        ( R: leave_addr limit index )
+        +------+------------+-----+
+        | (DO) | leave_addr | ... |
+        +------+-----+------+-----+
+                     |           ^
+                     |           |
+        +-------+    |           +-----+
+        | LEAVE |    +---------+       |
+        +-------+              |       |
+                               V       |
+        +--------+-----------+-----+   |
+        | (LOOP) | loop_addr | ... |   |
+        +--------+-----+-----+-----+   |
+                       |               |
+                       +---------------+
+
+        运行时的循环栈（和返回栈分开）：
+        ( L: leave_addr limit index )
         """
-        if self._get_var_value('STATE') != 0:
-            # 定义中
-            self._memory_append(self._find_word('DO').ptr)
-            self._data_stack.append(self._here()) # 需要loop在编译时回填的leave_addr的位置
-            self._memory_append(0) # 填0占位
-        else:
-            # 运行时
-            index = self._data_stack.pop()
-            limit = self._data_stack.pop()
+        self._memory_append(self._find_word('(DO)').ptr)
+        self._data_stack.append(self._here()) # 需要loop在编译时回填的leave_addr的位置
+        self._memory_append(0) # 填0占位
 
-            self._return_stack.append(self._memory[self._pc])
-            self._return_stack.append(limit)
-            self._return_stack.append(index)
-            self._pc += 1
+    def _word_do_p(self):
+        self._do_runtime(self._memory[self._pc])
+        self._pc += 1
+
+    def _do_runtime(self, leave_addr):
+        index = self._data_stack.pop()
+        limit = self._data_stack.pop()
+
+        self._loop_stack += (leave_addr, limit, index)
 
     def _word_question_do(self):
-        if self._get_var_value('STATE') != 0:
-            # 定义中
-            self._memory_append(self._find_word('?DO').ptr)
-            self._data_stack.append(self._here()) # 需要loop在编译时回填的leave_addr的位置
-            self._memory_append(0) # 填0占位
+        self._memory_append(self._find_word('(?DO)').ptr)
+        self._data_stack.append(self._here()) # 需要loop在编译时回填的leave_addr的位置
+        self._memory_append(0) # 填0占位
+
+    def _word_question_do_p(self):
+        leave_addr = self._memory[self._pc]
+        if self._question_do_runtime(leave_addr):
+            self._pc += 1
         else:
-            # 运行时
-            index = self._data_stack.pop()
-            limit = self._data_stack.pop()
-            leave_addr = self._memory[self._pc]
-
-            if limit != index:
-                self._return_stack.append(leave_addr)
-                self._return_stack.append(limit)
-                self._return_stack.append(index)
-                self._pc += 1
-            else:
-                self._pc = leave_addr
+            self._pc = leave_addr
+
+    def _question_do_runtime(self, leave_addr) -> bool:
+        # 返回是否进入循环
+        index = self._data_stack.pop()
+        limit = self._data_stack.pop()
+
+        if limit == index:
+            return False
+
+        self._loop_stack += (leave_addr, limit, index)
+        return True
+
+    def _compile_loop_end(self, runtime_name:str):
+        self._check_stack(1)
+        self._memory_append(self._find_word(runtime_name).ptr)
+        leave_fill_addr = self._data_stack.pop()
+        self._memory_append(leave_fill_addr + 1)
+        self._memory[leave_fill_addr] = self._here()
 
     def _word_loop(self):
-        if self._get_var_value('STATE') != 0:
-            # 定义中
-            self._check_stack(1)
-            self._memory_append(self._find_word('LOOP').ptr)
-            leave_fill_addr = self._data_stack.pop()
-            self._memory_append(leave_fill_addr + 1)
-            self._memory[leave_fill_addr] = self._here()
+        self._compile_loop_end('(LOOP)')
+
+    def _word_loop_p(self):
+        if self._loop_runtime():
+            self._pc = self._memory[self._pc]
         else:
-            # 运行时
-            self._check_return_stack(3)
-            index = self._return_stack[-1]
-            limit = self._return_stack[-2]
+            self._pc += 1
 
-            index += 1
-            index = tn.I(index).value
+    def _loop_runtime(self) -> bool:
+        # 返回是否继续循环
+        ls = self._loop_stack
+        if len(ls) < 3:
+            self._check_loop_stack(1)
+        index = ls[-1] + 1
+        if index == tn.int_sign:
+            index = tn.int_min
 
-            if index < limit:
-                self._return_stack[-1] = index
-                self._pc = self._memory[self._pc]
-            else:
-                self._return_stack.pop()
-                self._return_stack.pop()
-                self._return_stack.pop()
-                self._pc += 1
+        if index < ls[-2]:
+            ls[-1] = index
+            return True
+
+        del ls[-3:]
+        return False
 
     def _word_plus_loop(self):
-        if self._get_var_value('STATE') != 0:
-            # 定义中
-            self._check_stack(1)
-            self._memory_append(self._find_word('+LOOP').ptr)
-            leave_fill_addr = self._data_stack.pop()
-            self._memory_append(leave_fill_addr + 1)
-            self._memory[leave_fill_addr] = self._here()
+        self._compile_loop_end('(+LOOP)')
+
+    def _word_plus_loop_p(self):
+        if self._plus_loop_runtime():
+            self._pc = self._memory[self._pc]
         else:
-            # 运行时
-            self._check_return_stack(3)
-            index = self._return_stack[-1]
-            limit = self._return_stack[-2]
+            self._pc += 1
 
+    def _plus_loop_runtime(self) -> bool:
+        # 返回是否继续循环
+        ls = self._loop_stack
+        if len(ls) < 3:
+            self._check_loop_stack(1)
+        if not self._data_stack:
             self._check_stack(1)
 
-            step = self._data_stack.pop()
-            old_index = index
-            index += step
-            index = tn.I(index).value
-
-            if not (
-                (step > 0 and
-                    (tn.I(limit) - tn.I(old_index)).value > 0 and
-                    (tn.I(index) - tn.I(limit)).value >= 0)
-                or
-                (step < 0 and
-                    (tn.I(limit) - tn.I(old_index)).value <= 0 and
-                    (tn.I(index) - tn.I(limit)).value < 0)):
-                self._return_stack[-1] = index
-                self._pc = self._memory[self._pc]
-            else:
-                self._return_stack.pop()
-                self._return_stack.pop()
-                self._return_stack.pop()
-                self._pc += 1
+        step = self._data_stack.pop()
+        index = ls[-1]
+        limit = ls[-2]
+
+        # 按无符号的偏移index-limit判断是否越过limit-1和limit之间的边界
+        mask = tn.int_mask
+        sign = tn.int_sign
+        offset = (index - limit) & mask
+        new_offset = (offset + step) & mask
+        if step > 0:
+            done = offset > sign and new_offset < sign
+        elif step < 0:
+            done = offset <= sign and new_offset >= sign
+        else:
+            done = False
+
+        if not done:
+            ls[-1] = ((index + step + sign) & mask) - sign
+            return True
+
+        del ls[-3:]
+        return False
 
     def _word_leave(self):
-        self._check_return_stack(3)
-        self._return_stack.pop()
-        self._return_stack.pop()
-        leave_addr = self._return_stack.pop()
-        self._pc = leave_addr
+        self._pc = self._leave_runtime()
+
+    def _leave_runtime(self) -> int:
+        ls = self._loop_stack
+        if len(ls) < 3:
+            self._check_loop_stack(1)
+        leave_addr = ls[-3]
+        del ls[-3:]
+        return leave_addr
 
     def _word_unloop(self):
-        self._check_return_stack(3)
-        self._return_stack.pop()
-        self._return_stack.pop()
-        self._return_stack.pop()
+        ls = self._loop_stack
+        if len(ls) < 3:
+            self._check_loop_stack(1)
+        del ls[-3:]
 
     def _word_i(self):
-        self._check_return_stack(3)
-        self._data_stack.append(self._return_stack[-1])
+        ls = self._loop_stack
+        if len(ls) < 3:
+            self._check_loop_stack(1)
+        self._data_stack.append(ls[-1])
 
     def _word_j(self):
-        self._check_return_stack(6)
-        self._data_stack.append(self._return_stack[-4])
+        ls = self._loop_stack
+        if len(ls) < 6:
+            self._check_loop_stack(2)
+        self._data_stack.append(ls[-4])
 
     def _word_k(self):
-        self._check_return_stack(9)
-        self._data_stack.append(self._return_stack[-7])
+        ls = self._loop_stack
+        if len(ls) < 9:
+            self._check_loop_stack(3)
+        self._data_stack.append(ls[-7])
+
+    def _word_case(self):
+        """
+        每个OF编译成 OVER = 0BRANCH next DROP，ENDOF编译成 BRANCH end。
+        所有OF的选择值都是(LITERAL)时，ENDCASE把第一个分支的(LITERAL) n改成
+        (CASE) table，一次查表跳到匹配的OF之后，其余的比较不再执行：
+        +--------+-------+------+---+---------+------+------+------+
+        | (CASE) | table | OVER | = | 0BRANCH | next | DROP | ...  |
+        +--------+-------+------+---+---------+------+------+------+
+        """
+        self._data_stack.append(T4th._CaseSys(self._here()))
+
+    def _pop_case_sys(self) -> _CaseSys:
+        self._check_stack(1)
+        case_sys = self._data_stack.pop()
+        if not isinstance(case_sys, T4th._CaseSys):
+            raise ValueError('Unmatched CASE')
+        return case_sys
+
+    def _word_of(self):
+        case_sys = self._pop_case_sys()
+        # 分支只有一个(LITERAL) n时可以查表
+        start = case_sys.clause_start
+        value = None
+        if self._here() == start + 2 and self._memory[start] == self._core_xt('(LITERAL)'):
+            value = self._memory[start + 1]
+
+        self._memory_append(self._core_xt('OVER'))
+        self._memory_append(self._core_xt('='))
+        self._memory_append(self._core_xt('0BRANCH'))
+        next_fill_addr = self._here()
+        self._memory_append(0) # 填0占位
+        self._memory_append(self._core_xt('DROP'))
+        case_sys.clauses.append((value, self._here(), next_fill_addr))
+
+        self._data_stack.append(case_sys)
+
+    def _word_endof(self):
+        case_sys = self._pop_case_sys()
+        if not case_sys.clauses:
+            raise ValueError('ENDOF without OF')
+        (value, body_addr, next_fill_addr) = case_sys.clauses[-1]
+
+        self._memory_append(self._core_xt('BRANCH'))
+        end_fill_addr = self._here()
+        self._memory_append(0) # 填0占位，ENDCASE回填
+        self._memory[next_fill_addr] = self._here()
+        case_sys.clauses[-1] = (value, body_addr, end_fill_addr)
+        case_sys.clause_start = self._here()
+
+        self._data_stack.append(case_sys)
+
+    def _word_endcase(self):
+        case_sys = self._pop_case_sys()
+        default = case_sys.clause_start
+
+        self._memory_append(self._core_xt('DROP'))
+        for (_, _, end_fill_addr) in case_sys.clauses:
+            self._memory[end_fill_addr] = self._here()
+
+        clauses = case_sys.clauses
+        if clauses and all(value is not None for (value, _, _) in clauses):
+            targets = {}
+            for (value, body_addr, _) in clauses:
+                targets.setdefault(value, body_addr) # 同一个值只有第一个OF会匹配
+            # 第一个分支的(LITERAL) n
+            self._memory[case_sys.start] = self._core_xt('(CASE)')
+            self._memory[case_sys.start + 1] = T4th._CaseTable(targets, default)
+
+    def _word_case_p(self):
+        table = self._memory[self._pc]
+        if not self._data_stack:
+            self._check_stack(1)
+        addr = table.targets.get(self._data_stack[-1])
+        if addr is None:
+            self._pc = table.default
+        else:
+            self._data_stack.pop()
+            self._pc = addr
 
     def _word_key(self):
-        key = get_raw_input(self._in_stream)
+        self._output.flush()
+        key = self._wait_input(get_raw_input, self._in_stream)
 
         if not key:
             self._data_stack.append(0)
@@ -959,20 +1619,20 @@ class T4th:
         n1 = self._data_stack.pop()
         addr = self._data_stack.pop()
 
-        _input_buffer = get_input_line(prompt='', stream=self._in_stream, max_length=n1)
+        self._output.flush()
+        _input_buffer = self._wait_input(get_input_line, prompt='', stream=self._in_stream, max_length=n1)
 
         n2 = 0
         if _input_buffer is not None:
             n2 = len(_input_buffer)
-
-        for i in range(n2):
-            self._memory[addr + i] = ord(_input_buffer[i])
+            self._memory.set_str(addr, _input_buffer)
 
         self._data_stack.append(n2)
 
 
     def _word_refill(self):
-        _input_buffer = get_input_line(prompt=self._prompt, stream=self._in_stream)
+        self._flush_before_prompt()
+        _input_buffer = self._wait_input(get_input_line, prompt=self._prompt, stream=self._in_stream)
         self._to_in_set(0)
         if _input_buffer is None:
             self._source_n_set(0)
@@ -980,10 +1640,7 @@ class T4th:
             self._data_stack.append(0)
             return
 
-        copy_len = min(self._in_buf_len(), len(_input_buffer))
-        for i in range(copy_len):
-            self._memory[self._source_addr() + i] = ord(_input_buffer[i])
-        self._source_n_set(copy_len)
+        self._set_source_line(_input_buffer)
 
         self._data_stack.append(-1)
 
@@ -1017,8 +1674,8 @@ class T4th:
         # 复制到PAD中部
         c_addr = T4th.MemAddress.PAD_BUFFER.value + (T4th.MemAddress.PAD_BUFFER_LEN.value // 2)
         self._memory[c_addr] = u
-        for i in range(u):
-            self._memory[c_addr + 1 + i] = self._memory[self._source_addr() + in_begin + i]
+        src = self._source_addr() + in_begin
+        self._memory.set_range(c_addr + 1, self._memory.get_range(src, src + u))
 
         self._data_stack.append(c_addr)
 
@@ -1028,9 +1685,7 @@ class T4th:
         u = self._data_stack.pop()
         addr = self._data_stack.pop()
 
-        for i in range(u):
-            ch_ord = self._memory[addr + i]
-            print(chr(ch_ord), end='', flush=True)
+        self._output.write(self._memory.get_str(addr, addr + u))
 
     def _word_to_number(self):
         self._check_stack(4)
@@ -1042,13 +1697,14 @@ class T4th:
 
         ud = tn.ud2i(u1, u2)
 
+        base = self._base()
         i = 0
         while i < n:
             ch = chr(self._memory[addr + i])
-            d = tn.ch_to_int(ch)
+            d = tn.ch_to_int(ch, base)
             if d < 0:
                 break
-            ud = ud * self._base() + d
+            ud = ud * base + d
             i += 1
 
         (u1, u2) = tn.i2d(ud)
@@ -1095,14 +1751,17 @@ class T4th:
 
         input_backup = self._input_backup()
 
+        level = len(self._nested)
         try:
             pc = self._pc
             self._in_stream = f
             self._source_n_set(0)
             self._to_in_set(0)
 
+            self._nested.append((len(self._return_stack), pc, 'INCLUDED'))
             self.interpret()
         finally:
+            del self._nested[level:]
             f.close()
             self._input_restore(input_backup)
             self._pc = pc
@@ -1110,6 +1769,22 @@ class T4th:
 
     # 辅助函数
 
+    def _print(self, s:str='', end:str='\n'):
+        self._output.write(s + end)
+
+    def _wait_input(self, read, *args, **kwargs):
+        # 等待输入的时间不算作采样
+        self._waiting_input = True
+        try:
+            return read(*args, **kwargs)
+        finally:
+            self._waiting_input = False
+
+    def _flush_before_prompt(self):
+        # 提示符由get_input_line直接写到标准输出，先写出缓冲的内容，保证顺序
+        if echoes_prompt(self._in_stream):
+            self._output.flush()
+
     def _check_stack(self, depth):
         if len(self._data_stack) < depth:
             raise ValueError(f'Stack underflow: {len(self._data_stack)} < {depth}')
@@ -1118,6 +1793,11 @@ class T4th:
         if len(self._return_stack) < depth:
             raise ValueError(f'Return stack underflow: {len(self._return_stack)} < {depth}')
 
+    def _check_loop_stack(self, depth):
+        # depth是循环的层数，每层三个单元
+        if len(self._loop_stack) < depth * 3:
+            raise ValueError(f'Loop stack underflow: {len(self._loop_stack) // 3} < {depth}')
+
     def _base(self):
         return self._get_var_value('BASE')
 
@@ -1131,48 +1811,74 @@ class T4th:
         self._memory[T4th.MemAddress.DP.value] += 1
 
     def _forget_p(self, p:int):
+        # 从最新的词开始，把p及之后定义的词从索引中移除
+        q = self._latest_word_ptr
+        while q >= p and q > 0:
+            w = self._memory[q]
+            ptrs = self._word_index[w.word_name]
+            ptrs.pop()
+            if not ptrs:
+                del self._word_index[w.word_name]
+            q = w.prev
+
         w = self._memory[p]
         self._memory[T4th.MemAddress.DP.value] = p
         self._latest_word_ptr = w.prev
 
+        self._inline_bodies = {xt: body for (xt, body) in self._inline_bodies.items() if xt < p}
+
     def _copy_counted_str(self, c_addr:int, n:int = -1) -> str:
         if n == -1:
             n = self._memory[c_addr]
             c_addr += 1
-        s = ''
-        for i in range(n):
-            s += chr(self._memory[c_addr + i])
-        return s
+        return self._memory.get_str(c_addr, c_addr + n)
 
     def _in_buf_len(self):
         return T4th.MemAddress.IN_BUFFER_LEN.value
 
     def _source_addr(self):
-        return self._get_var_value('SOURCE_P')
+        return self._memory[T4th._VAR_ADDR['SOURCE_P']]
 
     def _source_addr_set(self, v):
-        self._set_var_value('SOURCE_P', v)
+        self._memory[T4th._VAR_ADDR['SOURCE_P']] = v
+        self._source_text = None
 
     def _source_n(self):
-        return self._get_var_value('SOURCE_N')
+        return self._memory[T4th._VAR_ADDR['SOURCE_N']]
 
     def _source_n_set(self, v):
-        self._set_var_value('SOURCE_N', v)
+        self._memory[T4th._VAR_ADDR['SOURCE_N']] = v
+        self._source_text = None
 
     def _to_in(self):
-        return self._get_var_value('TO_IN')
+        return self._memory[T4th._VAR_ADDR['TO_IN']]
 
     def _to_in_inc(self):
         self._inc_var('TO_IN')
 
     def _to_in_set(self, v):
-        self._set_var_value('TO_IN', v)
+        self._memory[T4th._VAR_ADDR['TO_IN']] = v
+
+    def _source_str(self) -> str:
+        # 当前输入行的字符串副本，用于解析。内存中的副本是SOURCE看到的内容，>IN只保存在内存中。
+        # SOURCE的地址或长度被修改后从内存重新读。
+        if self._source_text is None:
+            addr = self._source_addr()
+            self._source_text = self._memory.get_str(addr, addr + self._source_n())
+        return self._source_text
+
+    def _set_source_line(self, line:str):
+        # 把读到的一行复制到输入缓冲区
+        line = line[:self._in_buf_len()]
+        self._memory.set_str(self._source_addr(), line)
+        self._source_n_set(len(line))
+        self._source_text = line
 
     def _input_backup(self):
         stream_pos = 0 if not self._in_stream.seekable() else self._in_stream.tell()
         in_stream = self._in_stream
 
-        source_content = self._memory[self._source_addr():self._source_addr() + self._source_n()]
+        source_content = self._memory.get_range(self._source_addr(), self._source_addr() + self._source_n())
         source_addr = self._source_addr()
         source_n = self._source_n()
         to_in = self._to_in()
@@ -1185,7 +1891,7 @@ class T4th:
         self._source_addr_set(source_addr)
         self._source_n_set(source_n)
         self._to_in_set(to_in)
-        self._memory[source_addr:source_addr + source_n] = source_content
+        self._memory.set_range(source_addr, source_content)
 
         self._in_stream = in_stream
         if self._in_stream.seekable():
@@ -1194,53 +1900,45 @@ class T4th:
     # IO函数
 
     def _skip_chars(self, c):
-        while self._to_in() < self._source_n():
-            ch_ord = self._memory[self._source_addr() + self._to_in()]
-            if chr(ch_ord) != c:
-                break
-
-            self._to_in_inc()
+        text = self._source_str()
+        to_in = self._to_in()
+        if to_in < len(text):
+            self._to_in_set(len(text) - len(text[to_in:].lstrip(c)))
 
     def _get_until_char(self, c) -> bool:
-        while self._to_in() < self._source_n():
-            ch_ord = self._memory[self._source_addr() + self._to_in()]
-            if chr(ch_ord) == c:
-                self._to_in_inc()
-                return True
-            self._to_in_inc()
-        return False
+        text = self._source_str()
+        to_in = self._to_in()
+        if to_in >= len(text):
+            return False
+
+        i = text.find(c, to_in)
+        if i < 0:
+            self._to_in_set(len(text))
+            return False
+        self._to_in_set(i + 1)
+        return True
 
     def _get_next_word_or_none(self) -> Optional[str]:
         if self._source_n() == 0:
-            _input_buffer = get_input_line(prompt=self._prompt, stream=self._in_stream)
+            self._flush_before_prompt()
+            _input_buffer = self._wait_input(get_input_line, prompt=self._prompt, stream=self._in_stream)
             self._to_in_set(0)
             if _input_buffer is None:
                 self._source_n_set(0)
                 return None
 
             # 复制输入内容到memory
-            copy_len = min(self._in_buf_len(), len(_input_buffer))
-            for i in range(copy_len):
-                self._memory[self._source_addr() + i] = ord(_input_buffer[i])
-            self._source_n_set(copy_len)
+            self._set_source_line(_input_buffer)
 
-        if self._to_in() >= self._source_n():
+        # 跳过前面的空白，取到下一个空白为止，并跳过这一个空白
+        m = T4th._TOKEN_RE.match(self._source_str(), self._to_in())
+        if m is None:
             self._to_in_set(0)
             self._source_n_set(0)
             return ''
 
-        word = ''
-        while self._to_in() < self._source_n():
-            ch_ord = self._memory[self._source_addr() + self._to_in()]
-            c = chr(ch_ord)
-
-            self._to_in_inc()
-            if not c in [' ', '\t', '\n', '\r']:
-                word += c
-            else:
-                break
-
-        return word
+        self._to_in_set(m.end())
+        return m.group(1)
 
     def _get_next_word(self) -> str:
         word = self._get_next_word_or_none()
@@ -1250,29 +1948,53 @@ class T4th:
 
     # VM相关
 
-    def _init_vm(self):
+    def _init_vm(self, primitives:bool=True):
+        # primitives为假时不把原语加到词典中，由调用者从镜像还原
         self._quit = False
         self._quit_on_error = False
 
         self._data_stack = tn.memory()
         self._return_stack = tn.memory()
+        self._loop_stack = [] # 每层DO循环三个整数：leave地址、limit、index
 
-        self._memory = tn.memory(self._memory_size)
+        self._memory = tn.cell_memory(self._memory_size)
         self._memory[T4th.MemAddress.DP.value] = T4th.MemAddress.END.value
         self._memory[T4th.MemAddress.BASE.value] = 10
 
         self._latest_word_ptr = 0 # 0表示无效的指针
+        self._word_index = {}
+        self._compiled_does = {}
+        self._inline_bodies = {}
+        self._profiler = None
+        self._last_profile = None
+        self._sampler = None
+        self._last_samples = None
+        self._nested = []  # 嵌套的解释：[(返回栈深度, 调用者的pc, 词名)]
+        self._waiting_input = False
+        self._raise_errors = False
+        self._eval_depth = 0
+        self._init_steps()
         self._set_var_value('STATE', 0)
 
         self._rescue()
 
         # Add primitive words to dictionary
+        if not primitives:
+            return
         for (w, f) in self._primitive_words:
             w.ptr = self._here() + 1
             self._add_word(w)
             self._memory_append(T4th._PrimitiveWord(w.word_name, f))
 
 
+    def _init_steps(self):
+        self._steps = 0           # 数步数的内循环执行过的步数
+        self._step_limit = None   # 步数超过它时调用_out_of_steps，None时不数步数
+        self._budget_end = None   # 步数超过它时出错
+        self._slice_over = False  # step()的这一段在嵌套的执行中用完了
+        self._loop_depth = 0
+        self._run = None          # start()开始的逐步执行
+
     def _rescue(self):
         # 在定义词的过程中恢复
         if self._get_var_value('STATE') != 0 and self._latest_word_ptr > 0:
@@ -1282,6 +2004,7 @@ class T4th:
 
         self._data_stack.clear()
         self._return_stack.clear()
+        self._loop_stack.clear()
 
         self._source_addr_set(T4th.MemAddress.IN_BUFFER_ADDR.value)
         self._source_n_set(0)
@@ -1295,8 +2018,24 @@ class T4th:
         self._evaluating = False
 
     def interpret(self):
+        try:
+            self._interpret_loop()
+        finally:
+            # EVALUATE中嵌套的解释不用写出
+            if not self._evaluating:
+                self._output.flush()
+
+    def _interpret_loop(self, resume:str=None):
+        # resume是step()挂起时正在执行的词，先从挂起的地方把它执行完
         while not self._quit:
+            word_name = None
             try:
+                if resume is not None:
+                    (word_name, resume) = (resume, None)
+                    self._run_until(T4th.MemAddress.EXEC_START.value + 1)
+                    self._exec_pc = 0
+                    continue
+
                 word_name = self._get_next_word_or_none()
                 if word_name is None:
                     break # End of input
@@ -1310,36 +2049,46 @@ class T4th:
                 self._execute_word(word_name)
 
             except Exception as e:
-                print()
-                print(f'Error: {e}')
+                if self._raise_errors:
+                    # 由eval处理
+                    if isinstance(e, ForthError):
+                        raise
+                    raise ForthError(str(e), word=word_name, source=self._source_str(),
+                                     stack=list(self._data_stack)) from e
+
+                self._print()
+                self._print(f'Error: {e}')
                 self._rescue()
                 self._prompt = ''
                 if self._quit_on_error:
                     raise e
 
             except KeyboardInterrupt:
-                print()
-                print('Use interrupt')
+                if self._raise_errors:
+                    raise
+                self._print()
+                self._print('Use interrupt')
                 self._rescue()
                 self._prompt = ''
 
+            except _Suspend as e:
+                e.word = word_name
+                raise
+
     def _execute_word(self, word_name):
         word = self._find_word_or_none(word_name)
 
         if word:
             if self._get_var_value('STATE') != 0 and not word.is_immediate():
-                self._memory_append(word.ptr)
+                self._compile_word_ref(word)
             else:
                 if self._get_var_value('STATE') == 0 and word.is_non_interactive():
                     raise ValueError(f'Non-interactive word "{word_name}"')
 
                 self._pc = T4th.MemAddress.EXEC_START.value
                 self._memory[T4th.MemAddress.EXEC_START.value] = word.ptr
-
-                while self._pc != T4th.MemAddress.EXEC_START.value + 1:
-                    self._exec_pc = self._memory[self._pc]
-                    self._pc += 1
-                    self._memory[self._exec_pc]()
+                self._run_until(T4th.MemAddress.EXEC_START.value + 1)
+                self._exec_pc = 0 # 回到外层解释器
 
         else:
             try:
@@ -1396,6 +2145,511 @@ class T4th:
             except ValueError:
                 raise ValueError(f'Unknown word "{word_name}"')
 
+    # 内联
+
+    # 这些词会用到调用者的返回栈，包含它们的定义不内联。I、J、K、UNLOOP用循环栈，内联后不变
+    _RETURN_STACK_WORDS = ('>R', 'R>', 'R@')
+
+    def _compile_word_ref(self, word:_Word):
+        # 短小的冒号定义把定义体复制进来，其他的词编译xt
+        if self._inline_threshold is not None:
+            body = self._inline_body(word.ptr)
+            if body is not None and (len(body) <= self._inline_threshold or word.is_inline()):
+                for v in body:
+                    self._memory_append(v)
+                return
+
+        self._memory_append(word.ptr)
+
+    def _inline_body(self, xt:int) -> Optional[list]:
+        # 可以内联的定义体（不含EXIT），不能内联时返回None
+        if xt in self._inline_bodies:
+            return self._inline_bodies[xt]
+
+        body = None
+        code = self._memory[xt]
+        if isinstance(code, T4th._PrimitiveWord) and code.name == 'DOCOL':
+            try:
+                instrs = decode(self, xt + 1)
+            except CompileError:
+                instrs = {}
+
+            # 没有分支，只有一个EXIT在最后
+            end = max(instrs, default=xt)
+            if instrs and instrs[end][0] == _EXIT and all(
+                    kind in (_CALL, _DYN, _LIT, _EXECUTE) and self._memory[op_xt].name not in T4th._RETURN_STACK_WORDS
+                    for (addr, (kind, op_xt, _, _)) in instrs.items() if addr != end):
+                body = self._memory.get_range(xt + 1, end)
+
+        self._inline_bodies[xt] = body
+        return body
+
+    def _run_until(self, stop_pc):
+        # 内循环。线索中的xt是数据单元，代码域是对象。
+        if self._step_limit is not None:
+            return self._run_until_counted(stop_pc)
+        if self._profiler is not None:
+            return self._run_until_profiled(stop_pc)
+
+        cells = self._memory.cells
+        objects = self._memory.objects
+        while self._pc != stop_pc:
+            self._exec_pc = xt = cells[self._pc]
+            self._pc += 1
+            objects[xt]()
+
+    def _run_until_counted(self, stop_pc):
+        # 数步数的内循环，用于eval的budget和step()，步数超过_step_limit时调用_out_of_steps
+        cells = self._memory.cells
+        objects = self._memory.objects
+        self._loop_depth += 1
+        try:
+            while self._pc != stop_pc:
+                self._steps += 1
+                if self._steps > self._step_limit:
+                    self._out_of_steps()
+                self._exec_pc = xt = cells[self._pc]
+                self._pc += 1
+                objects[xt]()
+        finally:
+            self._loop_depth -= 1
+            if self._slice_over:
+                self._step_limit = self._steps # 回到外层后马上挂起
+
+    def _out_of_steps(self):
+        self._steps -= 1 # 这一步还没有执行
+        if self._budget_end is not None and self._steps >= self._budget_end:
+            raise ValueError('Budget exhausted')
+
+        # step()的这一段用完了。EVALUATE、闭包等嵌套的执行不能从中间挂起，回到最外层再挂起
+        if self._loop_depth == 1:
+            raise _Suspend()
+        self._slice_over = True
+        self._step_limit = self._budget_end if self._budget_end is not None else sys.maxsize
+        self._steps += 1
+
+    def _run_until_profiled(self, stop_pc):
+        # 带性能分析的内循环，见profiler.py
+        cells = self._memory.cells
+        objects = self._memory.objects
+        profiler = self._profiler
+        rs = self._return_stack
+        base = len(profiler.frames)
+        try:
+            while self._pc != stop_pc:
+                self._exec_pc = xt = cells[self._pc]
+                self._pc += 1
+                code = objects[xt]
+
+                if code.ptr == self._word_docol or (
+                        isinstance(code, T4th._DoesWord) and code.jmp_ptr not in self._compiled_does):
+                    # 进入线索执行的定义，EXIT时结束
+                    profiler.enter(xt, len(rs) + 1)
+                    code()
+                elif code.ptr == self._word_exit:
+                    code()
+                    profiler.leave_threaded(len(rs))
+                else:
+                    profiler.enter(xt)
+                    code()
+                    profiler.leave()
+        except BaseException:
+            profiler.unwind(base)
+            raise
+
+    def _xt_name(self, xt:int) -> str:
+        w = self._memory[xt - 1]
+        if isinstance(w, T4th._Word) and w.ptr == xt and not w.word_name.startswith(' '):
+            return w.word_name
+        return f'<{xt}>'
+
+    # 性能分析
+
+    def profile_start(self):
+        """开始按词统计调用次数和时间，之前的统计结果丢弃。"""
+        self._profiler = Profiler()
+        self._last_profile = None
+
+    def profile_stop(self) -> Optional[ProfileReport]:
+        """停止统计，返回统计结果。"""
+        report = self.profile_report()
+        self._last_profile = report
+        self._profiler = None
+        return report
+
+    def profile_report(self) -> Optional[ProfileReport]:
+        """正在统计时返回到目前为止的结果，否则返回最近一次的结果。"""
+        if self._profiler is None:
+            return self._last_profile
+        return self._profiler.report(self._xt_name)
+
+    # 采样分析
+
+    def sample_start(self, interval:float=0.005):
+        """开始每隔interval秒记录一次Forth调用栈，之前的结果丢弃。"""
+        if self._sampler is not None:
+            self._sampler.stop()
+        self._sampler = Sampler(self._sample_snapshot, interval)
+        self._last_samples = None
+        self._sampler.start()
+
+    def sample_stop(self) -> Optional[SampleReport]:
+        """停止采样，返回结果。"""
+        if self._sampler is not None:
+            self._sampler.stop()
+        report = self.sample_report()
+        self._last_samples = report
+        self._sampler = None
+        return report
+
+    def sample_report(self) -> Optional[SampleReport]:
+        """正在采样时返回到目前为止的结果，否则返回最近一次的结果。"""
+        if self._sampler is None:
+            return self._last_samples
+        return self._sampler.report(self._sample_resolver())
+
+    def _sample_snapshot(self):
+        # 在采样线程中执行，只复制状态，解析留到生成报告时
+        if self._waiting_input:
+            return None
+        return (self._exec_pc, self._pc, tuple(self._return_stack), tuple(self._nested))
+
+    def _sample_resolver(self):
+        cells = self._memory.cells
+        objects = self._memory.objects
+        headers = sorted(p for ptrs in self._word_index.values() for p in ptrs)
+        exec_end = T4th.MemAddress.EXEC_START.value + 1
+
+        def is_threaded(code):
+            return isinstance(code, T4th._DoesWord) or (
+                isinstance(code, T4th._PrimitiveWord) and code.ptr == self._word_docol)
+
+        def definition(addr):
+            # addr所在的冒号定义的名字，按地址找最近的词头
+            i = bisect.bisect_right(headers, addr) - 1
+            if i < 0 or addr <= headers[i] + 1:
+                return None
+            code = objects.get(headers[i] + 1)
+            if not (is_threaded(code) or isinstance(code, T4th._CompiledWord)):
+                return None
+            name = self._memory[headers[i]].word_name
+            return ':NONAME' if name.startswith(' ') else name
+
+        def caller(ret):
+            # 返回栈上的值是DOCOL或DOES>压入的返回地址时，返回调用者的名字；
+            # >R的值返回None
+            if ret == exec_end or not 0 < ret <= len(cells):
+                return None
+            if not is_threaded(objects.get(cells[ret - 1])):
+                return None
+            return definition(ret - 1)
+
+        def resolve(raw):
+            (exec_pc, pc, rs, nested) = raw
+            stack = []
+            levels = list(nested)
+            for (depth, ret) in enumerate(rs + (pc,)):
+                while levels and levels[0][0] == depth:
+                    (_, level_pc, level_name) = levels.pop(0)
+                    name = definition(level_pc - 1) if level_pc != exec_end else None
+                    if name is not None:
+                        stack.append(name)
+                    stack.append(level_name)
+                name = caller(ret) if depth < len(rs) else definition(pc)
+                if name is not None:
+                    stack.append(name)
+
+            # 正在执行的原语
+            code = objects.get(exec_pc)
+            if code is not None and not is_threaded(code):
+                name = self._xt_name(exec_pc)
+                if not stack or stack[-1] != name:
+                    stack.append(name)
+            if not stack:
+                stack.append('(INTERPRET)')
+            return tuple(stack)
+
+        return resolve
+
+    def checkpoint(self) -> Checkpoint:
+        """记下当前的词典、内存和变量，之后可以用reset()恢复。
+
+        检查点只能恢复创建它的T4th。只有最近一次的检查点可以按改过的内存页恢复，
+        恢复更早的检查点时复制整个内存。
+        """
+        return Checkpoint(self._memory.snapshot(), self._latest_word_ptr,
+                          {name: list(ptrs) for (name, ptrs) in self._word_index.items()},
+                          dict(self._compiled_does), dict(self._inline_bodies))
+
+    def reset(self, checkpoint:Checkpoint):
+        """恢复到checkpoint时的状态，清空栈和输入。
+
+        只写回之后改过的内存页，从词名索引中去掉之后定义的词，
+        所用的时间和改动的多少成正比，不重新加载core.fs。
+        """
+        # 从最新的词往前，去掉检查点之后定义的词；检查点之前的词被FORGET或改过时整个还原索引
+        p = self._latest_word_ptr
+        index = self._word_index
+        while p > checkpoint.latest:
+            w = self._memory[p]
+            ptrs = index.get(w.word_name)
+            if not ptrs or ptrs[-1] != p:
+                break
+            ptrs.pop()
+            if not ptrs:
+                del index[w.word_name]
+            p = w.prev
+        if p != checkpoint.latest or self._memory[p] is not checkpoint.memory[1].get(p):
+            self._word_index = {name: list(ptrs) for (name, ptrs) in checkpoint.word_index.items()}
+
+        self._memory.restore(checkpoint.memory)
+        self._latest_word_ptr = checkpoint.latest
+        self._compiled_does = dict(checkpoint.compiled_does)
+        self._inline_bodies = dict(checkpoint.inline_bodies)
+
+        self._quit = False
+        self._nested = []
+        self._waiting_input = False
+        self._raise_errors = False
+        self._eval_depth = 0
+        self._init_steps()
+        self._rescue()
+
+    def clone(self) -> 'T4th':
+        """返回一个有同样的词典和内存的新T4th，比重新加载core.fs快。
+
+        用define_primitive定义的词在副本中调用同一个Python函数。要创建多个副本时，
+        可以先clone()出一个模板，再用_image()和_load_image()。
+        """
+        vm = T4th(memory_size=self._memory_size, compile_closures=self._compile_closures,
+                  accelerated_core=self._accelerated_core, peephole=self._peephole,
+                  inline_threshold=self._inline_threshold)
+        vm._load_image(self._image(), self._user_primitives)
+        return vm
+
+    def _call_xt(self, xt):
+        # 在Python中调用一个词并等它返回（编译出的闭包中用）。
+        # 冒号定义会从返回地址EXEC_START+1处退出内循环。
+        pc = self._pc
+        stop_pc = T4th.MemAddress.EXEC_START.value + 1
+        self._pc = stop_pc
+        self._exec_pc = xt
+        self._memory[xt]()
+        self._run_until(stop_pc)
+        self._pc = pc
+
+    def eval(self, source:str, budget:int=None) -> EvalResult:
+        """解释执行source，返回输出和执行后的数据栈。
+
+        不读写sys.stdin和sys.stdout，可以在执行中的词里嵌套调用。
+        出错时抛出ForthError，不打印错误信息：没定义完的词被丢弃，返回栈恢复，
+        不是嵌套调用时数据栈被清空。
+        budget是最多执行的步数（内循环执行的词数），超过时抛出ForthError('Budget exhausted')。
+        执行BYE时停止解释，结果的quit为真；之后还可以再调用eval。
+        """
+        if self._run is not None and self._eval_depth == 0:
+            raise RuntimeError('A stepped evaluation is in progress')
+
+        out = StringIO()
+        reader = SourceReader(source)
+        frame = self._eval_enter(out, reader, budget)
+        try:
+            self._interpret_loop()
+            self._output.flush()
+            return EvalResult(out.getvalue(), list(self._data_stack), self._quit)
+        except ForthError as e:
+            self._eval_error(e, out, reader, frame[-2], frame[-1])
+            raise
+        finally:
+            self._eval_exit(frame)
+
+    def start(self, source:str, budget:int=None):
+        """准备逐步执行source，之后反复调用step()直到它返回结果。budget同eval()，是所有step()的总和。"""
+        if self._run is not None:
+            raise RuntimeError('A stepped evaluation is in progress')
+        self._run = T4th._Run(source, None if budget is None else self._steps + budget,
+                              (len(self._return_stack), len(self._loop_stack)), self._get_var_value('STATE') != 0)
+
+    def step(self, n:int) -> Optional[EvalResult]:
+        """执行start()的source，最多n步。
+
+        没执行完时VM挂起在当前的位置（pc、返回栈不变），返回None，再次调用时继续。
+        执行完时返回EvalResult。EVALUATE、INCLUDED执行完才挂起，编译成闭包的词按线索代码执行，可以在其中挂起。
+        出错时和eval()一样抛出ForthError，逐步执行结束。
+        """
+        run = self._run
+        if run is None:
+            raise RuntimeError('No stepped evaluation, call start() first')
+
+        frame = self._eval_enter(run.out, run.reader, None)
+        self._budget_end = run.budget_end
+        self._step_limit = self._steps + n if run.budget_end is None else min(self._steps + n, run.budget_end)
+        if run.input is not None:
+            self._input_restore(run.input)
+            (self._pc, self._exec_pc) = run.pc
+        try:
+            self._interpret_loop(resume=run.word)
+            self._run = None
+            self._output.flush()
+            return EvalResult(run.out.getvalue(), list(self._data_stack), self._quit)
+        except _Suspend as e:
+            self._output.flush()
+            (run.word, run.input, run.pc) = (e.word, self._input_backup(), (self._pc, self._exec_pc))
+            return None
+        except ForthError as e:
+            self._run = None
+            self._eval_error(e, run.out, run.reader, run.depths, run.compiling)
+            raise
+        finally:
+            self._slice_over = False
+            self._eval_exit(frame)
+
+    class _Run:
+        # start()开始的逐步执行
+        def __init__(self, source:str, budget_end:Optional[int], depths:tuple, compiling:bool):
+            self.reader = SourceReader(source)
+            self.out = StringIO()
+            self.budget_end = budget_end
+            self.depths = depths # (返回栈深度, 循环栈深度)
+            self.compiling = compiling
+            self.word = None  # 挂起时正在执行的词
+            self.input = None # 挂起时的输入状态
+            self.pc = None
+
+    def _eval_enter(self, out, reader, budget:Optional[int]) -> tuple:
+        # 换上eval的输入输出，返回恢复用的状态
+        frame = (self._in_stream, self._output, self._prompt, self._evaluating, self._raise_errors,
+                 self._pc, self._exec_pc, self._budget_end, self._step_limit, self._input_backup(),
+                 (len(self._return_stack), len(self._loop_stack)), self._get_var_value('STATE') != 0)
+
+        self._output = OutputSink(out, line_buffered=False)
+        self._in_stream = reader
+        self._source_addr_set(T4th.MemAddress.IN_BUFFER_ADDR.value)
+        self._source_n_set(0)
+        self._to_in_set(0)
+        self._prompt = ''
+        self._evaluating = True
+        self._raise_errors = True
+        self._quit = False # 之前执行过的BYE不影响这次eval
+        self._eval_depth += 1
+        if budget is not None:
+            # 嵌套的eval不能超过外层的预算
+            end = self._steps + budget
+            self._budget_end = end if self._budget_end is None else min(end, self._budget_end)
+            self._step_limit = self._budget_end if self._step_limit is None else min(self._step_limit, self._budget_end)
+        return frame
+
+    def _eval_error(self, e:ForthError, out, reader, depths:tuple, compiling:bool):
+        self._output.flush()
+        e.lineno = reader.lineno
+        e.output = out.getvalue()
+
+        if not compiling and self._get_var_value('STATE') != 0:
+            self._forget_p(self._latest_word_ptr)
+            self._set_var_value('STATE', 0)
+        (rs_depth, ls_depth) = depths
+        del self._return_stack[rs_depth:]
+        del self._loop_stack[ls_depth:]
+        if self._eval_depth == 1 and rs_depth == 0:
+            self._data_stack.clear()
+
+    def _eval_exit(self, frame:tuple):
+        self._eval_depth -= 1
+        (self._in_stream, self._output, self._prompt, self._evaluating, self._raise_errors,
+         self._pc, self._exec_pc, self._budget_end, self._step_limit, input_backup, _, _) = frame
+        self._input_restore(input_backup)
+
+    # 用Python定义的词
+
+    def define_primitive(self, name:str, func, stack_in=0, stack_out:int=0, immediate:bool=False):
+        """把Python函数func定义成Forth词name。
+
+        stack_in是参数个数，或者每个参数的类型组成的元组：int占一个单元；str和memoryview
+        占两个单元( c-addr u )，str传入复制出的字符串，memoryview传入单元内存的切片，不复制，
+        可以写。参数按在栈上的顺序传入，最深的在前。
+        stack_out是结果个数：0时忽略返回值，1时返回值就是结果，大于1时返回序列。
+        结果是True时压入-1（Forth的真），整数按单元回绕。
+        要在_load_core_fs之后定义，加载启动镜像会重建词典，之前调用时抛出RuntimeError。
+        """
+        if not self._core_loaded:
+            raise RuntimeError('define_primitive must be called after _load_core_fs')
+        primitive = self._primitive_runtime(name, func, stack_in, stack_out)
+
+        w = T4th._Word(name, flag=T4th._Word.FLAG_IMMEDIATE if immediate else 0)
+        w.ptr = self._here() + 1
+        self._add_word(w)
+        self._user_primitives[self._here()] = (name, func, stack_in, stack_out)
+        self._memory_append(T4th._PrimitiveWord(w.word_name, primitive))
+        return func
+
+    def _primitive_runtime(self, name:str, func, stack_in, stack_out:int):
+        # 调用func的原语，参数和结果见define_primitive
+        kinds = (int,) * stack_in if isinstance(stack_in, int) else tuple(stack_in)
+        for kind in kinds:
+            if kind not in (int, str, memoryview):
+                raise ValueError(f'Unsupported argument type: {kind}')
+        n_cells = sum(1 if kind is int else 2 for kind in kinds)
+        all_int = all(kind is int for kind in kinds)
+
+        data_stack = self._data_stack
+        int_min = tn.int_min
+        int_max = tn.int_max
+
+        def to_cell(v):
+            if v is True:
+                return -1
+            if v is False:
+                return 0
+            v = int(v)
+            return v if int_min <= v <= int_max else tn.wrap(v)
+
+        def convert(cells):
+            # (c-addr u)换成字符串或者内存切片
+            args = []
+            i = 0
+            for kind in kinds:
+                if kind is int:
+                    args.append(cells[i])
+                    i += 1
+                else:
+                    (addr, n) = (cells[i], cells[i + 1])
+                    if n < 0 or addr < 0 or addr + n > len(self._memory):
+                        raise ValueError(f'Invalid address range: {addr} {n}')
+                    if kind is memoryview:
+                        self._memory.touch(addr, addr + n)
+                        args.append(memoryview(self._memory.cells)[addr:addr + n])
+                    else:
+                        args.append(self._memory.get_str(addr, addr + n))
+                    i += 2
+            return args
+
+        def primitive():
+            if len(data_stack) < n_cells:
+                raise ValueError(f'Stack underflow: {len(data_stack)} < {n_cells}')
+            cells = data_stack[-n_cells:] if n_cells else []
+            if n_cells:
+                del data_stack[-n_cells:]
+
+            result = func(*cells) if all_int else func(*convert(cells))
+
+            if stack_out == 1:
+                # append会回绕超出范围的整数
+                data_stack.append(result if type(result) is int else to_cell(result))
+            elif stack_out > 1:
+                result = tuple(result)
+                if len(result) != stack_out:
+                    raise ValueError(f'{name} returned {len(result)} values, expected {stack_out}')
+                data_stack.extend([v if type(v) is int and int_min <= v <= int_max else to_cell(v) for v in result])
+
+        return primitive
+
+    def primitive(self, name:str=None, stack_in=0, stack_out:int=0, immediate:bool=False):
+        """define_primitive的装饰器形式，name默认是函数名（下划线换成-）。"""
+        def decorator(func):
+            word_name = name if name is not None else func.__name__.replace('_', '-')
+            return self.define_primitive(word_name, func, stack_in, stack_out, immediate)
+        return decorator
+
     def load_and_run_file(self, filename) -> bool:
         self._quit_on_error = True
         try:
@@ -1405,24 +2659,172 @@ class T4th:
             self._in_stream = sys.stdin
             self._prompt = ''
         except FileNotFoundError:
-            print(f'Error: file "{filename}" not found')
+            self._print(f'Error: file "{filename}" not found')
+            self._output.flush()
             exit(1)
         finally:
             self._quit_on_error = False
 
     def _load_core_fs(self):
         # 从本模块同级目录下加载并执行 core.fs 文件的内容
+        # 如果有有效的启动镜像，直接加载镜像，跳过解释core.fs
         current_dir = os.path.dirname(__file__)
-        self.load_and_run_file(os.path.join(current_dir, 'core.fs'))
+        core_fs = os.path.join(current_dir, 'core.fs')
+
+        image_path = self._boot_image_path(core_fs)
+        if image_path is not None and self._load_boot_image(image_path):
+            return
+
+        self.load_and_run_file(core_fs)
+        self._core_loaded = True
+
+        if image_path is not None:
+            self._save_boot_image(image_path)
+
+    # 启动镜像
+
+    def _boot_image_path(self, core_fs:str) -> Optional[str]:
+        # T4TH_CACHE_DIR 为空字符串时不使用启动镜像
+        cache_dir = os.environ.get('T4TH_CACHE_DIR')
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 't4th')
+        if not cache_dir:
+            return None
+
+        # 文件名是 boot-<选项>-<源代码>.img：不同选项的镜像可以同时存在，
+        # 源代码的哈希依赖core.fs、版本和影响镜像内容的所有模块（解释器、数值运算、编译器和窥孔优化）
+        options = f'{self._compile_closures}/{self._accelerated_core}/{self._peephole}/{self._inline_threshold}'
+        options_key = hashlib.sha256(options.encode()).hexdigest()[:8]
+
+        h = hashlib.sha256()
+        h.update(f'{T4th._version}/{marshal.version}/{sys.version_info[:2]}'.encode())
+        modules = (sys.modules[__name__], tn, sys.modules[compile_thread.__module__], peephole)
+        for filename in (core_fs, *(m.__file__ for m in modules)):
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+
+        return os.path.join(cache_dir, f'boot-{options_key}-{h.hexdigest()[:16]}.img')
+
+    def _image_encode(self, v):
+        if isinstance(v, T4th._Word):
+            return ('W', v.word_name, v.ptr, v.flag, v.prev)
+        elif isinstance(v, T4th._DoesWord):
+            return ('D', v.jmp_ptr)
+        elif isinstance(v, T4th._CompiledWord):
+            return ('C',) # 加载后重新编译
+        elif isinstance(v, T4th._PrimitiveWord):
+            return ('P', v.name)
+        elif isinstance(v, T4th._CaseTable):
+            return ('T', tuple(v.targets.items()), v.default)
+        return v
+
+    def _image_decode(self, v, primitives:dict):
+        if not isinstance(v, tuple):
+            return v
+        if v[0] == 'W':
+            (_, word_name, ptr, flag, prev) = v
+            return T4th._Word(word_name, ptr, flag, prev)
+        elif v[0] == 'D':
+            return T4th._DoesWord(v[1], self._new_does_p(v[1]))
+        elif v[0] == 'C':
+            return primitives['DOCOL']
+        elif v[0] == 'T':
+            return T4th._CaseTable(dict(v[1]), v[2])
+        else:
+            return primitives[v[1]]
+
+    def _image(self) -> dict:
+        # 内存和词典的可序列化副本，Python对象换成可以在另一个T4th中还原的元组
+        return {
+            'cells': [self._image_encode(self._memory[i]) for i in range(self._here())],
+            'latest': self._latest_word_ptr,
+        }
 
+    def _save_boot_image(self, path:str):
+        image = self._image()
+
+        cache_dir = os.path.dirname(path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先写临时文件再改名，避免并发启动的进程读到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(image, f)
+            os.replace(tmp_path, path)
+
+            # 删除同样选项的过期镜像
+            name = os.path.basename(path)
+            prefix = name[:name.rindex('-') + 1]
+            for filename in os.listdir(cache_dir):
+                if filename.startswith(prefix) and filename.endswith('.img') and filename != name:
+                    os.remove(os.path.join(cache_dir, filename))
+        except OSError:
+            pass # 镜像只是缓存，写不了就算了
+
+    def _load_boot_image(self, path:str) -> bool:
+        try:
+            with open(path, 'rb') as f:
+                image = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+
+        return self._load_image(image)
+
+    def _load_image(self, image:dict, user_primitives:dict=None) -> bool:
+        # 先解码和检查镜像，结构不对时返回False，VM不变，调用者可以重新加载core.fs
+        # user_primitives是clone()时原来的VM中用define_primitive定义的词
+        user_primitives = user_primitives or {}
+        primitives = {w.word_name: T4th._PrimitiveWord(w.word_name, f) for (w, f) in self._primitive_words}
+        try:
+            cells = image['cells']
+            latest = image['latest']
+            if len(cells) > len(self._memory) or type(latest) is not int:
+                return False
+            user = {xt: d for (xt, d) in user_primitives.items() if xt < len(cells) and cells[xt] == ('P', d[0].upper())}
+            decoded = [None if xt in user else self._image_decode(v, primitives) for (xt, v) in enumerate(cells)]
+
+            # 词头链从latest开始，每个词头的prev指向更早的词头
+            headers = []
+            p = latest
+            while p > 0:
+                if not isinstance(decoded[p], T4th._Word) or (headers and p >= headers[-1]):
+                    return False
+                headers.append(p)
+                p = decoded[p].prev
+        except (KeyError, IndexError, TypeError, ValueError):
+            return False
+
+        self._init_vm(primitives=False)
+        # 用define_primitive定义的词重新生成，使用这个VM的栈和内存
+        for (xt, d) in user.items():
+            decoded[xt] = T4th._PrimitiveWord(d[0], self._primitive_runtime(*d))
+        self._user_primitives = user
+        self._memory.set_range(0, decoded)
+        self._latest_word_ptr = latest
+
+        # 重建词名索引
+        for p in reversed(headers):
+            self._word_index.setdefault(self._memory[p].word_name, []).append(p)
+
+        for (xt, v) in enumerate(cells):
+            if v == ('C',):
+                self._compile_word(xt)
+
+        self._core_loaded = True
+        self._rescue()
+        return True
+
+
+def _repl(t4th:T4th):
+    print(f'T4th version {t4th._version} [ Free memory {len(t4th._memory) - t4th._here()} ]')
+    t4th.interpret()  # 进入命令交互
 
 def main():
     t4th = T4th()
 
     t4th._load_core_fs()
 
-    print(f'T4th version {t4th._version} [ Free memory {len(t4th._memory) - t4th._here()} ]')
-    t4th.interpret()  # 进入命令交互
+    _repl(t4th)
 
 if __name__ == '__main__': # pragma: no cover
     main()
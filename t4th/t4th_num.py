@@ -1,19 +1,26 @@
-from ctypes import c_int32, c_uint32, c_int64, c_uint64, sizeof
+from array import array
+import sys
 
-base = lambda : 10
+# 单元是32位，双精度单元是64位，都用普通的Python整数加显式的补码回绕实现
+# 模块中没有可变的全局状态，进制由调用者传入，同一个进程中的多个T4th互不影响
 
-int_type = c_int32
-uint_type = c_uint32
-dint_type = c_int64
-duint_type = c_uint64
-
-int_bits = sizeof(int_type) * 8
+int_bits = 32
 int_mask = (1 << int_bits) - 1
+int_sign = 1 << (int_bits - 1)
+int_min = -int_sign
+int_max = int_sign - 1
+
+dint_bits = int_bits * 2
+dint_mask = (1 << dint_bits) - 1
+dint_sign = 1 << (dint_bits - 1)
 
 digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
-def int_to_base(n: int) -> str:
-    if not (2 <= base() <= 36):
+# 单元数组的字节就是本机字节序的UTF-32，字符串和一段内存之间整段转换
+_utf32 = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+def int_to_base(n: int, base: int = 10) -> str:
+    if not (2 <= base <= 36):
         raise ValueError("Base must be between 2 and 36")
     if n == 0:
         return '0'
@@ -22,133 +29,276 @@ def int_to_base(n: int) -> str:
     n = abs(n)
     res = ""
     while n:
-        res = digits[n % base()] + res
-        n //= base()
+        res = digits[n % base] + res
+        n //= base
     return '-' + res if is_negative else res
 
-def ch_to_int(ch: str) -> int:
-    if not (2 <= base() <= 36):
+def ch_to_int(ch: str, base: int = 10) -> int:
+    if not (2 <= base <= 36):
         raise ValueError("Base must be between 2 and 36")
 
-    allowed_chars = digits[:base()]
+    allowed_chars = digits[:base]
     if ch not in allowed_chars:
         return -1
     return digits.index(ch)
 
+def wrap(n: int) -> int:
+    # 回绕成有符号单元
+    return ((n + int_sign) & int_mask) - int_sign
+
+def dwrap(n: int) -> int:
+    # 回绕成有符号双精度单元
+    return ((n + dint_sign) & dint_mask) - dint_sign
+
 def i2u(n: int):
-    return uint_type(n).value
+    return n & int_mask
 
 def i2d(n: int):
-    d = dint_type(n).value
+    d = dwrap(n)
     return (d & int_mask, d >> int_bits)
 
 def ud2i(u1, u2):
-    return uint_type(u1).value + (uint_type(u2).value << int_bits)
+    return (u1 & int_mask) + ((u2 & int_mask) << int_bits)
+
+class I:
+    __slots__ = ('value',)
+
+    def __init__(self, value=0):
+        self.value = wrap(value)
 
-class I(int_type):
     def __repr__(self):
         return f'{int_to_base(self.value)}'
 
     def __add__(self, other):
-        return I((self.value & int_mask) + (_v_in(other).value & int_mask))
+        return I(self.value + _v_in(other).value)
 
     def __sub__(self, other):
-        return I((self.value & int_mask) - (_v_in(other).value & int_mask))
+        return I(self.value - _v_in(other).value)
 
     def __mul__(self, other):
-        return I((self.value & int_mask) * (_v_in(other).value & int_mask))
+        return I(self.value * _v_in(other).value)
 
     def invert(self):
-        return I(~self.value & int_mask)
+        return I(~self.value)
 
     def rshift(self, n):
         return I((self.value & int_mask) >> n)
 
     def lshift(self, n):
-        return I(((self.value & int_mask) << n) & int_mask)
+        return I((self.value & int_mask) << n)
 
     def um_mod(self, ud1, ud2):
-        u1 = uint_type(self.value).value & int_mask
-        ud1 = uint_type(ud1).value & int_mask
-        ud2 = uint_type(ud2).value & int_mask
-
-        ud = ud1 + (ud2 << int_bits)
-
-        q = ud // u1
-        r = ud % u1
-        return (I(r), I(q))
+        ud = ud2i(ud1, ud2)
+        u1 = self.value & int_mask
+        return (I(ud % u1), I(ud // u1))
 
     def um_star(self, u):
-        u1 = uint_type(self.value).value & int_mask
-        u2 = uint_type(u).value & int_mask
-
-        ud = u1 * u2
-        ud1 = ud & int_mask
-        ud2 = (ud >> int_bits) & int_mask
-
-        return (I(ud1), I(ud2))
+        ud = (self.value & int_mask) * (u & int_mask)
+        return (I(ud), I(ud >> int_bits))
 
     def fm_mod(self, d1, d2):
-        n1 = int_type(self.value).value
-        d1 = uint_type(d1).value
-        d2 = uint_type(d2).value
-
-        d = dint_type(d1 + (d2 << int_bits)).value
-
-        q = d // n1
-        r = d % n1
-        return (I(r), I(q))
+        d = dwrap(ud2i(d1, d2))
+        n1 = self.value
+        return (I(d % n1), I(d // n1))
 
     def sm_rem(self, d1, d2):
-        n1 = int_type(self.value).value
-        d1 = int_type(d1).value
-        d2 = int_type(d2).value
-
-        d = dint_type((d1 & int_mask) + (d2 << int_bits)).value
+        d = dwrap((d1 & int_mask) + (wrap(d2) << int_bits))
+        n1 = self.value
 
-        q = int(d / n1)
+        # 向零取整
+        q = abs(d) // abs(n1)
+        if (d < 0) != (n1 < 0):
+            q = -q
         r = d - q * n1
 
         return (I(r), I(q))
 
     def m_star(self, n):
-        n1 = int_type(self.value).value
-        n2 = int_type(n).value
-
-        d = n1 * n2
-
-        d1 = d & int_mask
-        d2 = (d >> int_bits) & int_mask
-
-        return (I(d1), I(d2))
+        d = self.value * wrap(n)
+        return (I(d), I(d >> int_bits))
 
 def _v_in(v):
-    if isinstance(v, I):
+    if type(v) is int:
+        return I(v)
+    elif isinstance(v, I):
         return v
     elif isinstance(v, int):
         return I(v)
     else:
         return v
 
-def _v_out(v):
-    if isinstance(v, I):
-        return v.value
-    else:
-        return v
-
 class memory(list):
+    # 数据栈和返回栈：整数按单元回绕，其他对象原样保存
     def __init__(self, size=0):
-        if size != 0:
-            super().__init__([I(0)] * size)
-        else:
-            super().__init__()
+        super().__init__([0] * size)
     def append(self, v):
-        super().append(_v_in(v))
+        if type(v) is int:
+            if not int_min <= v <= int_max:
+                v = wrap(v)
+        elif isinstance(v, I):
+            v = v.value
+        elif isinstance(v, int):
+            v = wrap(v)
+        super().append(v)
     def __setitem__(self, i, v):
-        super().__setitem__(i, _v_in(v))
+        if type(v) is int:
+            if not int_min <= v <= int_max:
+                v = wrap(v)
+        elif isinstance(v, I):
+            v = v.value
+        elif isinstance(v, int):
+            v = wrap(v)
+        super().__setitem__(i, v)
+
+class cell_memory:
+    # 数据单元放在紧凑的array中，词头、代码域等Python对象放在按同一地址索引的字典中。
+    # 只支持整数下标，取一段内存用get_range/set_range。负数地址和越界一样抛出IndexError，
+    # 不像array那样从末尾数。
+    # snapshot()之后记下写过的页（dirty），restore()只写回这些页。
+    PAGE_SHIFT = 8 # 每页256个单元
+
+    def __init__(self, size):
+        self.cells = array('i', bytes(size * 4))
+        self.objects = {}
+        self.dirty = None # 写过的页号的集合，None表示不记录
+        self._snapshot = None
+
+    def __len__(self):
+        return len(self.cells)
+
     def __getitem__(self, i):
-        return _v_out(super().__getitem__(i))
-    def __iter__(self):
-        return (_v_out(x) for x in super().__iter__())
-    def pop(self):
-        return _v_out(super().pop())
+        if i < 0:
+            raise IndexError('array index out of range')
+        o = self.objects.get(i)
+        return self.cells[i] if o is None else o
+
+    def __setitem__(self, i, v):
+        if i < 0:
+            raise IndexError('array assignment index out of range')
+        if type(v) is not int:
+            if isinstance(v, I):
+                v = v.value
+            elif isinstance(v, int):
+                v = int(v)
+            else:
+                self.cells[i] = 0 # 越界检查
+                self.objects[i] = v
+                if self.dirty is not None:
+                    self.dirty.add(i >> self.PAGE_SHIFT)
+                return
+
+        try:
+            self.cells[i] = v
+        except OverflowError:
+            self.cells[i] = wrap(v)
+        if i in self.objects:
+            del self.objects[i]
+        if self.dirty is not None:
+            self.dirty.add(i >> self.PAGE_SHIFT)
+
+    def get_range(self, start, stop):
+        if not 0 <= start <= stop <= len(self.cells):
+            return [self[i] for i in range(start, stop)]
+        objects = self.objects
+        if not objects:
+            return self.cells[start:stop].tolist()
+        values = self.cells[start:stop].tolist()
+        for i in self._object_keys(start, stop):
+            values[i - start] = objects[i]
+        return values
+
+    def _object_keys(self, start, stop):
+        # [start, stop)中放了对象的地址，范围比对象多时遍历字典
+        objects = self.objects
+        if stop - start > len(objects):
+            return [i for i in objects if start <= i < stop]
+        return [i for i in range(start, stop) if i in objects]
+
+    def set_range(self, start, values):
+        stop = start + len(values)
+        if 0 <= start <= stop <= len(self.cells):
+            try:
+                # 全是单元范围内的整数时整段复制
+                self.cells[start:stop] = array('i', values)
+            except (TypeError, OverflowError):
+                pass
+            else:
+                for i in self._object_keys(start, stop):
+                    del self.objects[i]
+                self.touch(start, stop)
+                return
+
+        for (i, v) in enumerate(values, start):
+            self[i] = v
+
+    def get_str(self, start, stop):
+        # 一段内存转成字符串，每个单元是一个字符
+        if 0 <= start <= stop <= len(self.cells) and not self._object_keys(start, stop):
+            try:
+                return self.cells[start:stop].tobytes().decode(_utf32)
+            except UnicodeDecodeError:
+                pass # 负数、代理字符等，逐个转换，不是字符时报错
+        return ''.join(map(chr, self.get_range(start, stop)))
+
+    def set_str(self, start, s):
+        # 字符串写到从start开始的一段内存，每个字符一个单元
+        try:
+            codes = array('i', s.encode(_utf32))
+        except UnicodeEncodeError: # 代理字符
+            codes = array('i', map(ord, s))
+        self.set_range(start, codes)
+
+    def copy(self, src, dst, n):
+        # 把[src, src+n)复制到dst，两段重叠时和先全部取出再写入一样。调用者检查范围
+        cells = self.cells
+        cells[dst:dst + n] = cells[src:src + n]
+        objects = self.objects
+        if objects:
+            moved = [(i - src + dst, objects[i]) for i in self._object_keys(src, src + n)]
+            for i in self._object_keys(dst, dst + n):
+                del objects[i]
+            for (i, o) in moved:
+                objects[i] = o
+        self.touch(dst, dst + n)
+
+    def fill(self, start, n, v):
+        # 把[start, start+n)都写成整数v。调用者检查范围
+        self.cells[start:start + n] = array('i', [wrap(v)]) * n
+        for i in self._object_keys(start, start + n):
+            del self.objects[i]
+        self.touch(start, start + n)
+
+    def touch(self, start, stop):
+        # 不经过__setitem__写内存（例如通过memoryview）时标记写过的页
+        if self.dirty is not None and start < stop:
+            self.dirty.update(range(start >> self.PAGE_SHIFT, ((stop - 1) >> self.PAGE_SHIFT) + 1))
+
+    def snapshot(self):
+        # 返回内存的副本，从现在开始记录写过的页
+        snap = (array('i', self.cells), dict(self.objects))
+        self._snapshot = snap
+        self.dirty = set()
+        return snap
+
+    def restore(self, snap):
+        # 写回snap时的内容。snap是最近一次的快照时只写回之后写过的页，否则整个复制
+        (cells, objects) = snap
+        dirty = self.dirty
+        if snap is self._snapshot and dirty is not None and min(dirty, default=0) >= 0:
+            size = 1 << self.PAGE_SHIFT
+            for page in dirty:
+                a = page << self.PAGE_SHIFT
+                b = min(a + size, len(cells))
+                self.cells[a:b] = cells[a:b]
+                for i in range(a, b):
+                    o = objects.get(i)
+                    if o is not None:
+                        self.objects[i] = o
+                    elif i in self.objects:
+                        del self.objects[i]
+        else:
+            self.cells[:] = cells
+            self.objects.clear()
+            self.objects.update(objects)
+            self._snapshot = snap
+        self.dirty = set()
@@ -0,0 +1,67 @@
+import pathlib
+import tempfile
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from t4th.pool import Pool, JobResult
+
+def setUpModule():
+    # 启动镜像写到临时目录，测试不改动用户的缓存
+    cache_dir = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(cache_dir.cleanup)
+    patcher = patch.dict('os.environ', {'T4TH_CACHE_DIR': cache_dir.name})
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+class TestPool(unittest.TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as d, Pool(2) as pool:
+            filename = pathlib.Path(d, 'job.fs')
+            filename.write_text(': sq dup * ;\n12 sq .\n')
+            jobs = [
+                '1 2 + .',
+                ': foo 5 ; foo foo +',
+                'nosuch',
+                ': hang begin again ; hang',
+                filename,
+                'foo sq',
+                pathlib.Path(d, 'missing.fs'),
+                '3 4',
+            ]
+            results = sorted(pool.run(jobs, timeout=1))
+
+        self.assertEqual([r.index for r in results], list(range(len(jobs))))
+        self.assertEqual(results[0][:4], (0, '3 ', [], None))
+        self.assertEqual(results[1].stack, [10])
+        self.assertIn('Unknown word "nosuch"', results[2].error)
+        self.assertEqual(results[3].error, 'Timeout')
+        self.assertEqual(results[4].output, '144 ')
+        # 每个任务从加载完core.fs的状态开始
+        self.assertIn('Unknown word "foo"', results[5].error)
+        self.assertIsNotNone(results[6].error)
+        self.assertEqual(results[7].stack, [3, 4])
+        self.assertIsInstance(results[7], JobResult)
+
+    def test_many_jobs(self):
+        with Pool(2) as pool:
+            results = list(pool.run(f'{i} dup *' for i in range(200)))
+        self.assertEqual(sorted(r.stack[0] for r in results), [i * i for i in range(200)])
+        self.assertTrue(all(r.error is None for r in results))
+
+    def test_stop_early(self):
+        with Pool(2) as pool:
+            results = pool.run(['1', ': spin 100000 0 do loop ; spin 2'])
+            next(results)
+            results.close()
+            # 没取的结果不会出现在下一次run中
+            results = sorted(pool.run(['3', '4']))
+        self.assertEqual([(r.index, r.stack) for r in results], [(0, [3]), (1, [4])])
+
+    def test_worker_start_error(self):
+        # 工作进程的错误信息写到被替换的sys.stderr中
+        with self.assertRaisesRegex(RuntimeError, 'failed to start'), patch('sys.stderr', new=StringIO()):
+            Pool(2, no_such_option=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from t4th.server import Server
+
+def setUpModule():
+    # 启动镜像写到临时目录，测试不改动用户的缓存
+    cache_dir = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(cache_dir.cleanup)
+    patcher = patch.dict('os.environ', {'T4TH_CACHE_DIR': cache_dir.name})
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = Server(max_connections=3, idle_timeout=2)
+        self.srv = await self.server.start(port=0)
+        self.port = self.srv.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.srv.close()
+        await self.srv.wait_closed()
+        self.server.close()
+
+    async def _connect(self):
+        (reader, writer) = await asyncio.open_connection('127.0.0.1', self.port)
+        self.assertTrue((await reader.readline()).startswith(b'T4th version'))
+        return (reader, writer)
+
+    async def _request(self, conn, line):
+        conn[1].write(line.encode() + b'\n')
+        return await self._reply(conn)
+
+    async def _reply(self, conn):
+        reader = conn[0]
+        reply = b''
+        while not (reply.endswith(b' ok\n') or reply.endswith(b' compiled\n') or b'Error: ' in reply):
+            reply += await reader.readline()
+        return reply.decode()
+
+    async def test_eval(self):
+        a = await self._connect()
+        b = await self._connect()
+        self.assertEqual(await self._request(a, ': sq dup * ; 7 sq .'), '49  ok\n')
+        self.assertEqual(await self._request(a, ': cube dup'), ' compiled\n')
+        self.assertEqual(await self._request(a, 'sq * ; 3 cube .'), '27  ok\n')
+        # 每个连接有自己的词典
+        self.assertEqual(await self._request(b, '7 sq .'), '\nError: Unknown word "sq"\n')
+        self.assertEqual(await self._request(b, '1 2 + .'), '3  ok\n')
+
+        a[1].write(b'bye\n')
+        self.assertEqual(await a[0].read(), b'\n')
+        b[1].close()
+
+    async def test_long_eval_off_loop(self):
+        a = await self._connect()
+        b = await self._connect()
+        await self._request(a, ': spin 0 300000 0 do i + loop ;')
+        a[1].write(b'spin .\n')
+        # 另一个连接不用等spin执行完
+        self.assertEqual(await asyncio.wait_for(self._request(b, '1 .'), 5), '1  ok\n')
+        self.assertEqual(await self._reply(a), '2050177040  ok\n')
+        for (_, writer) in (a, b):
+            writer.close()
+
+    async def test_limits(self):
+        conns = [await self._connect() for _ in range(3)]
+        (reader, writer) = await asyncio.open_connection('127.0.0.1', self.port)
+        self.assertEqual(await reader.read(), b'Error: too many connections\n')
+        writer.close()
+        for (_, writer) in conns:
+            writer.close()
+        while self.server.connections:
+            await asyncio.sleep(0.01)
+
+        self.server.idle_timeout = 0.2
+        c = await self._connect()
+        self.assertEqual(await c[0].read(), b'Error: idle timeout\n')
+        c[1].close()
+
+    async def test_eval_limits(self):
+        # 超过预算或者超时时回复错误并结束连接
+        self.server.eval_budget = 100000
+        a = await self._connect()
+        self.assertEqual(await self._request(a, '1 2 + .'), '3  ok\n')
+        self.assertEqual(await self._request(a, ': hang begin again ; 5 . hang'), '5 \nError: Budget exhausted\n')
+        self.assertEqual(await a[0].read(), b'')
+        a[1].close()
+
+        (self.server.eval_budget, self.server.eval_timeout) = (None, 0.2)
+        b = await self._connect()
+        self.assertEqual(await self._request(b, '1 2 + .'), '3  ok\n')
+        self.assertEqual(await self._request(b, ': hang begin again ; hang'), 'Error: eval timeout\n')
+        self.assertEqual(await b[0].read(), b'')
+        b[1].close()
+
+    async def test_eval_limits_closures(self):
+        # 编译成闭包的词同样受限制，不会占住线程
+        server = Server(eval_budget=None, eval_timeout=0.2, compile_closures=True)
+        srv = await server.start(port=0)
+        self.port = srv.sockets[0].getsockname()[1]
+        try:
+            a = await self._connect()
+            self.assertEqual(await self._request(a, ': hang begin again ;'), ' ok\n')
+            self.assertEqual(await asyncio.wait_for(self._request(a, 'hang'), 5), 'Error: eval timeout\n')
+            self.assertEqual(await a[0].read(), b'')
+            a[1].close()
+
+            server.eval_budget = 100000
+            b = await self._connect()
+            self.assertEqual(await asyncio.wait_for(self._request(b, ': hang begin again ; hang'), 5),
+                             '\nError: Budget exhausted\n')
+            b[1].close()
+        finally:
+            srv.close()
+            await srv.wait_closed()
+            server.close()
+
+    @unittest.skipUnless(hasattr(asyncio, 'start_unix_server'), 'no Unix sockets')
+    async def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 't4th.sock')
+            srv = await self.server.start(path=path)
+            (reader, writer) = await asyncio.open_unix_connection(path)
+            await reader.readline()
+            self.assertEqual(await self._request((reader, writer), '6 7 * .'), '42  ok\n')
+            writer.close()
+            srv.close()
+            await srv.wait_closed()
+
+if __name__ == '__main__':
+    unittest.main()
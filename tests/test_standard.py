@@ -2,13 +2,23 @@ import os
 import unittest
 from unittest.mock import patch
 from io import StringIO
+import tempfile
 import textwrap
 from t4th import t4th
 
+def setUpModule():
+    # 启动镜像写到临时目录，测试不改动用户的缓存
+    cache_dir = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(cache_dir.cleanup)
+    patcher = patch.dict('os.environ', {'T4TH_CACHE_DIR': cache_dir.name})
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
 class TestStandard(unittest.TestCase):
+    options = {}
 
     def setUp(self):
-        self.t4th = t4th.T4th()
+        self.t4th = t4th.T4th(**self.options)
         self.t4th._load_core_fs()
         current_dir = os.path.dirname(__file__)
         self.t4th.load_and_run_file(os.path.join(current_dir, 'ttester.fs'))
@@ -50,3 +60,12 @@ class TestStandard(unittest.TestCase):
         """)
 
         self.assertEqual(output, expected_output)
+
+class TestStandardCompiled(TestStandard):
+    options = {'compile_closures': True}
+
+class TestStandardForthCore(TestStandard):
+    options = {'accelerated_core': False}
+
+class TestStandardNoPeephole(TestStandard):
+    options = {'peephole': False}
@@ -1,13 +1,45 @@
+import marshal
+import os
 import unittest
 from unittest.mock import patch
 from io import StringIO
 import re
+import tempfile
+import sys
 import textwrap
+import threading
+from array import array
 
 from t4th import t4th
-
-class TestT4th(unittest.TestCase):
+from t4th import compiler
+import t4th.t4th_num as tn
+
+def setUpModule():
+    # 启动镜像写到临时目录，测试不改动用户的缓存
+    cache_dir = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(cache_dir.cleanup)
+    patcher = patch.dict('os.environ', {'T4TH_CACHE_DIR': cache_dir.name})
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+class _T4thTestCase(unittest.TestCase):
     _welcome_message_patter = pattern = r'T4th version (\d+\.\d+\.\d+) \[ Free memory (\d+) \]'
+    options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        # 只加载一次core.fs，每个脚本从检查点恢复后再执行
+        cls._vm = t4th.T4th(**cls.options)
+        cls._vm._load_core_fs()
+        cls._checkpoint = cls._vm.checkpoint()
+
+    def _booted_vm(self):
+        self._vm.reset(self._checkpoint)
+        return self._vm
+
+    def _main(self):
+        # 和t4th.main()一样，只是不重新加载core.fs
+        t4th._repl(self._booted_vm())
 
     def _assert_welcome_message(self, welcome_line):
         match = re.match(self._welcome_message_patter, welcome_line)
@@ -28,7 +60,7 @@ class TestT4th(unittest.TestCase):
 
         with patch('sys.stdin', new=StringIO('\n'.join(input_lines))), \
              patch('sys.stdout', new=StringIO()) as mock_stdout:
-            t4th.main()
+            self._main()
             output = mock_stdout.getvalue()
             output_lines = output.split('\n')
             welcome_line = output_lines[0]
@@ -42,7 +74,7 @@ class TestT4th(unittest.TestCase):
     def _run_scripts_result_contains(self, scripts, result_regex):
         with patch('sys.stdin', new=StringIO(scripts)), \
              patch('sys.stdout', new=StringIO()) as mock_stdout:
-            t4th.main()
+            self._main()
             output = mock_stdout.getvalue()
             output_lines = output.split('\n')
             welcome_line = output_lines[0]
@@ -51,6 +83,373 @@ class TestT4th(unittest.TestCase):
             self.assertRegex(output_lines, result_regex)
 
 
+    def _interpret(self, vm, script):
+        with patch('sys.stdin', new=StringIO(script)), \
+             patch('sys.stdout', new=StringIO()) as mock_stdout:
+            vm._in_stream = StringIO(script)
+            vm.interpret()
+            return mock_stdout.getvalue()
+
+class TestT4th(_T4thTestCase):
+    def test_boot_image(self):
+        script = "123 constant x : y x 1+ ; y . 10 0 ?do i . loop\n"
+        with tempfile.TemporaryDirectory() as cache_dir, \
+             patch.dict('os.environ', {'T4TH_CACHE_DIR': cache_dir}):
+            cold = t4th.T4th()
+            cold._load_core_fs()
+            images = os.listdir(cache_dir)
+            self.assertEqual(len(images), 1)
+
+            warm = t4th.T4th()
+            with patch.object(warm, 'load_and_run_file') as load_and_run_file:
+                warm._load_core_fs()
+                load_and_run_file.assert_not_called()
+
+            self.assertEqual(warm._here(), cold._here())
+            self.assertEqual(warm._latest_word_ptr, cold._latest_word_ptr)
+            self.assertEqual(self._interpret(warm, script), self._interpret(cold, script))
+
+            # 损坏的镜像会被重建
+            with open(os.path.join(cache_dir, images[0]), 'wb') as f:
+                f.write(b'broken')
+            rebuilt = t4th.T4th()
+            rebuilt._load_core_fs()
+            self.assertEqual(self._interpret(rebuilt, script), self._interpret(cold, script))
+            self.assertTrue(t4th.T4th()._load_boot_image(os.path.join(cache_dir, images[0])))
+
+            # 能读出来但是结构不对的镜像也会被重建
+            with open(os.path.join(cache_dir, images[0]), 'wb') as f:
+                marshal.dump({'cells': [('P', 'NOSUCH')], 'latest': 0}, f)
+            rebuilt = t4th.T4th()
+            rebuilt._load_core_fs()
+            self.assertEqual(self._interpret(rebuilt, script), self._interpret(cold, script))
+
+    def test_load_image_validation(self):
+        vm = self._booted_vm()
+        image = vm._image()
+        cells = image['cells']
+        latest = image['latest']
+        header = cells[latest]
+        bad_images = [
+            None,
+            [],
+            {'cells': 5, 'latest': 0},
+            {'cells': cells},
+            {'cells': cells, 'latest': '0'},
+            {'cells': cells + [0] * len(vm._memory), 'latest': latest},
+            {'cells': [('X',)], 'latest': 0},
+            {'cells': [('P', 'NOSUCH')], 'latest': 0},
+            {'cells': [('W', 'A')], 'latest': 0},
+            {'cells': cells, 'latest': latest + 1},           # 不是词头
+            {'cells': cells, 'latest': len(cells) + 10},      # 超出镜像
+            {'cells': cells[:latest] + [header[:4] + (latest,)] + cells[latest + 1:], 'latest': latest}, # 词头链有环
+        ]
+        for image in bad_images:
+            self.assertFalse(vm._load_image(image))
+        # VM没有被破坏
+        self.assertEqual(vm.eval(': sq dup * ; 7 sq .').output, '49 ')
+
+    def test_boot_image_options(self):
+        with tempfile.TemporaryDirectory() as cache_dir, \
+             patch.dict('os.environ', {'T4TH_CACHE_DIR': cache_dir}):
+            vm = t4th.T4th()
+            path = vm._boot_image_path(os.path.join(os.path.dirname(t4th.__file__), 'core.fs'))
+            stale = path[:path.rindex('-')] + '-0000000000000000.img'
+            with open(stale, 'wb') as f:
+                f.write(b'stale')
+
+            vm._load_core_fs()
+            t4th.T4th(compile_closures=True)._load_core_fs()
+            # 不同选项的镜像互不删除，同样选项的过期镜像被删除
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            self.assertFalse(os.path.exists(stale))
+
+            warm = t4th.T4th()
+            with patch.object(warm, 'load_and_run_file') as load_and_run_file:
+                warm._load_core_fs()
+                load_and_run_file.assert_not_called()
+
+            # 编译器和窥孔优化的源代码也决定镜像
+            core_fs = os.path.join(os.path.dirname(t4th.__file__), 'core.fs')
+            for module in (t4th.peephole, sys.modules[t4th.compile_thread.__module__]):
+                changed = os.path.join(cache_dir, 'changed.py')
+                with open(module.__file__, 'rb') as src, open(changed, 'wb') as dst:
+                    dst.write(src.read() + b'\n')
+                with patch.object(module, '__file__', changed):
+                    self.assertNotEqual(vm._boot_image_path(core_fs), path)
+
+    def test_accelerated_core(self):
+        # 结果的检查在TestOptions中，这里只看用的是原语
+        vm = self._booted_vm()
+        self.assertEqual(vm._memory[vm._find_word('rot').ptr].name, 'ROT')
+
+        # 栈不够时报错
+        with self.assertRaisesRegex(t4th.ForthError, 'Stack underflow'):
+            vm.eval('1 2 rot')
+        with self.assertRaisesRegex(t4th.ForthError, 'Stack underflow'):
+            vm.eval('1 2 3 2over')
+
+    def test_defining_words(self):
+        # 结果的检查在TestOptions中，这里看用的是原生的运行时
+        vm = self._booted_vm()
+        vm.eval('5 constant c 6 value w defer d')
+        for (name, code) in (('c', '(CONSTANT)'), ('w', '(VALUE)'), ('d', '(DEFER)')):
+            self.assertEqual(vm._memory[vm._find_word(name).ptr].name, code)
+
+        # 栈不够时不留下没定义完的词
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval('constant nothing')
+        self.assertIn('Stack underflow', cm.exception.message)
+        self.assertIsNone(vm._find_word_or_none('nothing'))
+
+    def test_case_table(self):
+        # 结果的检查在TestOptions中，这里看编译出的跳转表
+        vm = self._booted_vm()
+        vm.eval(textwrap.dedent("""
+            : c1 case 1 of 10 endof -5 of 20 endof 1 of 30 endof 7 of 0 endof dup 100 * swap endcase ;
+            : c4 case dup 1 and 0= of 200 endof 3 of 300 endof 0 swap endcase ;
+            : c5 case endcase ;
+        """))
+        self.assertIn('(CASE) 1:', vm.eval('see c1').output)
+        self.assertNotIn('(CASE)', vm.eval('see c4').output) # 选择值不是常数，逐个比较
+        self.assertEqual(vm.eval('see c5').output.count('DROP'), 1)
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval(': bad [ 5 ] 1 of 2 endof ;')
+        self.assertIn('Unmatched CASE', cm.exception.message)
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval('7 : w case 1 of 2 endof 3 ;')
+        self.assertEqual(cm.exception.message, 'Unterminated CASE')
+        self.assertEqual(cm.exception.stack, [7])
+        self.assertIsNone(vm._find_word_or_none('w'))
+        self.assertEqual(vm.eval('depth').stack, [0])
+
+    def test_peephole(self):
+        # 结果的检查在TestOptions中，这里看融合出的超级指令
+        vm = self._booted_vm()
+        vm.eval(textwrap.dedent("""
+            : t2 dup 0= if drop 100 then ;
+            : t3 case 1 of 10 endof 1 1+ of 20 endof 0 swap endcase ;
+            : t4 >r 1 r> drop ;
+        """))
+        self.assertRegex(vm.eval('see t2').output, r': T2\n  \d+ \(DUP0=0BRANCH\) \d+\n  \d+ DROP\n  \d+ \(LITERAL\) 100\n  \d+ EXIT\n;')
+        self.assertIn('(OVER=0BRANCH)', vm.eval('see t3').output)
+        self.assertIn('(RDROP)', vm.eval('see t4').output)
+        self.assertIn('DUP is not a colon definition', vm.eval('see dup').output)
+
+        # 重新定义的词不参与融合
+        vm.eval(': + - ; : t7 5 + ;')
+        self.assertNotIn('(LIT+)', vm.eval('see t7').output)
+
+    def test_inline(self):
+        # 结果的检查在TestOptions中，这里看哪些定义被内联
+        vm = self._booted_vm()
+        vm.eval(textwrap.dedent("""
+            : sq dup * ;
+            : nothing ;
+            : long 1 + 2 * 3 - ; inline
+            : long2 1 + 2 * 3 - ;
+            : branchy 0< if 1 then ;
+            : rs >r r> ;
+            : t1 nothing sq 5 long 1 long2 ;
+            : t2 -1 branchy 7 rs ;
+        """))
+        see = vm.eval('see t1').output
+        self.assertRegex(see, r': T1\n  \d+ DUP\n  \d+ \*\n  \d+ \(LITERAL\) 5\n  \d+ \(LIT\+\) 1\n')
+        self.assertIn('LONG2\n', see)
+        self.assertNotIn('LONG\n', see)
+        see = vm.eval('see t2').output
+        self.assertIn('BRANCHY\n', see)
+        self.assertIn('RS\n', see)
+
+    def test_output_sink(self):
+        class Stream(StringIO):
+            writes = 0
+            def write(self, s):
+                Stream.writes += 1
+                return super().write(s)
+
+        out = Stream()
+        vm = t4th.T4th(output=out)
+        vm._load_core_fs()
+        script = ': t 300 0 do [char] a emit s" bc" type i . loop cr ; t\n'
+        self.assertNotIn('abc', self._interpret(vm, script))
+        self.assertEqual(out.getvalue().count('abc'), 300)
+        self.assertEqual(Stream.writes, 1)
+
+        # 按行写出、超过缓冲大小写出
+        sink = t4th.OutputSink(out, buffer_size=4, line_buffered=True)
+        sink.write('x\n')
+        self.assertTrue(out.getvalue().endswith('x\n'))
+        sink.write('yy')
+        self.assertFalse(out.getvalue().endswith('yy'))
+        sink.write('zz')
+        self.assertTrue(out.getvalue().endswith('yyzz'))
+
+    def test_tokenizer(self):
+        vm = self._booted_vm()
+        script = textwrap.dedent("""
+            :   spaced	  1   2 +  ;   spaced .
+            variable n 0 n !
+            : again? 1 n +! n @ 3 < if 0 >in ! then ; again? n @ .
+            : rest source nip >in ! ; rest 99 .
+            >in @ . char x  >in @ . bl word  abc  count type ( comment ) char ) parse  p1 ) type
+            s" 5 6 *" evaluate . s" 5 6 +" evaluate .
+        """)
+        output = self._interpret(vm, script)
+        self.assertNotIn('Error', output)
+        self.assertIn(' ok\n3  ok\n ok\n3  ok\n ok\n6 22 abc p1  ok\n30 11  ok', output)
+
+    def test_profiler(self):
+        vm = self._booted_vm()
+        script = textwrap.dedent("""
+            : fib dup 2 < if drop 1 else dup 1- recurse swap 2 - recurse + then ;
+            : go 10 fib . ;
+            .profile profile-on go profile-off
+            1 fib drop
+        """)
+        output = self._interpret(vm, script)
+        self.assertIn('No profile', output)
+        self.assertIn('89  ok', output)
+
+        report = vm.profile_report()
+        self.assertIsInstance(report, t4th.ProfileReport)
+        self.assertEqual(report['go'].calls, 1)
+        self.assertEqual(report['fib'].calls, 177)
+        self.assertEqual(report['<'].calls, 177)
+        self.assertEqual(report['.'].calls, 1)
+        # 递归调用只算一次包含时间
+        self.assertLessEqual(report['fib'].inclusive_time, report['go'].inclusive_time)
+        self.assertLessEqual(report['go'].self_time, report['go'].inclusive_time)
+
+        output = self._interpret(vm, '.profile\n')
+        self.assertRegex(output, r'WORD +CALLS +SELF ms +INCL ms\n')
+        self.assertRegex(output, r'\nFIB +177 ')
+
+        # 出错时丢掉没有结束的调用，之后的统计照常
+        vm.profile_start()
+        self.assertIn('Error', self._interpret(vm, ': bad 1 0 / ; bad\n'))
+        self._interpret(vm, 'go\n')
+        report = vm.profile_stop()
+        self.assertNotIn('BAD', [e.name for e in report])
+        self.assertEqual(report['fib'].calls, 177)
+        self.assertEqual(vm._profiler, None)
+
+    def test_sampler(self):
+        vm = self._booted_vm()
+
+        # 在DEPTH中取样，检查还原出的调用栈
+        snapshots = []
+        depth = vm._find_word('depth').ptr
+        depth_code = vm._memory[depth]
+        def sample():
+            snapshots.append(vm._sample_snapshot())
+            depth_code()
+        vm._memory[depth] = t4th.T4th._PrimitiveWord('DEPTH', sample)
+
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'inc.fs')
+            with open(filename, 'w') as f:
+                f.write(': in-file depth drop ;\nin-file\n')
+            script = textwrap.dedent(f"""
+                : leaf 7 >r depth drop r> drop ;
+                : mid 3 0 do i 1 = if leaf then loop ;
+                : top 100 mid ;
+                : ev s" mid" evaluate ;
+                : inc s" {filename}" included ;
+                top drop ev inc depth drop
+            """)
+            output = self._interpret(vm, script)
+        self.assertNotIn('Error', output)
+
+        resolve = vm._sample_resolver()
+        self.assertEqual([resolve(s) for s in snapshots], [
+            ('TOP', 'MID', 'LEAF', 'DEPTH'),
+            ('EV', 'EVALUATE', 'MID', 'LEAF', 'DEPTH'),
+            ('INC', 'INCLUDED', 'IN-FILE', 'DEPTH'),
+            ('DEPTH',),
+        ])
+        self.assertEqual(resolve((0, t4th.T4th.MemAddress.EXEC_START.value + 1, (), ())), ('(INTERPRET)',))
+
+        # 后台线程取样
+        vm.sample_start(interval=0.001)
+        self._interpret(vm, ': fib dup 2 < if drop 1 else dup 1- recurse swap 2 - recurse + then ;\n'
+                            ': go 18 fib drop ; go go\n.samples\n')
+        report = vm.sample_stop()
+        self.assertIsNone(vm._sampler)
+        self.assertGreater(len(report), 0)
+        self.assertRegex(report.collapsed(), r'(?m)^GO;FIB(;[^ ]+)* \d+$')
+        self.assertIs(vm.sample_report(), report)
+
+    def test_eval(self):
+        vm = self._booted_vm()
+        with patch('sys.stdout', new=StringIO()) as mock_stdout:
+            self.assertEqual(vm.eval(': sq dup * ;\n3 sq . 4 sq'), t4th.EvalResult('9 ', [16]))
+            self.assertEqual(vm.eval('1 2 +').stack, [16, 3])
+            self.assertEqual(vm.eval('2drop s" 5 6 +" evaluate $7FFFFFFF 1+').stack, [11, -2147483648])
+            self.assertEqual(vm.eval('drop drop').output, '')
+        self.assertEqual(mock_stdout.getvalue(), '')
+
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval('1 2 .s\n: foo 1 2\nnosuch ;')
+        e = cm.exception
+        self.assertEqual((e.message, e.word, e.lineno, e.source), ('Unknown word "nosuch"', 'nosuch', 3, 'nosuch ;'))
+        self.assertEqual((e.output, e.stack), ('<2> 1 2 ', [1, 2]))
+        # 没定义完的词被丢弃，数据栈被清空
+        self.assertIsNone(vm._find_word_or_none('foo'))
+        self.assertEqual(vm.eval('depth').stack, [0])
+
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval(': div / ; s" 1 0 div" evaluate')
+        self.assertEqual((cm.exception.word, cm.exception.source), ('div', '1 0 div'))
+        self.assertIsInstance(cm.exception.__cause__, ValueError)
+        self.assertEqual(vm._return_stack, [])
+        self.assertEqual(vm.eval('7 .').output, '7 ')
+
+        # BYE停止这次eval，之后的eval照常执行
+        self.assertEqual(vm.eval('1 bye 2'), t4th.EvalResult('\n', [1], True))
+        self.assertEqual(vm.eval('3 .'), t4th.EvalResult('3 ', [1]))
+        vm.start('drop bye 4')
+        self.assertEqual(vm.step(10), t4th.EvalResult('\n', [], True))
+        self.assertEqual(vm.eval('5').stack, [5])
+
+    def test_step(self):
+        vm = self._booted_vm()
+        source = ': sum 0 swap 0 do i + loop ; 100 sum . s" 30 sum ." evaluate\n: later 5 sum ; later 7'
+        expected = vm.eval(source)
+        vm.eval('2drop forget sum')
+
+        # 挂起时pc和返回栈不变，再调用step()继续
+        vm.start(source)
+        results = [vm.step(20)]
+        self.assertIsNone(results[0])
+        self.assertNotEqual(vm._return_stack, [])
+        with self.assertRaises(RuntimeError):
+            vm.eval('1')
+        while results[-1] is None:
+            results.append(vm.step(20))
+        self.assertEqual(results[-1], expected)
+        self.assertGreater(len(results), 10)
+        self.assertIsNone(vm._run)
+
+        # 多个VM轮流执行
+        vms = [vm.clone() for _ in range(3)]
+        for (i, v) in enumerate(vms):
+            v.start(f': f 3 0 do {i} . loop ; f')
+        order = []
+        done = [None] * len(vms)
+        while not all(done):
+            for (i, v) in enumerate(vms):
+                if not done[i]:
+                    done[i] = v.step(4)
+                    order.append(i)
+        self.assertEqual([r.output for r in done], ['0 0 0 ', '1 1 1 ', '2 2 2 '])
+        self.assertEqual(order[:6], [0, 1, 2, 0, 1, 2])
+
+    def test_define_primitive(self):
+        # 结果的检查在TestOptions中。加载core.fs之前定义的词会在加载镜像时丢失，所以不允许
+        with self.assertRaises(RuntimeError):
+            t4th.T4th().define_primitive('hyp', lambda a, b: 0, stack_in=2, stack_out=1)
+
     def test_boot_and_bye(self):
         scripts = """
             bye ==>
@@ -122,6 +521,19 @@ class TestT4th(unittest.TestCase):
 
         self._run_scripts(scripts)
 
+    def test_redefinition_and_forget(self):
+        scripts = """
+            : foo 1 ;               ==>  ok
+            : foo foo 2 ;           ==>  ok
+            foo .S                  ==> <2> 1 2  ok
+            forget foo              ==>  ok
+            foo .S                  ==> <3> 1 2 1  ok
+            forget foo              ==>  ok
+            foo                     ==>
+                                    ==> Error: Unknown word "foo"
+        """
+        self._run_scripts(scripts)
+
     def test_input_tab_char(self):
         scripts = """
             123\t456\t.S ==> <2> 123 456  ok
@@ -169,6 +581,103 @@ class TestT4th(unittest.TestCase):
         """
         self._run_scripts(scripts)
 
+    def test_bulk_memory(self):
+        vm = self._booted_vm()
+        # 逐个字符复制的参考实现
+        vm.eval("""
+            : cmove-ref ( a1 a2 u -- ) 0 ?do over i + c@ over i + c! loop 2drop ;
+            : cmove>-ref ( a1 a2 u -- ) begin dup while 1- >r over r@ + c@ over r@ + c! r> repeat drop 2drop ;
+            : move-ref ( a1 a2 u -- ) >r 2dup u< if r> cmove>-ref else r> cmove-ref then ;
+            create buf 64 allot
+        """)
+        buf = vm.eval('buf').stack.pop()
+        vm.eval('drop')
+        for word in ('cmove', 'cmove>', 'move'):
+            for (src, dst, n) in ((0, 20, 10), (0, 3, 20), (5, 2, 20), (10, 10, 8), (0, 7, 30), (30, 4, 29), (3, 0, 0)):
+                results = []
+                for w in (word, word + '-ref'):
+                    vm._memory.set_range(buf, list(range(100, 164)))
+                    vm.eval(f'buf {src} + buf {dst} + {n} {w}')
+                    results.append(vm._memory.get_range(buf, buf + 64))
+                self.assertEqual(results[0], results[1], (word, src, dst, n))
+
+        self.assertEqual(vm.eval('buf 64 erase buf 5 char x fill buf 2 + 2 erase buf 4 + 3 blank buf 8 type').output, 'xx\0\0   \0')
+        self.assertEqual(vm.eval('buf 0 char y fill buf -1 erase buf c@').stack, [ord('x')])
+
+        # 复制词头等对象
+        vm.eval("' dup 1- buf 2 move")
+        self.assertIs(vm._memory[buf], vm._memory[vm._find_word('dup').ptr - 1])
+        vm.eval('buf 2 erase')
+        self.assertEqual(vm._memory.get_range(buf, buf + 2), [0, 0])
+
+        vm.eval('drop')
+        self.assertEqual(vm.eval('s" abc" s>here s" abd" compare s" ab" s>here s" a" compare s" " s>here s" " compare').stack,
+                         [-1, 1, 0])
+        for script in ('buf -1 10 move', '0 buf 1000000 cmove', '-5 3 char a fill', 'buf 1000000 erase',
+                       's" abc" -1 10 compare'):
+            with self.assertRaises(t4th.ForthError) as cm:
+                vm.eval(script)
+            self.assertIn('Invalid address range', cm.exception.message)
+
+        # 负数地址和越界的地址一样出错，不从内存末尾数
+        for script in ('-1 @', '5 -1 !', '-1 c@', '5 -1 +!', '100000000 @', '-2 3 type'):
+            with self.assertRaises(t4th.ForthError) as cm:
+                vm.eval(script)
+            self.assertIn('index out of range', cm.exception.message)
+        self.assertEqual(vm._memory[len(vm._memory) - 1], 0)
+
+    def test_loop_stack(self):
+        vm = self._booted_vm()
+        # 循环参数不在返回栈上，>R之后I、J不变
+        self.assertEqual(vm.eval(': ij 2 0 do 12 10 do 7 >r i j r> loop loop ; ij').stack,
+                         [10, 0, 7, 11, 0, 7, 10, 1, 7, 11, 1, 7])
+        vm.eval('2drop 2drop 2drop 2drop 2drop 2drop')
+        self.assertEqual(vm._loop_stack, [])
+        self.assertEqual(vm.eval(': find3 10 0 do i 3 = if i unloop exit then loop -1 ; find3').stack, [3])
+        self.assertEqual(vm._loop_stack, [])
+        vm.eval('drop')
+
+        # 编译时执行的立即词中的循环
+        self.assertEqual(vm.eval(': sum-lits 0 4 0 do i + loop postpone literal ; immediate : six sum-lits ; six').stack, [6])
+        vm.eval('drop')
+
+        # 用到I的短定义可以内联，结果和调用一样
+        vm.eval(': i2* i 2* ; : sum-i2* 0 4 0 do i2* + loop ;')
+        self.assertIsNotNone(vm._inline_body(vm._find_word('i2*').ptr))
+        self.assertEqual(vm.eval('sum-i2*').stack, [12])
+        vm.eval('drop')
+
+        # 回绕和越过边界
+        vm.eval(': count-loop 0 -rot do 1+ loop ; : count+loop 0 -rot do 1+ 1073741824 +loop ;')
+        self.assertEqual(vm.eval('2147483647 2147483646 count-loop').stack, [1])
+        self.assertEqual(vm.eval('-2147483647 2147483646 count+loop').stack, [1, 1])
+        self.assertEqual(vm.eval('2147483647 -2147483648 count+loop').stack, [1, 1, 4])
+        vm.eval('drop')
+        vm.eval('2drop')
+
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval(': no-loop i ; no-loop')
+        self.assertIn('Loop stack underflow', cm.exception.message)
+        with self.assertRaises(t4th.ForthError):
+            vm.eval(': div0 3 0 do 3 0 do 1 0 / loop loop ; div0')
+        self.assertEqual(vm._loop_stack, [])
+
+    def test_long_strings(self):
+        vm = self._booted_vm()
+        line = ' '.join(['ab 中文😀'] * 500)
+        result = vm.eval(f'create b 5000 allot b 5000 accept b over type\n{line}\n')
+        self.assertEqual((result.output, result.stack), (line, [len(line)]))
+
+        # EVALUATE一段很长的内存
+        source = ' '.join(f'{i} +' for i in range(2000))
+        addr = vm.eval('drop b').stack[0]
+        vm._memory.set_str(addr, source)
+        self.assertEqual(vm.eval(f'drop 0 b {len(source)} evaluate').stack, [sum(range(2000))])
+
+        vm.eval('drop : 中文 42 ;')
+        self.assertEqual(vm.eval('c" 中文" find nip c" 中文" count type').output, '中文')
+        self.assertEqual(vm.eval('').stack, [-1])
+
     def test_could_not_find_word(self):
         scripts = "' word-not-exists"
         output_contains = r'Error: Undefined word: `word-not-exists`'
@@ -329,6 +838,80 @@ class TestT4th(unittest.TestCase):
 
         self._run_scripts(scripts)
 
+    def test_checkpoint(self):
+        vm = self._booted_vm()
+        booted = (vm._memory.get_range(0, len(vm._memory)), vm._latest_word_ptr,
+                  {name: list(ptrs) for (name, ptrs) in vm._word_index.items()})
+        def assert_booted():
+            self.assertEqual(vm._memory.get_range(0, len(vm._memory)), booted[0])
+            self.assertEqual((vm._latest_word_ptr, vm._word_index), booted[1:])
+            self.assertEqual(vm.eval('depth').stack, [0])
+
+        @vm.primitive(stack_in=(memoryview,))
+        def fill_xs(buf):
+            buf[:] = array('i', [ord('x')] * len(buf))
+
+        vm.eval('variable v 5 v ! : dup 1 ; immediate hex 100 allot here 10 fill-xs 1 2 3')
+        vm.eval(': unfinished 1 2')
+        self.assertEqual(vm._memory[vm._find_word_ptr('fill-xs')].word_name, 'FILL-XS')
+        vm.reset(self._checkpoint)
+        assert_booted()
+        self.assertIsNone(vm._find_word_or_none('v'))
+        self.assertFalse(vm._find_word('dup').is_immediate())
+        self.assertEqual(vm.eval('7 dup + .').output, '14 ')
+
+        # 检查点之前的词被FORGET过
+        vm.eval(': later 42 ;')
+        later = vm.checkpoint()
+        vm.eval('forget later : a 1 ; : b 2 ;')
+        self.assertIsNone(vm._find_word_or_none('later'))
+        vm.reset(later)
+        self.assertEqual(vm.eval('later').stack, [42])
+        self.assertIsNone(vm._find_word_or_none('a'))
+
+        # 恢复更早的检查点时复制整个内存
+        vm.eval(': more later ; 1 more')
+        vm.reset(self._checkpoint)
+        assert_booted()
+        vm.reset(later)
+        self.assertEqual(vm.eval('later').stack, [42])
+        self.assertIsNone(vm._find_word_or_none('more'))
+        vm.reset(self._checkpoint)
+        assert_booted()
+
+    def test_base_per_instance(self):
+        # 多个T4th在不同线程中用不同的BASE同时执行，互不影响
+        template = self._booted_vm()
+        template.eval('decimal 123456789 constant n')
+        vms = [template.clone() for _ in range(32)]
+        errors = []
+
+        def run(vm, base):
+            try:
+                vm.eval(f'decimal {base} base !')
+                digits = tn.int_to_base(123456789, base)
+                for i in range(30):
+                    self.assertEqual(vm.eval('n .').output, f'{digits} ')
+                    self.assertEqual(vm.eval(f'{digits} 0 0 s" {digits}" >number 2drop drop').stack,
+                                     [123456789, 123456789])
+                    self.assertEqual(vm.eval(f'-{tn.int_to_base(i + 1, base)} .s 2drop drop').output,
+                                     f'<3> {digits} {digits} -{tn.int_to_base(i + 1, base)} ')
+            except Exception as e:
+                errors.append((base, e))
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+        try:
+            threads = [threading.Thread(target=run, args=(vm, 2 + i % 35)) for (i, vm) in enumerate(vms)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(template.eval('n .').output, '123456789 ')
+
     def test_tick(self):
         "F.6.1.0070"
         scripts = """
@@ -509,3 +1092,259 @@ class TestT4th(unittest.TestCase):
         """
 
         self._run_scripts(scripts)
+
+# 在每种选项下执行同样的脚本，结果应该相同。子类换选项，和test_standard.py一样
+class TestOptions(_T4thTestCase):
+    def test_accelerated_core(self):
+        scripts = """
+            1 2 3 rot .s -rot .s                                ==> <3> 2 3 1 <3> 1 2 3  ok
+            nip .s 5 tuck .s 2drop 2drop                        ==> <2> 1 3 <4> 1 5 3 5  ok
+            1 2 2dup .s 3 4 2over .s                            ==> <4> 1 2 1 2 <8> 1 2 1 2 3 4 1 2  ok
+            2swap .s 2drop 2drop 2drop 2drop                    ==> <8> 1 2 1 2 1 2 3 4  ok
+            $7FFFFFFF 1+ . $80000000 1- . $80000000 negate .    ==> -2147483648 2147483647 -2147483648  ok
+            -5 abs . $80000000 abs .                            ==> 5 -2147483648  ok
+            1 2 = . 2 2 = . 1 2 <> . 2 1 > .                    ==> 0 -1 -1 -1  ok
+            -1 1 > . -1 1 U> . 1 -1 U> .                        ==> 0 -1 0  ok
+            -3 4 min . -3 4 max . $80000000 $7FFFFFFF max .     ==> -3 4 2147483647  ok
+            variable v 5 v ! 3 v +! v @ .                       ==> 8  ok
+            7 v c! v c@ . v cell+ v - .                         ==> 7 1  ok
+            c" abc" count . c@ .                                ==> 3 97  ok
+            [defined] rot . [undefined] rot .                   ==> -1 0  ok
+            [defined] no-such-word . [undefined] no-such-word . ==> 0 -1  ok
+            1 [if] 11 [else] 22 [then] .                        ==> 11  ok
+            0 [if] 11 [else] 22 [then] . depth .                ==> 22 0  ok
+        """
+
+        self._run_scripts(scripts)
+
+    def test_peephole(self):
+        scripts = """
+            : t1 5 + 3 - 7 = ;                                        ==>  ok
+            : t2 dup 0= if drop 100 then ;                            ==>  ok
+            : t3 case 1 of 10 endof 1 1+ of 20 endof 0 swap endcase ; ==>  ok
+            : t4 >r 1 r> drop ;                                       ==>  ok
+            : t5 begin dup while 1- repeat ;                          ==>  ok
+            : t6 10 0 do i 5 = if i leave then loop ;                 ==>  ok
+            5 t1 . 0 t2 . 7 t2 .                                      ==> -1 100 7  ok
+            1 t3 . 2 t3 . 3 t3 .                                      ==> 10 20 0  ok
+            9 t4 . 3 t5 . t6 .                                        ==> 1 0 5  ok
+            : + - ; : t7 5 + ; 10 t7 .                                ==> 5  ok
+        """
+
+        self._run_scripts(scripts)
+
+    def test_inline(self):
+        scripts = """
+            : sq dup * ;                                    ==>  ok
+            : nothing ;                                     ==>  ok
+            : long 1 + 2 * 3 - ; inline                     ==>  ok
+            : long2 1 + 2 * 3 - ;                           ==>  ok
+            : branchy 0< if 1 then ;                        ==>  ok
+            : rs >r r> ;                                    ==>  ok
+            : t1 nothing sq 5 long 1 long2 ;                ==>  ok
+            : t2 -1 branchy 7 rs ;                          ==>  ok
+            3 t1 . . . t2 . .                               ==> 1 9 9 7 1  ok
+            ' sq 4 swap execute . ' nothing execute depth . ==> 16 0  ok
+        """
+
+        self._run_scripts(scripts)
+
+    def test_defining_words(self):
+        scripts = """
+            7 constant seven  variable v  3 value x  1 2 2constant pair             ==>  ok
+            defer greet  : hello ." hello" ;  : bye ." bye" ;                       ==>  ok
+            : show seven . v @ . x . pair . . ;                                     ==>  ok
+            show 9 v ! 5 to x show                                                  ==> 7 0 3 2 1 7 9 5 2 1  ok
+            : set-x to x ; 11 set-x x . ' x >body @ .                               ==> 11 11  ok
+            42 ' seven >body ! seven .                                              ==> 42  ok
+            ' hello is greet greet space action-of greet ' hello = .                ==> hello -1  ok
+            : rebind ['] bye is greet ; rebind greet space ' greet defer@ ' bye = . ==> bye -1  ok
+            ' hello ' greet defer! greet space ' pair >body 2@ . .                  ==> hello 2 1  ok
+            defer d d                                                               ==>
+                                                                                    ==> Error: Aborted
+            1 2 2constant p p . .                                                   ==> 2 1  ok
+        """
+
+        self._run_scripts(scripts)
+
+    def test_case_table(self):
+        scripts = """
+            : c1 case 1 of 10 endof -5 of 20 endof 1 of 30 endof                 ==>  compiled
+            7 of 0 endof dup 100 * swap endcase ;                                ==>  ok
+            : c2 case 3 of case 1 of 31 endof 2 of 32 endof 0 swap endcase endof ==>  compiled
+            4 of 1 2 3 + + endof 99 swap endcase ;                               ==>  ok
+            : c3 case 0 of 100 exit endof 2 of 7 endof 0 swap endcase 5 + ;      ==>  ok
+            : c4 case dup 1 and 0= of 200 endof 3 of 300 endof 0 swap endcase ;  ==>  ok
+            : c5 case endcase ;                                                  ==>  ok
+            : t1 do i c1 . loop ; 2 -6 t1                                        ==> -600 20 -400 -300 -200 -100 0 10  ok
+            10 2 t1                                                              ==> 200 300 400 500 600 0 800 900  ok
+            1 3 c2 . 2 3 c2 . 5 3 c2 . 4 c2 . 9 c2 .                             ==> 31 32 0 6 99  ok
+            : t3 3 0 do i c3 . loop 5 1 do i c4 . loop ; t3                      ==> 100 5 12 0 0 300 0  ok
+            8 c5 depth .                                                         ==> 0  ok
+        """
+
+        self._run_scripts(scripts)
+
+    def test_case_table_clone(self):
+        # 镜像中的跳转表
+        vm = self._booted_vm()
+        vm.eval(': c1 case 1 of 10 endof -5 of 20 endof 7 of 0 endof dup 100 * swap endcase ; : t1 do i c1 . loop ;')
+        self.assertEqual(vm.clone().eval('10 -6 t1').output, vm.eval('10 -6 t1').output)
+
+    def test_case_with_redefined_words(self):
+        scripts = """
+            : = 2drop 0 ;                                         ==>  ok
+            : drop ." D" ;                                        ==>  ok
+            : t case dup of 11 endof 99 swap endcase ;            ==>  ok
+            5 t .                                                 ==> 11  ok
+            : u case 1 of 10 endof 2 of 20 endof 0 swap endcase ; ==>  ok
+            2 u . 3 u .                                           ==> 20 0  ok
+        """
+
+        self._run_scripts(scripts)
+
+    def test_compile_closures(self):
+        scripts = """
+            : sq dup * ;                                                          ==>  ok
+            : sum-sq 0 swap 0 ?do i sq + loop ;                                   ==>  ok
+            : find-5 10 0 do i 5 = if i leave then loop ;                         ==>  ok
+            : down 0 10 do i -3 +loop ;                                           ==>  ok
+            : fib dup 2 < if drop 1 else dup 1- recurse swap 2 - recurse + then ; ==>  ok
+            : const create , does> @ 1+ ;                                         ==>  ok
+            : run-xt ['] sq execute ;                                             ==>  ok
+            : comp, postpone sq ; immediate                                       ==>  ok
+            : uses-comp 3 comp, ;                                                 ==>  ok
+            41 const k                                                            ==>  ok
+            10 sum-sq . find-5 . down .s 2drop 2drop                              ==> 285 5 <4> 10 7 4 1  ok
+            20 fib . k . 7 run-xt . uses-comp .                                   ==> 10946 42 49 9  ok
+            ' sq 5 swap execute . 0 sum-sq .                                      ==> 25 0  ok
+        """
+
+        self._run_scripts(scripts)
+
+    # 编译成闭包时，超过_MAX_BLOCK条指令的定义要在块之间分派
+    _dispatch_words = ('chains', 'big', 'two-entries', 'cases', 'early')
+
+    def _define_dispatch_words(self, vm):
+        padding = '\n'.join([' 1+ 1-' * 10] * 4)
+        chain = '\n'.join(f'dup {k} = if drop {k * k} else' for k in range(7))
+        vm.eval(textwrap.dedent(f"""
+            : chain ( n -- m ) {chain} 1- {' then' * 7} ;
+            : chains 0 10 0 do i chain + loop ;
+            : big 0 30 0 do i 3 mod 0= if 1+ then {padding} i 2 mod if 10 + else {padding} 100 + then loop ;
+            : two-entries ( n -- m ) dup 0< if negate begin 1- dup 5 < until else begin 2 - dup 5 < until then ;
+            : cases 0 8 0 do i case 1 of 10 endof 3 of 30 endof 5 of 50 endof dup 7 + swap endcase + loop ;
+            : early 0 20 0 do 10 0 do i j + 12 > if unloop unloop exit then 1+ loop loop ;
+        """))
+
+    def test_compile_closures_dispatch(self):
+        vm = self._booted_vm()
+        self._define_dispatch_words(vm)
+        self.assertEqual(vm.eval('chains . big . 20 two-entries . -20 two-entries . cases . early .').output,
+                         '112 1660 4 4 144 49 ')
+
+    def test_define_primitive(self):
+        vm = self._booted_vm()
+        vm.define_primitive('hyp', lambda a, b: int((a * a + b * b) ** 0.5), stack_in=2, stack_out=1)
+        vm.define_primitive('big?', lambda n: n > 100, stack_in=1, stack_out=1)
+
+        @vm.primitive(stack_in=(str,), stack_out=1)
+        def vowels(s):
+            return sum(c in 'aeiou' for c in s)
+
+        @vm.primitive(stack_in=(memoryview, int))
+        def fill_up(buf, c):
+            for i in range(len(buf)):
+                buf[i] = c + i
+
+        @vm.primitive(name='/mod-py', stack_in=2, stack_out=2)
+        def divmod_(a, b):
+            return (a % b, a // b)
+
+        vm.define_primitive('2^31', lambda: 2 ** 31, stack_out=1)
+        calls = []
+        vm.define_primitive('[log]', lambda: calls.append(1), immediate=True)
+
+        result = vm.eval(textwrap.dedent("""
+            3 4 hyp . 1000 big? . 7 big? . s" education" vowels .
+            create buf 5 allot buf 5 char a fill-up buf 5 type
+            17 5 /mod-py . . 2^31
+            : t [log] 3 4 hyp s" hello" vowels + ; t
+        """))
+        self.assertEqual(result, t4th.EvalResult('5 -1 0 5 abcde3 2 ', [-2147483648, 7]))
+        self.assertEqual(calls, [1])
+
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval('2drop 1 hyp')
+        self.assertIn('Stack underflow', cm.exception.message)
+        with self.assertRaises(t4th.ForthError):
+            vm.eval('-1 5 vowels')
+
+        # 副本中的Python词调用同一个函数
+        clone = vm.clone()
+        self.assertEqual(clone.eval('3 4 hyp : t2 [log] 1000 big? ; t2').stack, [5, -1])
+        self.assertEqual(calls, [1, 1])
+
+    def test_budget(self):
+        # 编译成闭包的词在数步数时按线索代码执行，预算同样有效，也能在其中挂起
+        vm = self._booted_vm()
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval(': forever begin again ; 1 forever', budget=1000)
+        self.assertEqual((cm.exception.message, cm.exception.word), ('Budget exhausted', 'forever'))
+        self.assertEqual((vm._return_stack, vm.eval('depth', budget=10).stack), ([], [0]))
+        with self.assertRaises(t4th.ForthError) as cm:
+            vm.eval('s" forever" evaluate', budget=1000)
+        self.assertEqual(cm.exception.message, 'Budget exhausted')
+        vm.start('1 2 forever', budget=500)
+        with self.assertRaises(t4th.ForthError):
+            while vm.step(30) is None:
+                pass
+        self.assertIsNone(vm._run)
+        self.assertEqual(vm.eval('3 4 +').stack, [7])
+
+        vm.eval('drop : upto5 5 0 do i loop ; : ten create 10 , does> @ 1+ ; ten x')
+        vm.start('upto5 x')
+        results = [vm.step(3)]
+        while results[-1] is None:
+            results.append(vm.step(3))
+        self.assertEqual(results[-1].stack, [0, 1, 2, 3, 4, 11])
+        self.assertGreater(len(results), 5)
+        self.assertEqual(vm.eval('2drop 2drop 2drop upto5 x').stack, [0, 1, 2, 3, 4, 11])
+
+class TestOptionsCompiled(TestOptions):
+    options = {'compile_closures': True}
+
+    def test_compiled_words(self):
+        vm = self._booted_vm()
+        self._define_dispatch_words(vm)
+        vm.eval(': fib dup 2 < if drop 1 else dup 1- recurse swap 2 - recurse + then ; : loop1 0 100 0 do i + loop ;')
+        vm.eval(': forever begin again ;')
+        for name in self._dispatch_words + ('fib', 'loop1', 'forever'):
+            self.assertIsInstance(vm._memory[vm._find_word(name).ptr], t4th.T4th._CompiledWord)
+
+        # IF ... ELSE ... THEN不用块函数，循环体是一个块函数，在其中循环
+        for (name, blocks) in (('fib', 0), ('loop1', 1)):
+            start = vm._find_word(name).ptr + 1
+            (source, _) = compiler._generate(vm, start, compiler.decode(vm, start))
+            self.assertEqual(source.count('    def b'), blocks, source)
+
+class TestOptionsForthCore(TestOptions):
+    options = {'accelerated_core': False}
+
+    def test_forth_core(self):
+        vm = self._booted_vm()
+        self.assertEqual(vm._memory[vm._find_word('rot').ptr].name, 'DOCOL')
+
+class TestOptionsNoPeephole(TestOptions):
+    options = {'peephole': False}
+
+    def test_no_peephole(self):
+        vm = self._booted_vm()
+        self.assertNotIn('(RDROP)', vm.eval(': t4 >r 1 r> drop ; see t4').output)
+
+class TestOptionsNoInline(TestOptions):
+    options = {'inline_threshold': None}
+
+    def test_no_inline(self):
+        vm = self._booted_vm()
+        self.assertIn('SQ\n', vm.eval(': sq dup * ; : t1 sq ; see t1').output)
@@ -1,20 +1,229 @@
+import itertools
 import unittest
+from ctypes import c_int32, c_uint32, c_int64
 import t4th.t4th_num as t4n
 
+# 原来基于ctypes的实现，作为对照
+class _Ref:
+    int_mask = 0xFFFFFFFF
+
+    @staticmethod
+    def i(n):
+        return c_int32(n).value
+
+    @staticmethod
+    def i2u(n):
+        return c_uint32(n).value
+
+    @staticmethod
+    def i2d(n):
+        d = c_int64(n).value
+        return (d & _Ref.int_mask, d >> 32)
+
+    @staticmethod
+    def ud2i(u1, u2):
+        return c_uint32(u1).value + (c_uint32(u2).value << 32)
+
+    @staticmethod
+    def um_mod(u1, ud1, ud2):
+        u1 = c_uint32(u1).value
+        ud = c_uint32(ud1).value + (c_uint32(ud2).value << 32)
+        return (c_int32(ud % u1).value, c_int32(ud // u1).value)
+
+    @staticmethod
+    def um_star(u1, u2):
+        ud = c_uint32(u1).value * c_uint32(u2).value
+        return (c_int32(ud & _Ref.int_mask).value, c_int32((ud >> 32) & _Ref.int_mask).value)
+
+    @staticmethod
+    def fm_mod(n1, d1, d2):
+        n1 = c_int32(n1).value
+        d = c_int64(c_uint32(d1).value + (c_uint32(d2).value << 32)).value
+        return (c_int32(d % n1).value, c_int32(d // n1).value)
+
+    @staticmethod
+    def sm_rem(n1, d1, d2):
+        n1 = c_int32(n1).value
+        d = c_int64((c_int32(d1).value & _Ref.int_mask) + (c_int32(d2).value << 32)).value
+        # 原来用的是int(d / n1)，在64位被除数上会有浮点误差，这里用精确的向零取整
+        q = abs(d) // abs(n1) * (1 if (d < 0) == (n1 < 0) else -1)
+        r = d - q * n1
+        return (c_int32(r).value, c_int32(q).value)
+
+    @staticmethod
+    def m_star(n1, n2):
+        d = c_int32(n1).value * c_int32(n2).value
+        return (c_int32(d & _Ref.int_mask).value, c_int32((d >> 32) & _Ref.int_mask).value)
+
+
+_EDGES = [
+    0, 1, -1, 2, -2, 3, 7, -7, 10, 255, 256, 65535, 65536, -65536,
+    0x7FFFFFFE, 0x7FFFFFFF, 0x80000000, 0x80000001, -0x7FFFFFFF, -0x80000000,
+    0xFFFFFFFE, 0xFFFFFFFF, 0x100000000, 0x1FFFFFFFF, -0x100000000,
+    0x7FFFFFFFFFFFFFFF, -0x8000000000000000, 0xFFFFFFFFFFFFFFFF, 0x123456789ABCDEF,
+]
+
 class TestT4thNum(unittest.TestCase):
     def test_int_to_base_fail(self):
-        t4n.base = lambda : 37
         with self.assertRaises(ValueError):
-            t4n.int_to_base(123)
+            t4n.int_to_base(123, 37)
+
+    def test_int_to_base(self):
+        self.assertEqual(t4n.int_to_base(42), '42')
+        self.assertEqual(t4n.int_to_base(42, 16), '2A')
+        self.assertEqual(t4n.int_to_base(-5, 2), '-101')
+        self.assertEqual(t4n.int_to_base(0, 36), '0')
 
     def test_i_repr(self):
-        i = t4n.I(42)
-        t4n.base = lambda :10
-        self.assertEqual(f'{i}', '42')
-        t4n.base = lambda :16
-        self.assertEqual(f'{i}', '2A')
+        self.assertEqual(f'{t4n.I(42)}', '42')
 
     def test_ch_to_int_fail(self):
-        t4n.base = lambda : 37
         with self.assertRaises(ValueError):
-            t4n.ch_to_int('0')
+            t4n.ch_to_int('0', 37)
+
+    def test_ch_to_int(self):
+        self.assertEqual(t4n.ch_to_int('9'), 9)
+        self.assertEqual(t4n.ch_to_int('A'), -1)
+        self.assertEqual(t4n.ch_to_int('A', 16), 10)
+        self.assertEqual(t4n.ch_to_int('G', 16), -1)
+
+    def test_conversions(self):
+        for n in _EDGES:
+            with self.subTest(n=n):
+                self.assertEqual(t4n.wrap(n), _Ref.i(n))
+                self.assertEqual(t4n.I(n).value, _Ref.i(n))
+                self.assertEqual(t4n.i2u(n), _Ref.i2u(n))
+                self.assertEqual(t4n.i2d(n), _Ref.i2d(n))
+                self.assertEqual(t4n.I(n).invert().value, _Ref.i(~_Ref.i(n)))
+
+        for (a, b) in itertools.product(_EDGES, repeat=2):
+            with self.subTest(a=a, b=b):
+                self.assertEqual(t4n.ud2i(a, b), _Ref.ud2i(a, b))
+
+    def test_arithmetic(self):
+        for (a, b) in itertools.product(_EDGES, repeat=2):
+            with self.subTest(a=a, b=b):
+                ia = t4n.I(a)
+                ra = _Ref.i(a)
+                rb = _Ref.i(b)
+                self.assertEqual((ia + b).value, _Ref.i((ra & 0xFFFFFFFF) + (rb & 0xFFFFFFFF)))
+                self.assertEqual((ia - b).value, _Ref.i((ra & 0xFFFFFFFF) - (rb & 0xFFFFFFFF)))
+                self.assertEqual((ia * b).value, _Ref.i((ra & 0xFFFFFFFF) * (rb & 0xFFFFFFFF)))
+                self.assertEqual([x.value for x in ia.um_star(b)], list(_Ref.um_star(a, b)))
+                self.assertEqual([x.value for x in ia.m_star(b)], list(_Ref.m_star(a, b)))
+
+        for (a, n) in itertools.product(_EDGES, range(0, 65)):
+            with self.subTest(a=a, n=n):
+                ra = _Ref.i(a) & 0xFFFFFFFF
+                self.assertEqual(t4n.I(a).rshift(n).value, _Ref.i(ra >> n))
+                self.assertEqual(t4n.I(a).lshift(n).value, _Ref.i((ra << n) & 0xFFFFFFFF))
+
+    def test_division(self):
+        for (n1, d1, d2) in itertools.product(_EDGES, repeat=3):
+            if _Ref.i(n1) == 0:
+                continue
+            with self.subTest(n1=n1, d1=d1, d2=d2):
+                i = t4n.I(n1)
+                self.assertEqual([x.value for x in i.um_mod(d1, d2)], list(_Ref.um_mod(n1, d1, d2)))
+                self.assertEqual([x.value for x in i.fm_mod(d1, d2)], list(_Ref.fm_mod(n1, d1, d2)))
+                self.assertEqual([x.value for x in i.sm_rem(d1, d2)], list(_Ref.sm_rem(n1, d1, d2)))
+
+    def test_sm_rem_exact(self):
+        # 商在单元范围内，但int(d / n1)会因为浮点舍入多算1
+        n1 = 0x7FFFFFFF
+        d = n1 * 0x7FFFFFFE + (n1 - 1)
+        (d1, d2) = t4n.i2d(d)
+        (r, q) = t4n.I(n1).sm_rem(d1, d2)
+        self.assertEqual((r.value, q.value), (n1 - 1, 0x7FFFFFFE))
+
+    def test_stack_memory_wraps(self):
+        m = t4n.memory()
+        m.append(0xFFFFFFFF)
+        m.append(t4n.I(5))
+        m.append(('not', 'a', 'number'))
+        self.assertEqual(list(m), [-1, 5, ('not', 'a', 'number')])
+        m[0] = 0x80000000
+        self.assertEqual(m[0], -0x80000000)
+        self.assertEqual(m.pop(), ('not', 'a', 'number'))
+
+    def test_cell_memory(self):
+        m = t4n.cell_memory(16)
+        self.assertEqual(len(m), 16)
+        self.assertEqual(m[3], 0)
+
+        m[3] = -5
+        self.assertEqual(m[3], -5)
+        m[4] = 0xFFFFFFFF # 按32位回绕
+        self.assertEqual(m[4], -1)
+        m[5] = t4n.I(7)
+        self.assertEqual(m[5], 7)
+
+        code = object()
+        m[6] = code
+        self.assertIs(m[6], code)
+        self.assertEqual(m.get_range(3, 8), [-5, -1, 7, code, 0])
+        m[6] = 1 # 整数覆盖对象
+        self.assertEqual(m[6], 1)
+        self.assertEqual(m.objects, {})
+
+        m.set_range(10, [1, 2, code])
+        self.assertEqual(m.get_range(10, 13), [1, 2, code])
+
+        with self.assertRaises(IndexError):
+            m[16] = 1
+        with self.assertRaises(IndexError):
+            m[16] = code
+        with self.assertRaises(IndexError):
+            m[16]
+        # 负数地址不从末尾数
+        with self.assertRaises(IndexError):
+            m[-1]
+        with self.assertRaises(IndexError):
+            m[-1] = 1
+        with self.assertRaises(IndexError):
+            m[-1] = code
+        with self.assertRaises(IndexError):
+            m.get_range(-2, 1)
+        with self.assertRaises(IndexError):
+            m.set_range(-1, [1, 2])
+        self.assertEqual(m.get_range(15, 16), [0])
+
+    def test_cell_memory_restore_pages(self):
+        # restore()只写回写过的页，页的大小由PAGE_SHIFT决定
+        class SmallPages(t4n.cell_memory):
+            PAGE_SHIFT = 2
+
+        m = SmallPages(16)
+        m[1] = 9
+        snap = m.snapshot()
+        code = object()
+        m[5] = 1
+        m[14] = code
+        self.assertEqual(m.dirty, {1, 3})
+        m.restore(snap)
+        self.assertEqual(m.get_range(0, 16), [0, 9] + [0] * 14)
+        self.assertEqual((m.objects, m.dirty), ({}, set()))
+
+    def test_cell_memory_str(self):
+        m = t4n.cell_memory(32)
+        m.set_str(2, 'ab 中文😀')
+        self.assertEqual(m.get_range(2, 9), [97, 98, 32, 0x4E2D, 0x6587, 0x1F600, 0])
+        self.assertEqual(m.get_str(2, 8), 'ab 中文😀')
+        self.assertEqual(m.get_str(5, 5), '')
+
+        # 代理字符逐个转换
+        m.set_str(10, 'x\udcff')
+        self.assertEqual(m.get_range(10, 12), [120, 0xDCFF])
+        self.assertEqual(m.get_str(10, 12), 'x\udcff')
+
+        # 写字符串覆盖对象
+        m[20] = object()
+        m.set_str(19, 'abc')
+        self.assertEqual((m.get_str(19, 22), m.objects), ('abc', {}))
+
+        m[20] = -1
+        with self.assertRaises(ValueError):
+            m.get_str(19, 22)
+        m[20] = object()
+        with self.assertRaises(TypeError):
+            m.get_str(19, 22)